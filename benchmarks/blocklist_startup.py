@@ -0,0 +1,71 @@
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from main import BinaryHostList, HostMatcher, parse_host_entry
+
+SIZES = (10000, 100000, 1000000)
+
+def peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def write_hosts_file(path, count, seed=1):
+    rng = random.Random(seed)
+    words = ["ads", "track", "pixel", "stats", "metrics", "collect", "beacon", "tag", "cdn", "srv"]
+    tlds = ["com", "net", "io", "org", "de", "co.uk", "ru", "info"]
+    with open(path, 'w') as file:
+        file.write("# synthetic hosts blocklist\n127.0.0.1 localhost\n")
+        for n in range(count):
+            file.write(f"0.0.0.0 {rng.choice(words)}{n}.{rng.choice(words)}{n % 5000}.{rng.choice(tlds)}\n")
+
+def child(mode, path):
+    baseline = peak_rss_kb()
+    start = time.perf_counter()
+    if mode == 'text':
+        # What the current in-memory approach costs: every entry parsed into a Python string
+        with open(path, 'r') as file:
+            tracker_list = [host for host in map(parse_host_entry, file) if host]
+        matcher = HostMatcher(tracker_list)
+    else:
+        matcher = BinaryHostList(path)
+    load_time = time.perf_counter() - start
+
+    hosts = [f"www.track{n}.example.com" for n in range(20000)]
+    start = time.perf_counter()
+    for host in hosts:
+        matcher.matches(host)
+    lookup_time = time.perf_counter() - start
+    print(f"{load_time:.6f} {peak_rss_kb() - baseline} {lookup_time / len(hosts) * 1e6:.3f}")
+
+def run_child(mode, path):
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', mode, path],
+                            check=True, capture_output=True, text=True).stdout.split()
+    return float(output[0]), int(output[1]), float(output[2])
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"{'entries':>9} {'format':>7} {'load ms':>10} {'RSS MB':>8} {'lookup us':>10} {'file MB':>8}")
+        for size in SIZES:
+            text_path = os.path.join(directory, f"hosts-{size}.txt")
+            bin_path = os.path.join(directory, f"hosts-{size}.bin")
+            write_hosts_file(text_path, size)
+            BinaryHostList.compile([text_path], bin_path)
+            for mode, path in (('text', text_path), ('binary', bin_path)):
+                load_time, rss_kb, lookup_us = run_child(mode, path)
+                print(f"{size:>9} {mode:>7} {load_time * 1000:>10.1f} {rss_kb / 1024:>8.1f} "
+                      f"{lookup_us:>10.2f} {os.path.getsize(path) / 1048576:>8.1f}")
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == '--child':
+        child(sys.argv[2], sys.argv[3])
+    else:
+        main()
@@ -0,0 +1,85 @@
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt6.QtCore import QCoreApplication, QEventLoop, QTimer
+
+from main import DownloadPostProcessor, DownloadRecord, PersistenceService
+
+FILE_MB = 512
+TICK_MS = 10  # a GUI timer that should keep firing while files are hashed
+
+def write_file(path, megabytes):
+    block = os.urandom(1048576)
+    with open(path, 'wb') as file:
+        for _ in range(megabytes):
+            file.write(block)
+
+def read_hash(path, chunk_size):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        while chunk := file.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def worst_tick_gap(work):
+    # Longest gap between ticks of a TICK_MS timer on this thread while work() runs
+    gaps = []
+    last = [time.perf_counter()]
+    def tick():
+        now = time.perf_counter()
+        gaps.append(now - last[0])
+        last[0] = now
+    timer = QTimer()
+    timer.timeout.connect(tick)
+    timer.start(TICK_MS)
+    start = time.perf_counter()
+    work()
+    elapsed = time.perf_counter() - start
+    timer.stop()
+    tick()
+    return elapsed, max(gaps)
+
+def main():
+    app = QCoreApplication(sys.argv)
+    with tempfile.TemporaryDirectory() as directory:
+        paths = [os.path.join(directory, f"file{n}.bin") for n in range(2)]
+        for path in paths:
+            write_file(path, FILE_MB)
+        persistence = PersistenceService(os.path.join(directory, 'browser_data.json'))
+
+        def on_gui_thread():
+            for path in paths:
+                read_hash(path, 1048576)
+
+        def on_pool(workers):
+            def run():
+                loop = QEventLoop()
+                pending = set(paths)
+                def done(record):
+                    pending.discard(record.path)
+                    if not pending:
+                        loop.quit()
+                processor = DownloadPostProcessor(persistence, os.path.join(directory, f"index{workers}.json"),
+                                                  workers=workers, on_record=done)
+                for path in paths:
+                    processor.submit(DownloadRecord('https://example.com/' + os.path.basename(path), path,
+                                                    time.monotonic()))
+                loop.exec()
+                processor.close()
+            return run
+
+        print(f"{len(paths)} x {FILE_MB} MB files, GUI timer every {TICK_MS} ms")
+        print(f"{'hashing':>22} {'seconds':>8} {'MB/s':>7} {'worst GUI gap ms':>17}")
+        for label, work in (("GUI thread, read()", on_gui_thread), ("pool, 1 worker, mmap", on_pool(1)),
+                            ("pool, 2 workers, mmap", on_pool(2))):
+            elapsed, gap = worst_tick_gap(work)
+            print(f"{label:>22} {elapsed:>8.2f} {len(paths) * FILE_MB / elapsed:>7.0f} {gap * 1000:>17.1f}")
+        persistence.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import gc
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from main import HistoryManager, PersistenceService, UrlClassifier, process_rss
+
+SIZES = (10000, 100000, 1000000)
+PAGE = 100
+
+def build_visits(count, seed=1):
+    rng = random.Random(seed)
+    now = time.time()
+    start = now - 365 * 86400
+    # About one unique URL per three visits, with popular pages revisited most
+    pages = [(f"https://site{n % max(10, count // 200)}.example.com/article/{n}", f"Article {n}")
+             for n in range(max(1, count // 3))]
+    visits = []
+    for n in range(count):
+        url, title = pages[int(len(pages) * rng.random() ** 2)]
+        visits.append((url, title, start + (now - start) * n / count, 'typed' if rng.random() < 0.1 else 'link'))
+    return visits
+
+class StoreOnly(HistoryManager):
+    # Measures the store itself, not the frecency and suggestion index built on top of it
+    def build_suggestion_index(self):
+        pass
+
+def open_store(directory):
+    persistence = PersistenceService(os.path.join(directory, 'browser_data.json'))
+    return StoreOnly(persistence, journal_file=os.path.join(directory, 'journal.jsonl'),
+                     partition_dir=os.path.join(directory, 'history'),
+                     max_age_days=None, max_visits=None, summarize_after_days=None)
+
+def write_fixtures(directory, count):
+    visits = build_visits(count)
+    with open(os.path.join(directory, 'dicts.json'), 'w') as file:
+        json.dump({'history': [{'url': url, 'title': title, 'timestamp': datetime.fromtimestamp(timestamp).isoformat(),
+                                'type': visit_type} for url, title, timestamp, visit_type in visits]}, file)
+    store = open_store(directory)
+    for visit in visits:
+        store.add_visit(*visit)
+    store.save_to_file()
+    store.persistence.close()
+
+def render(items, classifier):
+    return [(classifier.classify(item['url'], item['title'])[1], item['timestamp'][:10]) for item in items]
+
+def render_rows(rows):
+    return [(row.display, row.timestamp[:10]) for row in rows]
+
+def child(mode, directory):
+    classifier = UrlClassifier()
+    gc.collect()
+    baseline = process_rss(os.getpid())
+    start = time.perf_counter()
+    if mode == 'dicts':
+        with open(os.path.join(directory, 'dicts.json'), 'r') as file:
+            items = json.load(file)['history']
+    else:
+        store = open_store(directory)
+    load_time = time.perf_counter() - start
+    gc.collect()
+    rss = process_rss(os.getpid()) - baseline
+
+    start = time.perf_counter()
+    if mode == 'dicts':
+        # What the list-of-dicts store has to do for a page: sort everything, then slice
+        ordered = sorted(items, key=lambda item: item['timestamp'], reverse=True)
+        render(ordered[:PAGE], classifier)
+    else:
+        render_rows(store.get_items(PAGE))
+    first_page = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if mode == 'dicts':
+        ordered = sorted(items, key=lambda item: item['timestamp'], reverse=True)
+        middle = len(ordered) // 2
+        render(ordered[middle:middle + PAGE], classifier)
+    else:
+        render_rows(store.get_items(PAGE, store.visit_total // 2))
+    deep_page = time.perf_counter() - start
+    print(f"{load_time:.6f} {rss} {first_page:.6f} {deep_page:.6f}")
+
+def run_child(mode, directory):
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', mode, directory],
+                            check=True, capture_output=True, text=True).stdout.split()
+    return float(output[-4]), int(output[-3]), float(output[-2]), float(output[-1])
+
+def main():
+    print(f"{'visits':>8} {'store':>8} {'load ms':>10} {'resident MB':>12} {'page ms':>9} {'deep page ms':>13}")
+    for size in SIZES:
+        with tempfile.TemporaryDirectory() as directory:
+            write_fixtures(directory, size)
+            for mode in ('dicts', 'columns'):
+                load_time, rss, first_page, deep_page = run_child(mode, directory)
+                print(f"{size:>8} {mode:>8} {load_time * 1000:>10.1f} {rss / 1048576:>12.1f} "
+                      f"{first_page * 1000:>9.2f} {deep_page * 1000:>13.2f}")
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == '--child':
+        child(sys.argv[2], sys.argv[3])
+    else:
+        main()
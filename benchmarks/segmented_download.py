@@ -0,0 +1,134 @@
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt6.QtCore import QCoreApplication, QEventLoop, QTimer
+from PyQt6.QtNetwork import QNetworkAccessManager
+
+from main import DOWNLOAD_DONE_STATES, DownloadState, SegmentedDownload
+
+FILE_BYTES = 48 * 1048576
+CONNECTION_RATE = 16 * 1048576  # per-connection cap, like a single TCP flow on a long path
+CHUNK = 64 * 1024
+ETAG = '"bench-1"'
+
+class RangeHandler(BaseHTTPRequestHandler):
+    # Enough of a static file server for range requests: single ranges, If-Range and a
+    # per-connection rate limit; ranges can be switched off to exercise the fallback
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        payload = self.server.payload
+        start, end, status = 0, len(payload), 200
+        range_header = self.headers.get('Range')
+        if self.server.ranges and range_header and self.headers.get('If-Range', ETAG) == ETAG:
+            first, _, last = range_header.removeprefix('bytes=').partition('-')
+            start, end, status = int(first), min(int(last) + 1 if last else len(payload), len(payload)), 206
+        self.send_response(status)
+        self.send_header('Content-Length', str(end - start))
+        self.send_header('ETag', ETAG)
+        if self.server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range', f"bytes {start}-{end - 1}/{len(payload)}")
+        self.end_headers()
+        try:
+            for offset in range(start, end, CHUNK):
+                chunk = payload[offset:min(offset + CHUNK, end)]
+                self.wfile.write(chunk)
+                with self.server.lock:
+                    self.server.served += len(chunk)
+                time.sleep(len(chunk) / CONNECTION_RATE)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(payload, ranges=True):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    server.daemon_threads = True
+    server.payload = payload
+    server.ranges = ranges
+    server.served = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def probe(download):
+    loop = QEventLoop()
+    result = []
+    download.probe(lambda supported: (result.append(supported), loop.quit()))
+    loop.exec()
+    return result[0]
+
+def run(download, stop_at=None):
+    # Runs until the download ends, or pauses it once stop_at bytes have arrived
+    loop = QEventLoop()
+    download.stateChanged.connect(lambda state: loop.quit() if state in DOWNLOAD_DONE_STATES else None)
+    timer = QTimer()
+    if stop_at is not None:
+        def check():
+            if download.receivedBytes() >= stop_at:
+                download.pause()
+                loop.quit()
+        timer.timeout.connect(check)
+        timer.start(20)
+    download.resume()
+    loop.exec()
+    timer.stop()
+
+def digest(path):
+    with open(path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+def main():
+    app = QCoreApplication(sys.argv)
+    network = QNetworkAccessManager()
+    payload = os.urandom(FILE_BYTES)
+    expected = hashlib.sha256(payload).hexdigest()
+    server = start_server(payload)
+    url = f"http://127.0.0.1:{server.server_port}/file.bin"
+    print(f"{FILE_BYTES // 1048576} MB file, {CONNECTION_RATE // 1048576} MB/s per connection")
+
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"{'connections':>11} {'seconds':>8} {'MB/s':>7} {'intact':>7}")
+        for connections in (1, 2, 4, 8):
+            path = os.path.join(directory, f"file-{connections}.bin")
+            download = SegmentedDownload(url, path, network, connections=connections, segment_bytes=4 * 1048576)
+            start = time.perf_counter()
+            probe(download)
+            run(download)
+            elapsed = time.perf_counter() - start
+            print(f"{connections:>11} {elapsed:>8.2f} {FILE_BYTES / elapsed / 1048576:>7.1f} "
+                  f"{str(digest(path) == expected):>7}")
+
+        # Stop halfway, throw the object away and continue from the sidecar in a new one
+        path = os.path.join(directory, "resumed.bin")
+        first = SegmentedDownload(url, path, network)
+        probe(first)
+        run(first, stop_at=FILE_BYTES // 2)
+        first.close()
+        before = server.served
+        second = SegmentedDownload(url, path, network)
+        probe(second)
+        resumed_from = second.receivedBytes()
+        run(second)
+        print(f"resume: continued from {resumed_from / 1048576:.1f} MB, fetched "
+              f"{(server.served - before) / 1048576:.1f} MB more, intact {digest(path) == expected}, "
+              f"state {second.state() == DownloadState.DownloadCompleted}")
+
+    server.shutdown()
+    plain = start_server(payload[:1048576], ranges=False)
+    download = SegmentedDownload(f"http://127.0.0.1:{plain.server_port}/file.bin", os.devnull, network)
+    print(f"server without ranges: segmented {probe(download)} (falls back to the engine download)")
+    plain.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import functools
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HISTORY_SIZES = (0, 100000, 400000)
+TABS = 20
+
+def write_fixtures(count):
+    sys.path.insert(0, ROOT)
+    import main
+    persistence = main.PersistenceService()
+    history = main.HistoryManager(persistence, max_age_days=None, max_visits=None, summarize_after_days=None,
+                                  build_index=False)
+    rng = random.Random(1)
+    now = time.time()
+    for n in range(count):
+        page = int(count // 3 * rng.random() ** 2)
+        history.add_visit(f"https://site{page % 500}.example.com/article/{page}", f"Article {page}",
+                          now - 180 * 86400 * (count - n) / count, 'link')
+    history.save_to_file()
+    persistence.update({'tabs': [{'url': f"data:text/html,<title>Tab {n}</title>{n}", 'title': f"Tab {n}"}
+                                 for n in range(TABS)]})
+    persistence.close()
+
+def child(deferred):
+    start = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    import main
+    from PyQt6.QtCore import QTimer
+    from PyQt6.QtWidgets import QApplication
+    main.DEFERRED_STARTUP = deferred
+    # Retention would rewrite the fixture on first start; keep every run identical. The
+    # HISTORY_* constants are already bound as defaults, so the window's manager is patched
+    main.HistoryManager.__init__ = functools.partialmethod(main.HistoryManager.__init__, max_age_days=None,
+                                                           max_visits=None, summarize_after_days=None)
+    trace = main.StartupTrace(start=start)
+    trace.mark('imports')
+    app = QApplication(sys.argv)
+    window = main.StratusBrowser(trace)
+    window.show()
+    def check():
+        if trace.painted and not window.deferred_startup:
+            app.quit()
+    timer = QTimer()
+    timer.timeout.connect(check)
+    timer.start(5)
+    QTimer.singleShot(60000, app.quit)
+    app.exec()
+    print(f"{trace.elapsed('first paint'):.4f} {trace.last - start:.4f} {len(window.history_manager.suggestion_index)}")
+    os._exit(0)
+
+def run(deferred, directory):
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', str(int(deferred))],
+                            cwd=directory, check=True, capture_output=True, text=True).stdout.split()
+    return float(output[-3]), float(output[-2]), int(output[-1])
+
+def main():
+    print(f"{'visits':>8} {'startup':>9} {'window ms':>10} {'all ready ms':>13} {'suggestions':>12}")
+    for size in HISTORY_SIZES:
+        with tempfile.TemporaryDirectory() as directory:
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--fixtures', str(size)],
+                           cwd=directory, check=True, capture_output=True)
+            for deferred in (False, True):
+                window, ready, suggestions = run(deferred, directory)
+                print(f"{size:>8} {'deferred' if deferred else 'eager':>9} {window * 1000:>10.1f} "
+                      f"{ready * 1000:>13.1f} {suggestions:>12}")
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == '--child':
+        child(sys.argv[2] == '1')
+    elif len(sys.argv) == 3 and sys.argv[1] == '--fixtures':
+        write_fixtures(int(sys.argv[2]))
+    else:
+        main()
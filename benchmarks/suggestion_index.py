@@ -0,0 +1,49 @@
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import SuggestionIndex
+
+SIZES = (10000, 100000)
+PREFIXES = ["g", "gi", "git", "github.com/", "https://www.", "news", "wiki", "yo", "zz"]
+
+def build_history(count, seed=1):
+    rng = random.Random(seed)
+    sites = ["github.com", "google.com", "news.ycombinator.com", "wikipedia.org", "youtube.com",
+             "stackoverflow.com", "reddit.com"] + [f"site{n}.example.com" for n in range(2000)]
+    urls = []
+    for n in range(count):
+        site = rng.choice(sites) if rng.random() < 0.6 else f"site{rng.randint(0, 5000)}.example.com"
+        prefix = "https://www." if rng.random() < 0.5 else "https://"
+        urls.append(f"{prefix}{site}/page/{rng.randint(0, count // 10)}")
+    return urls
+
+def main():
+    print(f"{'entries':>8} {'build s':>8} {'query us (max)':>15} {'add us (mean)':>14}")
+    for size in SIZES:
+        urls = build_history(size)
+        index = SuggestionIndex()
+        start = time.perf_counter()
+        index.build(Counter(urls))
+        build_time = time.perf_counter() - start
+
+        worst = 0.0
+        for prefix in PREFIXES:
+            for end in range(1, len(prefix) + 1):
+                start = time.perf_counter()
+                index.complete(prefix[:end])
+                worst = max(worst, time.perf_counter() - start)
+
+        additions = build_history(2000, seed=2)
+        start = time.perf_counter()
+        for url in additions:
+            index.add(url)
+        add_time = (time.perf_counter() - start) / len(additions)
+        print(f"{size:>8} {build_time:>8.2f} {worst * 1e6:>15.1f} {add_time * 1e6:>14.1f}")
+
+if __name__ == "__main__":
+    main()
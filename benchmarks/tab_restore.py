@@ -0,0 +1,57 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TAB_COUNTS = (1, 10, 40)
+
+def child(lazy, count):
+    sys.path.insert(0, ROOT)
+    import main
+    from PyQt6.QtCore import QTimer
+    from PyQt6.QtWidgets import QApplication
+    from PyQt6.QtWebEngineWidgets import QWebEngineView
+
+    with open('browser_data.json', 'w') as file:
+        json.dump({'tabs': [{'url': f"data:text/html,<title>Tab {n}</title>{n}", 'title': f"Tab {n}"}
+                            for n in range(count)]}, file)
+
+    app = QApplication(sys.argv)
+    main.LAZY_TAB_RESTORE = lazy
+    # Measures restore alone; deferred startup would leave the current tab without a view here
+    main.DEFERRED_STARTUP = False
+    start = time.perf_counter()
+    window = main.StratusBrowser()
+    window.show()
+    constructed = time.perf_counter() - start
+
+    first_load = []
+    current = window.tabs.currentWidget()
+    current.browser.loadFinished.connect(lambda ok: first_load.append(time.perf_counter() - start) or app.quit())
+    QTimer.singleShot(30000, app.quit)
+    app.exec()
+    views = len(window.findChildren(QWebEngineView))
+    print(f"{constructed:.4f} {first_load[0] if first_load else float('nan'):.4f} {views}")
+
+def run(lazy, count):
+    with tempfile.TemporaryDirectory() as directory:
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', str(int(lazy)), str(count)],
+                                cwd=directory, check=True, capture_output=True, text=True).stdout.split()
+    return float(output[-3]), float(output[-2]), int(output[-1])
+
+def main():
+    print(f"{'tabs':>5} {'mode':>6} {'window ms':>10} {'first load ms':>14} {'web views':>10}")
+    for count in TAB_COUNTS:
+        for lazy in (False, True):
+            constructed, first_load, views = run(lazy, count)
+            print(f"{count:>5} {'lazy' if lazy else 'eager':>6} {constructed * 1000:>10.1f} "
+                  f"{first_load * 1000:>14.1f} {views:>10}")
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == '--child':
+        child(sys.argv[2] == '1', int(sys.argv[3]))
+    else:
+        main()
@@ -0,0 +1,194 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TAB_COUNTS = (1, 20, 100)
+MODES = ('inline', 'shared', 'palette')
+
+# The per-widget sheets every BrowserTab used to set on itself, for the 'inline' baseline
+LEGACY_NAV_STYLE = """
+            QWidget {
+                background: #1a1a1a;
+                border-bottom: 1px solid rgba(255, 255, 255, 0.1);
+                border-radius: 12px;
+            }
+        """
+
+LEGACY_URL_BAR_STYLE = """
+            QLineEdit {
+                background-color: #2b2b2b;
+                color: #fff;
+                padding: 4px 10px;
+                border-radius: 6px;
+                border: 1px solid #222;
+                margin: 4px;
+                font-size: 13px;
+                selection-background-color: #0066cc;
+            }
+            QLineEdit:focus {
+                border: 1px solid #0066cc;
+                background-color: #333;
+            }
+            QLineEdit:hover {
+                background-color: #333;
+            }
+            QLineEdit::placeholder {
+                color: rgba(255, 255, 255, 0.5);
+            }
+        """
+
+LEGACY_BUTTON_STYLE = """
+            QPushButton {
+                background-color: transparent;
+                color: #fff;
+                padding: 0;
+                border-radius: 16px;
+                margin: 8px 4px;
+                min-width: 32px;
+                max-width: 32px;
+                min-height: 32px;
+                max-height: 32px;
+                font-size: 14px;
+                font-weight: 400;
+                line-height: 32px;
+            }
+            QPushButton:hover {
+                background-color: rgba(255, 255, 255, 0.1);
+            }
+            QPushButton:pressed {
+                background-color: rgba(255, 255, 255, 0.05);
+            }
+            QPushButton:disabled {
+                color: rgba(255, 255, 255, 0.3);
+            }
+        """
+
+LEGACY_NEW_TAB_STYLE = """
+            QPushButton {
+                background-color: transparent;
+                color: #fff;
+                padding: 5px;
+                border-radius: 15px;
+                margin: 0px 8px 0px 2px;
+                min-width: 30px;
+                max-width: 30px;
+                min-height: 28px;
+                max-height: 28px;
+                font-size: 18px;
+                font-weight: 400;
+                line-height: 1;
+            }
+            QPushButton:hover {
+                background-color: rgba(255, 255, 255, 0.1);
+            }
+            QPushButton:pressed {
+                background-color: rgba(255, 255, 255, 0.05);
+            }
+        """
+
+LEGACY_TAB_BAR_STYLE = """
+            QTabBar {
+                background: #1a1a1a;
+            }
+            QTabBar::tab {
+                background: rgba(255, 255, 255, 0.05);
+                color: #bbb;
+                padding: 8px 12px;
+                margin: 4px 1px 0px 1px;
+                border-radius: 8px 8px 0 0;
+                min-width: 50px;
+                max-width: 150px;
+            }
+            QTabBar::tab:selected {
+                background: rgba(255, 255, 255, 0.1);
+                color: #fff;
+                font-weight: bold;
+            }
+            QTabBar::tab:hover:!selected {
+                background: rgba(255, 255, 255, 0.07);
+                color: #fff;
+            }
+            QTabBar::close-button {
+                image: none;
+                subcontrol-position: right;
+                subcontrol-origin: padding;
+                margin-right: 4px;
+            }
+            QTabBar::close-button::after {
+                content: "✕";
+                color: rgba(255, 255, 255, 0.5);
+                font-size: 16px;
+                font-weight: 400;
+                background: transparent;
+                border-radius: 10px;
+                padding: 2px 6px;
+            }
+            QTabBar::close-button:hover::after {
+                color: white;
+                background: rgba(255, 255, 255, 0.1);
+            }
+        """
+
+def apply_inline_styles(main):
+    init = main.BrowserTab.__init__
+    def styled_init(tab, *args, **kwargs):
+        init(tab, *args, **kwargs)
+        tab.url_bar.parentWidget().setStyleSheet(LEGACY_NAV_STYLE)
+        tab.url_bar.setStyleSheet(LEGACY_URL_BAR_STYLE)
+        for button in (tab.back_button, tab.forward_button, tab.reload_button):
+            button.setStyleSheet(LEGACY_BUTTON_STYLE)
+        tab.new_tab_button.setStyleSheet(LEGACY_NEW_TAB_STYLE)
+    main.BrowserTab.__init__ = styled_init
+
+def child(mode, count):
+    sys.path.insert(0, ROOT)
+    import main
+    from PyQt6.QtWidgets import QApplication
+    main.DEFERRED_STARTUP = False
+    if mode == 'inline':
+        apply_inline_styles(main)
+    elif mode == 'palette':
+        main.THEME_PALETTE_BACKGROUNDS = True
+    app = QApplication(sys.argv)
+    app.setPalette(main.build_palette(main.THEME))
+    window = main.StratusBrowser()
+    if mode == 'inline':
+        window.tabs.tabBar().setStyleSheet(LEGACY_TAB_BAR_STYLE)
+    window.show()
+    app.processEvents()
+    baseline = main.process_rss(os.getpid())
+    latencies = []
+    for n in range(count):
+        # Created in the background like a restored tab, then selected, polished and painted
+        start = time.perf_counter()
+        tab = window.add_new_tab(f"https://example.com/{n}", f"Tab {n}", background=True)
+        window.tabs.setCurrentWidget(tab)
+        app.processEvents()
+        latencies.append(time.perf_counter() - start)
+    rss = main.process_rss(os.getpid()) - baseline
+    latencies.sort()
+    print(f"{sum(latencies) / count:.6f} {latencies[int(count * 0.95) - 1 if count > 1 else 0]:.6f} {rss}")
+    os._exit(0)
+
+def run(mode, count):
+    with tempfile.TemporaryDirectory() as directory:
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', mode, str(count)],
+                                cwd=directory, check=True, capture_output=True, text=True).stdout.split()
+    return float(output[-3]), float(output[-2]), int(output[-1])
+
+def main():
+    print(f"{'tabs':>5} {'styling':>8} {'mean ms/tab':>12} {'p95 ms/tab':>11} {'RSS MB':>8}")
+    for count in TAB_COUNTS:
+        for mode in MODES:
+            mean, p95, rss = run(mode, count)
+            print(f"{count:>5} {mode:>8} {mean * 1000:>12.2f} {p95 * 1000:>11.2f} {rss / 1048576:>8.1f}")
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == '--child':
+        child(sys.argv[2], int(sys.argv[3]))
+    else:
+        main()
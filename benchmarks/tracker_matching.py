@@ -0,0 +1,63 @@
+import os
+import random
+import sys
+import time
+import urllib.parse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import DEFAULT_TRACKER_LIST, HostMatcher
+
+FIRST_PARTY_HOSTS = [
+    "www.example.com", "static.example.com", "cdn.jsdelivr.net", "fonts.gstatic.com",
+    "i.ytimg.com", "upload.wikimedia.org", "assets.nytimes.com", "img.bbystatic.com",
+    "cdn.shopify.com", "ajax.googleapis.com", "news.ycombinator.com", "github.githubassets.com",
+    "www.reddit.com", "www.microsoft.com",
+]
+
+PATHS = [
+    "/js/app.{n}.js", "/css/main.{n}.css", "/img/hero-{n}.jpg", "/api/v1/items?page={n}",
+    "/collect?v=1&tid=UA-{n}&cid={n}", "/pixel.gif?event=view&id={n}", "/fonts/inter-{n}.woff2",
+]
+
+def build_requests(count, seed=1):
+    rng = random.Random(seed)
+    tracker_hosts = [host if rng.random() < 0.5 else f"px{rng.randint(1, 9)}.{host}"
+                     for host in DEFAULT_TRACKER_LIST]
+    urls = []
+    for n in range(count):
+        # Roughly one in four subrequests of a typical article page goes to a tracker
+        host = rng.choice(tracker_hosts) if rng.random() < 0.25 else rng.choice(FIRST_PARTY_HOSTS)
+        urls.append(f"https://{host}" + rng.choice(PATHS).format(n=n))
+    return urls
+
+def padded_list(size):
+    padding = [f"tracker{i}.adnetwork{i % 97}.com" for i in range(max(0, size - len(DEFAULT_TRACKER_LIST)))]
+    return DEFAULT_TRACKER_LIST + padding
+
+def substring_scan(urls, tracker_list):
+    return [any(tracker in url for tracker in tracker_list) for url in urls]
+
+def host_lookup(urls, matcher):
+    return [matcher.matches(urllib.parse.urlsplit(url).hostname or "") for url in urls]
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    urls = build_requests(20000)
+    print(f"{len(urls)} synthetic subrequests")
+    print(f"{'list size':>10} {'substring us/req':>18} {'host us/req':>12} {'speedup':>8} {'over-blocked':>13}")
+    for size in (len(DEFAULT_TRACKER_LIST), 1000, 10000):
+        tracker_list = padded_list(size)
+        matcher = HostMatcher(tracker_list)
+        scan_result, scan_time = timed(substring_scan, urls, tracker_list)
+        host_result, host_time = timed(host_lookup, urls, matcher)
+        over_blocked = sum(1 for scan, host in zip(scan_result, host_result) if scan and not host)
+        print(f"{size:>10} {scan_time / len(urls) * 1e6:>18.2f} {host_time / len(urls) * 1e6:>12.2f} "
+              f"{scan_time / host_time:>7.1f}x {over_blocked:>13}")
+
+if __name__ == "__main__":
+    main()
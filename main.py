@@ -1,37 +1,329 @@
 import sys
+import os
+import time
+
+# Taken before the heavy imports below so --startup-trace can account for them
+STARTUP_CLOCK = time.perf_counter()
+
 import re
+import base64
+import bisect
+import functools
+import heapq
+import itertools
+import math
+import hashlib
+import mmap
+import struct
+import threading
+import concurrent.futures
+import sqlite3
 import urllib.parse
 import json
-from datetime import datetime, timedelta
-from collections import defaultdict
+import html
+import mimetypes
+import zlib
+from datetime import datetime
+from array import array
+from collections import Counter, OrderedDict, defaultdict, deque, namedtuple
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QWidget,
-                             QPushButton, QLineEdit, QHBoxLayout, QTabWidget, QTabBar, QProgressBar, QFileDialog, QTableWidget, QTableWidgetItem, 
-                           QHeaderView, QVBoxLayout, QWidget, QPushButton, QHBoxLayout)
+                             QPushButton, QLineEdit, QHBoxLayout, QTabWidget, QTabBar, QFileDialog, QTableView,
+                           QHeaderView, QVBoxLayout, QWidget, QPushButton, QHBoxLayout, QListView, QMenu,
+                           QStyledItemDelegate, QStyleOptionProgressBar, QStyle, QInputDialog)
 from PyQt6.QtWebEngineWidgets import QWebEngineView
-from PyQt6.QtWebEngineCore import QWebEngineProfile, QWebEngineUrlRequestInterceptor
-from PyQt6.QtCore import QUrl, Qt, QTimer, QSize, QStringListModel, QDir, QFileInfo
-from PyQt6.QtGui import QIcon, QPalette, QColor, QKeySequence, QShortcut, QImage, QPixmap
+from PyQt6.QtWebEngineCore import (QWebEngineProfile, QWebEngineUrlRequestInterceptor, QWebEngineUrlRequestInfo,
+                                   QWebEnginePage, QWebEngineUrlScheme, QWebEngineUrlSchemeHandler,
+                                   QWebEngineUrlRequestJob, QWebEngineDownloadRequest)
+from PyQt6.QtCore import (QUrl, Qt, QTimer, QSize, QDir, QAbstractListModel,
+                          QAbstractTableModel, QModelIndex, QObject, pyqtSignal, QEvent, QBuffer, QIODevice, QByteArray)
+from PyQt6.QtGui import QIcon, QPalette, QColor, QKeySequence, QShortcut, QImage, QPixmap, QFont
 from PyQt6.QtNetwork import QNetworkAccessManager, QNetworkRequest, QNetworkReply
 
+DOWNLOAD_REFRESH_MS = 100  # progress is sampled for every active download at 10 Hz
+DOWNLOAD_RATE_SMOOTHING = 0.3
+DOWNLOAD_MAX_ACTIVE = 4
+DOWNLOAD_MAX_PER_HOST = 2
+DOWNLOAD_HISTORY_LIMIT = 500  # finished downloads kept in the list across restarts
+DOWNLOAD_RESTART_TIMEOUT_MS = 30000  # a restored download that isn't re-requested by then goes back in the queue
+DOWNLOAD_RESTART_ATTEMPTS = 3
+
+DownloadState = QWebEngineDownloadRequest.DownloadState
+
+DOWNLOAD_STATUS = {
+    DownloadState.DownloadRequested: "Starting",
+    DownloadState.DownloadInProgress: "Downloading",
+    DownloadState.DownloadCompleted: "Completed",
+    DownloadState.DownloadCancelled: "Cancelled",
+    DownloadState.DownloadInterrupted: "Failed",
+}
+
+DOWNLOAD_DONE_STATES = (DownloadState.DownloadCompleted, DownloadState.DownloadCancelled,
+                        DownloadState.DownloadInterrupted)
+
+class DownloadRecord:
+    def __init__(self, url, path, now, download=None):
+        self.download = download
+        self.url = url
+        self.path = path
+        self.name = os.path.basename(path)
+        self.host = QUrl(url).host()
+        self.state = DownloadState.DownloadRequested
+        self.queued = False
+        self.segmented = False
+        self.connection = None
+        self.restart_attempts = 0
+        self.received = 0
+        self.total = 0
+        self.rate = 0.0
+        self.sampled_at = now
+        self.sampled_bytes = 0
+        self.finished_at = None
+        # Filled in by the post-download pipeline; hashed/hash_total are written by a worker thread
+        self.processing = False
+        self.hashed = 0
+        self.hash_total = 0
+        self.reported_hashed = -1
+        self.sha256 = None
+        self.mime = None
+        self.duplicate_of = None
+        self.expected_sha256 = expected_digest(url)
+
+    @classmethod
+    def from_json(cls, entry, now):
+        record = cls(entry['url'], entry['path'], now)
+        record.state = DownloadState[entry['state']]
+        record.received = entry.get('received', 0)
+        record.total = entry.get('total', 0)
+        record.finished_at = entry.get('finished_at')
+        record.segmented = entry.get('segmented', False)
+        record.sha256 = entry.get('sha256')
+        record.mime = entry.get('mime')
+        record.duplicate_of = entry.get('duplicate_of')
+        record.expected_sha256 = entry.get('expected_sha256') or record.expected_sha256
+        return record
+
+    def to_json(self):
+        # Transfers that were still running are restarted from the queue next time
+        state = self.state if self.state in DOWNLOAD_DONE_STATES else DownloadState.DownloadRequested
+        return {'url': self.url, 'path': self.path, 'state': state.name, 'received': self.received,
+                'total': self.total, 'finished_at': self.finished_at, 'segmented': self.segmented,
+                'sha256': self.sha256, 'mime': self.mime, 'duplicate_of': self.duplicate_of,
+                'expected_sha256': self.expected_sha256}
+
+    def verified(self):
+        if self.expected_sha256 is None or self.sha256 is None:
+            return None
+        return self.sha256 == self.expected_sha256
+
+    def status(self):
+        if self.queued:
+            return "Queued"
+        if self.processing:
+            return f"Hashing {self.hashed / self.hash_total:.0%}" if self.hash_total else "Hashing"
+        if self.state == DownloadState.DownloadCompleted:
+            if self.verified() is False:
+                return "Checksum mismatch"
+            if self.mime == 'text/html' and mimetypes.guess_type(self.path)[0] not in (None, 'text/html'):
+                # Usually an error or login page saved under the file's name
+                return "Web page, not file"
+            if self.duplicate_of:
+                return "Duplicate"
+            if self.verified():
+                return "Verified"
+        return DOWNLOAD_STATUS.get(self.state, "Unknown")
+
+    def sample(self, now):
+        if self.processing:
+            hashed = self.hashed
+            changed = hashed != self.reported_hashed
+            self.reported_hashed = hashed
+            return changed
+        if self.download is None:
+            return False
+        received = self.download.receivedBytes()
+        total = self.download.totalBytes()
+        elapsed = now - self.sampled_at
+        if received == self.received and total == self.total and elapsed < 1:
+            return False
+        if elapsed > 0:
+            instant = (received - self.sampled_bytes) / elapsed
+            self.rate += DOWNLOAD_RATE_SMOOTHING * (instant - self.rate)
+        self.received = received
+        self.total = total
+        self.sampled_at = now
+        self.sampled_bytes = received
+        return True
+
+    def fraction(self):
+        if self.state == DownloadState.DownloadCompleted:
+            return 1.0
+        if self.total <= 0:
+            return None
+        return min(1.0, self.received / self.total)
+
+    def eta(self):
+        if self.state != DownloadState.DownloadInProgress or self.total <= 0 or self.rate < 1:
+            return None
+        return (self.total - self.received) / self.rate
+
+class DownloadListModel(QAbstractTableModel):
+    # Rows read from DownloadRecord objects; a timer samples the active downloads and
+    # reports every changed row in one dataChanged span instead of one update per
+    # downloadProgress signal
+    COLUMNS = ["File", "Size", "Progress", "Speed", "Time Left", "Status"]
+    PROGRESS_COLUMN = 2
+
+    def __init__(self, refresh_ms=DOWNLOAD_REFRESH_MS, parent=None):
+        super().__init__(parent)
+        self.records = []
+        self.active = set()
+        self.timer = QTimer(self)
+        self.timer.setInterval(refresh_ms)
+        self.timer.timeout.connect(self.refresh)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.records)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return self.COLUMNS[section]
+        return None
+
+    def add(self, records):
+        if not records:
+            return
+        row = len(self.records)
+        self.beginInsertRows(QModelIndex(), row, row + len(records) - 1)
+        self.records.extend(records)
+        self.endInsertRows()
+        for record in records:
+            self.update(record)
+
+    def update(self, record):
+        try:
+            row = self.records.index(record)
+        except ValueError:
+            # Cleared from the list
+            return
+        record.sample(time.monotonic())
+        if record.processing:
+            self.active.add(record)
+            if not self.timer.isActive():
+                self.timer.start()
+        elif record.state in DOWNLOAD_DONE_STATES or record.queued or record.download is None:
+            record.rate = 0.0
+            self.active.discard(record)
+        else:
+            self.active.add(record)
+            if not self.timer.isActive():
+                self.timer.start()
+        self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.COLUMNS) - 1))
+
+    def refresh(self):
+        if not self.active:
+            self.timer.stop()
+            return
+        now = time.monotonic()
+        changed = {record for record in self.active if record.sample(now)}
+        if not changed:
+            return
+        rows = [row for row, record in enumerate(self.records) if record in changed]
+        if not rows:
+            return
+        self.dataChanged.emit(self.index(rows[0], 1), self.index(rows[-1], len(self.COLUMNS) - 1))
+
+    def clear_completed(self):
+        # Remove runs of finished rows from the bottom up so the earlier rows keep their index
+        row = len(self.records) - 1
+        while row >= 0:
+            if self.records[row].state != DownloadState.DownloadCompleted:
+                row -= 1
+                continue
+            end = row
+            while row >= 0 and self.records[row].state == DownloadState.DownloadCompleted:
+                row -= 1
+            self.beginRemoveRows(QModelIndex(), row + 1, end)
+            # Completed rows can still be active while they are hashed
+            self.active.difference_update(self.records[row + 1:end + 1])
+            del self.records[row + 1:end + 1]
+            self.endRemoveRows()
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        record = self.records[index.row()]
+        column = index.column()
+        if role == Qt.ItemDataRole.DisplayRole:
+            if column == 0:
+                return record.name
+            if column == 1:
+                if record.total <= 0:
+                    return DownloadManager.format_size(record.received) if record.received else "Calculating..."
+                return f"{DownloadManager.format_size(record.received)} / {DownloadManager.format_size(record.total)}"
+            if column == 2:
+                fraction = record.fraction()
+                return "" if fraction is None else f"{fraction:.0%}"
+            if column == 3:
+                return f"{DownloadManager.format_size(record.rate)}/s" if record.rate >= 1 else ""
+            if column == 4:
+                eta = record.eta()
+                return "" if eta is None else DownloadManager.format_duration(eta)
+            if column == 5:
+                return record.status()
+        elif role == Qt.ItemDataRole.UserRole and column == self.PROGRESS_COLUMN:
+            return record.fraction()
+        elif role == Qt.ItemDataRole.ToolTipRole and column == 0:
+            lines = [record.path, record.url]
+            if record.mime:
+                lines.append(record.mime)
+            if record.sha256:
+                lines.append(f"SHA-256 {record.sha256}")
+            if record.expected_sha256 and record.expected_sha256 != record.sha256:
+                lines.append(f"Expected {record.expected_sha256}")
+            if record.duplicate_of:
+                lines.append(f"Same content as {record.duplicate_of}")
+            return "\n".join(lines)
+        return None
+
+class DownloadProgressDelegate(QStyledItemDelegate):
+    def paint(self, painter, option, index):
+        fraction = index.data(Qt.ItemDataRole.UserRole)
+        bar = QStyleOptionProgressBar()
+        bar.rect = option.rect.adjusted(2, 4, -2, -4)
+        bar.state = option.state
+        bar.minimum = 0
+        # An unknown total paints as a busy indicator
+        bar.maximum = 0 if fraction is None else 1000
+        bar.progress = 0 if fraction is None else int(fraction * 1000)
+        bar.text = index.data()
+        bar.textVisible = True
+        QApplication.style().drawControl(QStyle.ControlElement.CE_ProgressBar, bar, painter)
+
 class DownloadManager(QWidget):
-    def __init__(self, parent=None):
+    def __init__(self, service, parent=None):
         super().__init__(parent)
-        self.downloads = {}
+        self.service = service
+        self.model = service.model
         self.setup_ui()
 
     def setup_ui(self):
         layout = QVBoxLayout(self)
         
         # Create downloads table
-        self.table = QTableWidget(0, 4)  # rows, columns
-        self.table.setHorizontalHeaderLabels(["File", "Size", "Progress", "Status"])
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.setItemDelegateForColumn(DownloadListModel.PROGRESS_COLUMN, DownloadProgressDelegate(self.table))
+        self.table.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
+        self.table.verticalHeader().hide()
+        self.table.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
+        self.table.customContextMenuRequested.connect(self.show_context_menu)
         self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
-        self.table.horizontalHeader().setSectionResizeMode(1, QHeaderView.ResizeMode.Fixed)
-        self.table.horizontalHeader().setSectionResizeMode(2, QHeaderView.ResizeMode.Fixed)
-        self.table.horizontalHeader().setSectionResizeMode(3, QHeaderView.ResizeMode.Fixed)
-        self.table.setColumnWidth(1, 100)
-        self.table.setColumnWidth(2, 200)
-        self.table.setColumnWidth(3, 100)
+        for column, width in ((1, 140), (2, 200), (3, 90), (4, 80), (5, 100)):
+            self.table.horizontalHeader().setSectionResizeMode(column, QHeaderView.ResizeMode.Fixed)
+            self.table.setColumnWidth(column, width)
         
         # Button container
         button_container = QWidget()
@@ -46,349 +338,3201 @@ class DownloadManager(QWidget):
         layout.addWidget(self.table)
         layout.addWidget(button_container)
 
-    def start_download(self, download):
-        row = self.table.rowCount()
-        self.table.insertRow(row)
-        
-        # File name
-        file_item = QTableWidgetItem(QFileInfo(download.path()).fileName())
-        self.table.setItem(row, 0, file_item)
-        
-        # File size
-        size_item = QTableWidgetItem("Calculating...")
-        self.table.setItem(row, 1, size_item)
-        
-        # Progress bar
-        progress = QProgressBar()
-        progress.setTextVisible(True)
-        self.table.setCellWidget(row, 2, progress)
-        
-        # Status
-        status_item = QTableWidgetItem("Starting...")
-        self.table.setItem(row, 3, status_item)
-        
-        # Store download reference
-        self.downloads[download] = {
-            'row': row,
-            'progress': progress
+    def clear_completed(self):
+        self.model.clear_completed()
+
+    def show_context_menu(self, position):
+        index = self.table.indexAt(position)
+        if not index.isValid():
+            return
+        record = self.model.records[index.row()]
+        menu = QMenu(self)
+        menu.addAction("Verify SHA-256...", lambda: self.ask_expected_digest(record))
+        if record.sha256:
+            menu.addAction("Copy SHA-256", lambda: QApplication.clipboard().setText(record.sha256))
+        menu.exec(self.table.viewport().mapToGlobal(position))
+
+    def ask_expected_digest(self, record):
+        digest, accepted = QInputDialog.getText(self, "Verify SHA-256", f"Expected SHA-256 of {record.name}:",
+                                                text=record.expected_sha256 or "")
+        if accepted:
+            self.service.set_expected_digest(record, digest)
+
+    @staticmethod
+    def format_size(size):
+        for unit in ['B', 'KB', 'MB', 'GB']:
+            if size < 1024:
+                return f"{size:.1f} {unit}"
+            size /= 1024
+        return f"{size:.1f} TB"
+
+    @staticmethod
+    def format_duration(seconds):
+        seconds = int(seconds)
+        if seconds < 60:
+            return f"{seconds}s"
+        if seconds < 3600:
+            return f"{seconds // 60}m {seconds % 60:02d}s"
+        return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+
+SEGMENTED_DOWNLOADS = True
+SEGMENTED_MIN_BYTES = 32 * 1048576  # smaller files stay with the engine download
+SEGMENT_BYTES = 8 * 1048576
+SEGMENT_CONNECTIONS = 4
+SEGMENT_RETRIES = 3
+SEGMENT_STATE_INTERVAL = 1.0  # seconds between sidecar saves while transferring
+SEGMENT_WRITE_BACKLOG = 32 * 1048576  # received bytes the writer thread may fall behind by
+SEGMENT_PART_SUFFIX = '.part'
+SEGMENT_STATE_SUFFIX = '.segments.json'
+
+class SegmentedDownload(QObject):
+    # Fetches one file as byte ranges over a shared QNetworkAccessManager, which pools
+    # the connections per host. Data goes into a preallocated path + '.part' and the
+    # progress of every segment into a sidecar, so a later run continues where this
+    # one stopped. Exposes the parts of QWebEngineDownloadRequest the download list uses.
+    stateChanged = pyqtSignal(object)
+    # Emitted by the writer thread and delivered on the GUI thread
+    written = pyqtSignal(int)
+    completed = pyqtSignal()
+    writer_error = pyqtSignal(str)
+
+    def __init__(self, url, path, network, connections=SEGMENT_CONNECTIONS, segment_bytes=SEGMENT_BYTES,
+                 parent=None):
+        super().__init__(parent)
+        self.request_url = QUrl(url)
+        self.path = path
+        self.part_path = path + SEGMENT_PART_SUFFIX
+        self.state_path = path + SEGMENT_STATE_SUFFIX
+        self.network = network
+        self.connections = connections
+        self.segment_bytes = segment_bytes
+        self.size = 0
+        self.validator = None
+        # [start, end, received] per segment, end exclusive; received counts bytes
+        # handed to the writer, the sidecar only what it has written
+        self.segments = []
+        self.replies = {}
+        self.failures = Counter()
+        self.download_state = DownloadState.DownloadRequested
+        self.paused = True
+        # All file work runs on one writer thread in submission order; the GUI thread
+        # only tracks offsets and stops reading replies while the backlog is full
+        self.writer = None
+        self.file = None
+        self.opened = False
+        self.backlog = 0
+        self.saved_at = 0
+        self.written.connect(self.chunk_written)
+        self.completed.connect(self.write_completed)
+        self.writer_error.connect(self.write_failed)
+
+    def url(self):
+        return self.request_url
+
+    def state(self):
+        return self.download_state
+
+    def receivedBytes(self):
+        return sum(segment[2] for segment in self.segments)
+
+    def totalBytes(self):
+        return self.size
+
+    def isPaused(self):
+        return self.paused
+
+    def set_state(self, state):
+        self.download_state = state
+        self.stateChanged.emit(state)
+
+    def range_request(self, start, end):
+        request = QNetworkRequest(self.request_url)
+        request.setRawHeader(b'Range', f"bytes={start}-{end - 1}".encode())
+        if self.validator:
+            # The server answers 200 with the whole body if the file changed since
+            request.setRawHeader(b'If-Range', self.validator.encode())
+        return request
+
+    def probe(self, callback):
+        # A one-byte range request tells both whether ranges work and the full size
+        reply = self.network.get(self.range_request(0, 1))
+        def finished():
+            reply.deleteLater()
+            status = reply.attribute(QNetworkRequest.Attribute.HttpStatusCodeAttribute)
+            content_range = bytes(reply.rawHeader(b'Content-Range')).decode('latin-1')
+            total = content_range.rpartition('/')[2]
+            if reply.error() != QNetworkReply.NetworkError.NoError or status != 206 or not total.isdigit():
+                callback(False)
+                return
+            validator = bytes(reply.rawHeader(b'ETag') or reply.rawHeader(b'Last-Modified')).decode('latin-1')
+            self.prepare(int(total), validator or None)
+            callback(True)
+        reply.finished.connect(finished)
+
+    def prepare(self, size, validator):
+        try:
+            with open(self.state_path, 'r') as file:
+                saved = json.load(file)
+            if (saved['url'] == self.request_url.toString() and saved['size'] == size
+                    and saved['validator'] == validator and os.path.getsize(self.part_path) == size):
+                self.size = size
+                self.validator = validator
+                self.segments = saved['segments']
+                return
+        except (OSError, ValueError, KeyError):
+            pass
+        self.size = size
+        self.validator = validator
+        self.segments = [[start, min(start + self.segment_bytes, size), 0]
+                         for start in range(0, size, self.segment_bytes)]
+        self.submit(self.preallocate, size)
+        self.save_state()
+
+    def submit(self, work, *args):
+        if self.writer is None:
+            self.writer = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='segment-writer')
+        self.writer.submit(work, *args)
+
+    def save_state(self):
+        # Queued behind the writes it counts, so the sidecar never claims unwritten bytes
+        self.saved_at = time.monotonic()
+        self.submit(self.write_state, json.dumps({
+            'url': self.request_url.toString(), 'size': self.size,
+            'validator': self.validator, 'segments': self.segments
+        }))
+
+    def resume(self):
+        if not self.paused or self.download_state in DOWNLOAD_DONE_STATES:
+            return
+        if not self.opened:
+            self.submit(self.open_part)
+            self.opened = True
+        self.paused = False
+        if self.download_state != DownloadState.DownloadInProgress:
+            self.set_state(DownloadState.DownloadInProgress)
+        self.fetch_next()
+
+    def pause(self):
+        if self.paused:
+            return
+        self.paused = True
+        self.abort_replies()
+        self.save_state()
+
+    def cancel(self):
+        if self.download_state in DOWNLOAD_DONE_STATES:
+            return
+        self.paused = True
+        self.abort_replies()
+        self.close_file()
+        self.submit(self.remove_files)
+        self.release_writer()
+        self.set_state(DownloadState.DownloadCancelled)
+
+    def close(self):
+        # Waits for every queued write; used at shutdown, when the window is going away anyway
+        self.close_file()
+        self.release_writer(wait=True)
+
+    def release_writer(self, wait=False):
+        if self.writer is not None:
+            self.writer.shutdown(wait=wait)
+            self.writer = None
+
+    def abort_replies(self):
+        replies, self.replies = self.replies, {}
+        for reply in replies:
+            reply.abort()
+            reply.deleteLater()
+
+    def close_file(self):
+        if self.opened:
+            self.submit(self.close_part)
+            self.opened = False
+
+    def fetch_next(self):
+        busy = set(self.replies.values())
+        for index, (start, end, received) in enumerate(self.segments):
+            if len(self.replies) >= self.connections:
+                break
+            if index in busy or start + received >= end:
+                continue
+            reply = self.network.get(self.range_request(start + received, end))
+            # A full backlog leaves data in the reply, and a bounded buffer stops the socket
+            reply.setReadBufferSize(SEGMENT_WRITE_BACKLOG // self.connections)
+            self.replies[reply] = index
+            reply.readyRead.connect(lambda reply=reply: self.write_chunk(reply))
+            reply.finished.connect(lambda reply=reply: self.segment_finished(reply))
+        if not self.replies and self.receivedBytes() >= self.size:
+            self.finish()
+
+    def write_chunk(self, reply, force=False):
+        index = self.replies.get(reply)
+        if index is None or not reply.bytesAvailable() or (self.backlog >= SEGMENT_WRITE_BACKLOG and not force):
+            return
+        if reply.attribute(QNetworkRequest.Attribute.HttpStatusCodeAttribute) != 206:
+            # Range ignored or the file changed underneath us; the pieces no longer fit together
+            print(f"Range request for {self.request_url.toString()} was answered with a full response")
+            self.fail()
+            return
+        segment = self.segments[index]
+        data = reply.readAll().data()[:segment[1] - segment[0] - segment[2]]
+        if not data:
+            return
+        self.submit(self.write_at, segment[0] + segment[2], data)
+        segment[2] += len(data)
+        self.backlog += len(data)
+        if time.monotonic() - self.saved_at >= SEGMENT_STATE_INTERVAL:
+            self.save_state()
+
+    def chunk_written(self, count):
+        self.backlog -= count
+        if self.backlog < SEGMENT_WRITE_BACKLOG:
+            for reply in list(self.replies):
+                self.write_chunk(reply)
+
+    def segment_finished(self, reply):
+        # Whatever the backlog held back still belongs to this segment
+        self.write_chunk(reply, force=True)
+        index = self.replies.pop(reply, None)
+        reply.deleteLater()
+        if index is None:
+            return
+        start, end, received = self.segments[index]
+        if start + received < end:
+            self.failures[index] += 1
+            if self.failures[index] > SEGMENT_RETRIES:
+                print(f"Segment {start}-{end} of {self.request_url.toString()} failed: {reply.errorString()}")
+                self.fail()
+                return
+        self.fetch_next()
+
+    def fail(self):
+        self.paused = True
+        self.abort_replies()
+        self.save_state()
+        self.close_file()
+        self.set_state(DownloadState.DownloadInterrupted)
+
+    def finish(self):
+        self.close_file()
+        self.submit(self.complete_file)
+
+    def write_completed(self):
+        self.paused = True
+        self.release_writer()
+        self.set_state(DownloadState.DownloadCompleted)
+
+    def write_failed(self, message):
+        print(message)
+        if self.download_state not in DOWNLOAD_DONE_STATES:
+            self.fail()
+
+    # The methods below run on the writer thread
+
+    def preallocate(self, size):
+        try:
+            with open(self.part_path, 'wb') as file:
+                file.truncate(size)
+                if hasattr(os, 'posix_fallocate'):
+                    os.posix_fallocate(file.fileno(), 0, size)
+        except OSError as e:
+            print(f"Error preallocating {self.part_path}: {e}")
+
+    def open_part(self):
+        try:
+            self.file = open(self.part_path, 'r+b')
+        except OSError as e:
+            self.writer_error.emit(f"Error opening {self.part_path}: {e}")
+
+    def write_at(self, offset, data):
+        if self.file is not None:
+            try:
+                self.file.seek(offset)
+                self.file.write(data)
+            except OSError as e:
+                self.writer_error.emit(f"Error writing {self.part_path}: {e}")
+        self.written.emit(len(data))
+
+    def write_state(self, state):
+        try:
+            if self.file is not None:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+            PersistenceService.write_atomic(self.state_path, state)
+        except OSError as e:
+            print(f"Error saving download state {self.state_path}: {e}")
+
+    def close_part(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def remove_files(self):
+        for path in (self.part_path, self.state_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def complete_file(self):
+        try:
+            os.replace(self.part_path, self.path)
+            os.remove(self.state_path)
+        except OSError as e:
+            self.writer_error.emit(f"Error completing {self.path}: {e}")
+            return
+        self.completed.emit()
+
+DOWNLOAD_INDEX_FILE = 'download_index.json'
+DOWNLOAD_HASH_WORKERS = 2
+DOWNLOAD_HASH_CHUNK = 4 * 1048576
+MIME_SNIFF_BYTES = 512
+
+MIME_SIGNATURES = [
+    (b'%PDF-', 'application/pdf'),
+    (b'PK\x03\x04', 'application/zip'),
+    (b'\x1f\x8b', 'application/gzip'),
+    (b'BZh', 'application/x-bzip2'),
+    (b'\xfd7zXZ\x00', 'application/x-xz'),
+    (b'(\xb5/\xfd', 'application/zstd'),
+    (b"7z\xbc\xaf'\x1c", 'application/x-7z-compressed'),
+    (b'Rar!\x1a\x07', 'application/vnd.rar'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'OggS', 'audio/ogg'),
+    (b'fLaC', 'audio/flac'),
+    (b'ID3', 'audio/mpeg'),
+    (b'\x1aE\xdf\xa3', 'video/webm'),
+    (b'\x7fELF', 'application/x-executable'),
+    (b'MZ', 'application/x-msdownload'),
+]
+
+def sniff_mime(head):
+    for signature, mime in MIME_SIGNATURES:
+        if head.startswith(signature):
+            return mime
+    if head[4:8] == b'ftyp':
+        return 'video/mp4'
+    text = head.lstrip().lower()
+    if text.startswith((b'<!doctype html', b'<html', b'<head', b'<body')):
+        return 'text/html'
+    if b'\x00' not in head:
+        try:
+            head.decode('utf-8')
+            return 'text/plain'
+        except UnicodeDecodeError:
+            pass
+    return 'application/octet-stream'
+
+def expected_digest(url):
+    # Links may carry their checksum the way package indexes do: ...#sha256=<hex>
+    name, _, value = QUrl(url).fragment().partition('=')
+    if name == 'sha256' and re.fullmatch(r'[0-9a-fA-F]{64}', value):
+        return value.lower()
+    return None
+
+class DownloadPostProcessor(QObject):
+    # Hashes finished downloads on a thread pool and keeps a path -> (size, mtime,
+    # sha256) index of everything downloaded before, so a new file's digest finds
+    # its duplicates with one lookup. Workers only read files and update progress
+    # counters on the record; results come back to the GUI thread through a signal.
+    processed = pyqtSignal(object)
+
+    def __init__(self, persistence, index_file=DOWNLOAD_INDEX_FILE, workers=DOWNLOAD_HASH_WORKERS,
+                 chunk_size=DOWNLOAD_HASH_CHUNK, on_record=None, parent=None):
+        super().__init__(parent)
+        self.persistence = persistence
+        self.index_file = index_file
+        self.chunk_size = chunk_size
+        self.on_record = on_record
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='download-hash')
+        self.stopping = False
+        self.index = self.load_index()
+        self.by_digest = defaultdict(set)
+        for path, (size, mtime, digest) in self.index.items():
+            self.by_digest[digest].add(path)
+        self.processed.connect(self.record_result)
+
+    def load_index(self):
+        try:
+            with open(self.index_file, 'r') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            print(f"Error loading {self.index_file}: {e}")
+            return {}
+
+    def submit(self, record):
+        record.processing = True
+        record.hashed = 0
+        self.pool.submit(self.process, record.path, record)
+
+    def scan(self, directory):
+        # Index what is already in the folder; files whose size and mtime match their
+        # entry are not read again
+        known = dict(self.index)
+        def run():
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                return
+            for entry in entries:
+                if self.stopping:
+                    return
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                cached = known.get(entry.path)
+                if cached is None or cached[0] != stat.st_size or cached[1] != stat.st_mtime:
+                    self.process(entry.path)
+        self.pool.submit(run)
+
+    def hash_file(self, file, size, record):
+        digest = hashlib.sha256()
+        try:
+            view = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        except (OSError, ValueError):
+            view = None
+        if view is not None:
+            with view, memoryview(view) as data:
+                for offset in range(0, size, self.chunk_size):
+                    if self.stopping:
+                        return None
+                    digest.update(data[offset:offset + self.chunk_size])
+                    if record is not None:
+                        record.hashed = min(size, offset + self.chunk_size)
+            return digest.hexdigest()
+        # Empty files and files that can't be mapped are read in chunks instead
+        buffer = bytearray(self.chunk_size)
+        done = 0
+        while not self.stopping:
+            count = file.readinto(buffer)
+            if not count:
+                return digest.hexdigest()
+            digest.update(memoryview(buffer)[:count])
+            done += count
+            if record is not None:
+                record.hashed = done
+        return None
+
+    def process(self, path, record=None):
+        result = {'record': record, 'path': path, 'sha256': None}
+        try:
+            with open(path, 'rb') as file:
+                stat = os.fstat(file.fileno())
+                if record is not None:
+                    record.hash_total = stat.st_size
+                result['size'] = stat.st_size
+                result['mtime'] = stat.st_mtime
+                result['mime'] = sniff_mime(file.read(MIME_SNIFF_BYTES))
+                file.seek(0)
+                result['sha256'] = self.hash_file(file, stat.st_size, record)
+        except OSError as e:
+            result['error'] = str(e)
+        if not self.stopping:
+            self.processed.emit(result)
+
+    def record_result(self, result):
+        path = result['path']
+        digest = result['sha256']
+        record = result['record']
+        if digest is not None:
+            self.forget(path)
+            duplicates, stale = [], []
+            for other in list(self.by_digest[digest]):
+                (duplicates if self.still_matches(other) else stale).append(other)
+            # Moved or deleted since they were indexed
+            for other in stale:
+                self.forget(other)
+            self.index[path] = [result['size'], result['mtime'], digest]
+            self.by_digest[digest].add(path)
+            self.persistence.write_json(self.index_file, self.index)
+        if record is None:
+            return
+        record.processing = False
+        if digest is None:
+            print(f"Error hashing {path}: {result.get('error', 'cancelled')}")
+        else:
+            record.sha256 = digest
+            record.mime = result['mime']
+            record.duplicate_of = duplicates[0] if duplicates else None
+        if self.on_record is not None:
+            self.on_record(record)
+
+    def still_matches(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        size, mtime, digest = self.index[path]
+        return stat.st_size == size and stat.st_mtime == mtime
+
+    def forget(self, path):
+        entry = self.index.pop(path, None)
+        if entry is not None:
+            self.by_digest[entry[2]].discard(path)
+
+    def close(self):
+        self.stopping = True
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+class DownloadService:
+    # Owns every download of the profile: downloadRequested is connected once, new
+    # transfers beyond max_active (or max_per_host for one server) are accepted but
+    # paused in a FIFO queue, and the queue plus finished entries survive restarts
+    def __init__(self, profile, persistence, window, max_active=DOWNLOAD_MAX_ACTIVE,
+                 max_per_host=DOWNLOAD_MAX_PER_HOST, history_limit=DOWNLOAD_HISTORY_LIMIT):
+        self.profile = profile
+        self.persistence = persistence
+        self.window = window
+        self.max_active = max_active
+        self.max_per_host = max_per_host
+        self.history_limit = history_limit
+        self.model = DownloadListModel(parent=window)
+        self.model.rowsRemoved.connect(self.save)
+        self.queue = deque()
+        self.running = Counter()
+        self.active = 0
+        # Restored entries waiting for the downloadRequested their restart triggers, in the
+        # order the restarts were issued
+        self.restarting = []
+        self.page = None
+        self.network = None
+        self.post_processor = DownloadPostProcessor(persistence, on_record=self.record_processed, parent=window)
+        profile.downloadRequested.connect(self.handle_request)
+        self.restore()
+        self.post_processor.scan(os.path.join(QDir.homePath(), "Downloads"))
+
+    def restore(self):
+        now = time.monotonic()
+        records = []
+        for entry in self.persistence.get('downloads', []):
+            try:
+                record = DownloadRecord.from_json(entry, now)
+            except (KeyError, TypeError) as e:
+                print(f"Error restoring download entry: {e}")
+                continue
+            if record.state not in DOWNLOAD_DONE_STATES:
+                record.queued = True
+                self.queue.append(record)
+            records.append(record)
+        self.model.add(records)
+        self.schedule()
+
+    def handle_request(self, download):
+        record = self.take_restart(download)
+        if record is None:
+            if self.page is not None and download.page() is self.page:
+                # A restart that already timed out and went back in the queue
+                download.cancel()
+                return
+            default_path = os.path.join(QDir.homePath(), "Downloads", download.suggestedFileName())
+            path, _ = QFileDialog.getSaveFileName(self.window, "Save File", default_path, "All Files (*.*)")
+            if not path:
+                # Not accepting the request cancels it
+                return
+            record = DownloadRecord(download.url().toString(), path, time.monotonic())
+            self.model.add([record])
+            self.window.show_downloads()
+            if not self.has_slot(record):
+                record.queued = True
+                self.queue.append(record)
+            else:
+                self.claim_slot(record)
+        self.attach(record, download)
+        if SEGMENTED_DOWNLOADS and download.totalBytes() >= SEGMENTED_MIN_BYTES:
+            self.try_segmented(record, download)
+        self.save()
+
+    def take_restart(self, download):
+        # The URL asked for identifies a restart unless the server redirected; only
+        # restarts come from self.page, so then the file name or the oldest one decides
+        url = download.url().toString()
+        match = next((record for record in self.restarting if record.url == url), None)
+        if match is None and self.restarting and self.page is not None and download.page() is self.page:
+            name = download.suggestedFileName()
+            match = next((record for record in self.restarting if record.name == name), self.restarting[0])
+        if match is not None:
+            self.restarting.remove(match)
+        return match
+
+    def attach(self, record, download):
+        directory, name = os.path.split(record.path)
+        download.setDownloadDirectory(directory)
+        download.setDownloadFileName(name)
+        download.accept()
+        self.connect_download(record, download)
+
+    def connect_download(self, record, download):
+        record.connection = download.stateChanged.connect(lambda state, record=record: self.state_changed(record, state))
+        record.download = download
+        record.state = download.state()
+        if record.queued:
+            download.pause()
+        self.model.update(record)
+
+    def try_segmented(self, record, engine_download=None):
+        # The engine download keeps going while the server is probed for range support
+        # and is only cancelled once the segmented transfer can take over
+        if self.network is None:
+            self.network = QNetworkAccessManager(self.window)
+        segmented = SegmentedDownload(record.url, record.path, self.network, parent=self.window)
+        def probed(supported):
+            if record.state in DOWNLOAD_DONE_STATES or record not in self.model.records:
+                return
+            if not supported:
+                record.segmented = False
+                if engine_download is None:
+                    self.restart(record)
+                return
+            if engine_download is not None:
+                engine_download.stateChanged.disconnect(record.connection)
+                engine_download.cancel()
+            record.segmented = True
+            self.connect_download(record, segmented)
+            if not record.queued:
+                segmented.resume()
+            self.save()
+        segmented.probe(probed)
+
+    def has_slot(self, record):
+        return self.active < self.max_active and self.running[record.host] < self.max_per_host
+
+    def claim_slot(self, record):
+        self.active += 1
+        self.running[record.host] += 1
+
+    def release_slot(self, record):
+        self.active -= 1
+        self.running[record.host] -= 1
+
+    def schedule(self):
+        # One pass in FIFO order; a host at its limit doesn't hold up the entries behind it
+        waiting = deque()
+        for record in self.queue:
+            if self.has_slot(record):
+                self.start(record)
+            else:
+                waiting.append(record)
+        self.queue = waiting
+
+    def start(self, record):
+        self.claim_slot(record)
+        record.queued = False
+        if record.download is not None:
+            record.download.resume()
+            self.model.update(record)
+        elif record.segmented:
+            self.try_segmented(record)
+        else:
+            self.restart(record)
+
+    def restart(self, record):
+        # Restored from disk: ask the profile for the URL again and reattach in handle_request
+        if self.page is None:
+            self.page = QWebEnginePage(self.profile, self.window)
+        record.restart_attempts += 1
+        self.restarting.append(record)
+        self.page.download(QUrl(record.url), record.path)
+        attempt = record.restart_attempts
+        QTimer.singleShot(DOWNLOAD_RESTART_TIMEOUT_MS, lambda: self.restart_timed_out(record, attempt))
+
+    def restart_timed_out(self, record, attempt):
+        # The request failed before downloadRequested, or never matched; free the slot
+        if record not in self.restarting or record.restart_attempts != attempt:
+            return
+        self.restarting.remove(record)
+        self.release_slot(record)
+        if record.restart_attempts >= DOWNLOAD_RESTART_ATTEMPTS:
+            print(f"Gave up restarting {record.url} after {record.restart_attempts} attempts")
+            record.state = DownloadState.DownloadInterrupted
+            record.finished_at = time.time()
+        else:
+            record.queued = True
+            self.queue.append(record)
+        self.model.update(record)
+        self.schedule()
+        self.save()
+
+    def state_changed(self, record, state):
+        record.state = state
+        if state in DOWNLOAD_DONE_STATES:
+            if record.queued:
+                record.queued = False
+                self.queue.remove(record)
+            else:
+                self.release_slot(record)
+            record.finished_at = time.time()
+            if state == DownloadState.DownloadCompleted:
+                self.post_processor.submit(record)
+            self.schedule()
+            self.save()
+        self.model.update(record)
+
+    def record_processed(self, record):
+        self.model.update(record)
+        self.save()
+
+    def set_expected_digest(self, record, digest):
+        record.expected_sha256 = digest.strip().lower() or None
+        self.model.update(record)
+        self.save()
+
+    def close(self):
+        for record in self.model.records:
+            if isinstance(record.download, SegmentedDownload):
+                # Stops the transfer and waits for its writes, so the sidecar is current
+                record.download.pause()
+                record.download.close()
+        self.save()
+        self.post_processor.close()
+
+    def save(self, *args):
+        records = self.model.records
+        finished = [record for record in records if record.state in DOWNLOAD_DONE_STATES]
+        dropped = set(finished[:-self.history_limit]) if len(finished) > self.history_limit else set()
+        self.persistence.update({'downloads': [record.to_json() for record in records if record not in dropped]})
+
+class PersistenceService:
+    def __init__(self, data_file='browser_data.json', delay=1.0):
+        self.data_file = data_file
+        self.delay = delay
+        self.data = self.load()
+        # Pending work is merged here by the UI thread and drained by the worker:
+        # later updates of a key replace earlier ones, so a burst becomes one write
+        self.pending_values = {}
+        self.pending_appends = []
+        self.pending_files = {}
+        self.pending_callbacks = []
+        self.condition = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, name='persistence', daemon=True)
+        self.thread.start()
+
+    def load(self):
+        try:
+            with open(self.data_file, 'r') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            print(f"Error loading {self.data_file}: {e}")
+            return {}
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def update(self, values, after_write=None):
+        with self.condition:
+            self.pending_values.update(values)
+            if after_write is not None:
+                self.pending_callbacks.append(after_write)
+            self.condition.notify()
+
+    def append(self, path, text):
+        with self.condition:
+            self.pending_appends.append((path, text))
+            self.condition.notify()
+
+    def write_json(self, path, value):
+        # Side files next to the data file; None deletes the file
+        with self.condition:
+            self.pending_files[path] = value
+            self.condition.notify()
+
+    def has_pending(self):
+        return bool(self.pending_values or self.pending_appends or self.pending_files or self.pending_callbacks)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.has_pending() and not self.stopping:
+                    self.condition.wait()
+                if self.stopping and not self.has_pending():
+                    return
+            if not self.stopping:
+                # Debounce: let the rest of a burst land before touching the disk
+                time.sleep(self.delay)
+            self.write_pending()
+
+    def write_pending(self):
+        # Batches are taken and written under one lock so they hit the disk in order
+        with self.write_lock:
+            with self.condition:
+                values, self.pending_values = self.pending_values, {}
+                appends, self.pending_appends = self.pending_appends, []
+                files, self.pending_files = self.pending_files, {}
+                callbacks, self.pending_callbacks = self.pending_callbacks, []
+            try:
+                self.write_appends(appends)
+                self.write_files(files)
+                if values:
+                    # A value of None removes the key from the data file
+                    for key, value in values.items():
+                        if value is None:
+                            self.data.pop(key, None)
+                        else:
+                            self.data[key] = value
+                    self.write_atomic(self.data_file, json.dumps(self.data))
+                for callback in callbacks:
+                    callback()
+            except OSError as e:
+                print(f"Error saving browser data: {e}")
+
+    @staticmethod
+    def write_appends(appends):
+        by_path = defaultdict(list)
+        for path, text in appends:
+            by_path[path].append(text)
+        for path, texts in by_path.items():
+            with open(path, 'a') as file:
+                file.write(''.join(texts))
+
+    @staticmethod
+    def write_files(files):
+        for path, value in files.items():
+            if value is None:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            else:
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                PersistenceService.write_atomic(path, json.dumps(value))
+
+    @staticmethod
+    def write_atomic(path, text):
+        temp_file = path + '.tmp'
+        with open(temp_file, 'w') as file:
+            file.write(text)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_file, path)
+
+    def flush(self):
+        self.write_pending()
+
+    def close(self):
+        self.flush()
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        self.thread.join()
+
+class SuggestionIndex:
+    # Prefix ranges larger than this keep their best completions cached and
+    # maintained on every update, so popular prefixes never rescan the range
+    CACHE_THRESHOLD = 64
+    # Bounds the recursion in fill_top for very long shared prefixes
+    MAX_DEPTH = 200
+
+    def __init__(self, limit=20):
+        self.limit = limit
+        self.scores = {}
+        # Sorted (key, text) pairs; a URL is filed under its full form and again
+        # without the scheme and "www." so typing "git" finds https://github.com/
+        self.keys = []
+        self.top_cache = {}
+
+    def __len__(self):
+        return len(self.scores)
+
+    @staticmethod
+    def keys_for(text):
+        key = text.lower()
+        stripped = re.sub(r'^[a-z][a-z0-9+.-]*://(www\.)?', '', key)
+        return [key, stripped] if stripped and stripped != key else [key]
+
+    def build(self, scores):
+        self.scores = dict(scores)
+        self.keys = sorted((key, text) for text in self.scores for key in self.keys_for(text))
+        self.top_cache.clear()
+        self.fill_top('', 0, len(self.keys))
+
+    def add(self, text, amount=1):
+        self.set_score(text, self.scores.get(text, 0) + amount)
+
+    def set_score(self, text, score):
+        old_score = self.scores.get(text)
+        self.scores[text] = score
+        keys = self.keys_for(text)
+        if old_score is None:
+            for key in keys:
+                bisect.insort(self.keys, (key, text))
+        for key in keys:
+            for end in range(len(key) + 1):
+                prefix = key[:end]
+                top = self.top_cache.get(prefix)
+                if top is not None:
+                    self.update_top(prefix, top, text, score, old_score)
+
+    def update_top(self, prefix, top, text, score, old_score):
+        for position, (_, candidate) in enumerate(top):
+            if candidate == text:
+                if old_score is not None and score < old_score:
+                    # An uncached entry may now outrank it; recompute on the next query
+                    del self.top_cache[prefix]
+                    return
+                top[position] = (score, text)
+                break
+        else:
+            if len(top) >= self.limit and score <= top[-1][0]:
+                return
+            top.append((score, text))
+        top.sort(key=lambda entry: -entry[0])
+        del top[self.limit:]
+
+    def scan_top(self, start, end):
+        best = {self.keys[position][1]: None for position in range(start, end)}
+        return heapq.nlargest(self.limit, ((self.scores[text], text) for text in best),
+                              key=lambda entry: entry[0])
+
+    def fill_top(self, prefix, start, end):
+        # Computes the best completions of keys[start:end] bottom-up from the child
+        # prefixes, caching every range larger than CACHE_THRESHOLD on the way
+        if end - start <= self.CACHE_THRESHOLD:
+            return self.scan_top(start, end)
+        depth = len(prefix)
+        if depth >= self.MAX_DEPTH:
+            top = self.scan_top(start, end)
+            self.top_cache[prefix] = top
+            return top
+
+        best = {}
+        position = start
+        while position < end:
+            key, text = self.keys[position]
+            if len(key) == depth:
+                best[text] = self.scores[text]
+                position += 1
+                continue
+            child = key[:depth + 1]
+            child_end = bisect.bisect_left(self.keys, (child + '\U0010ffff',), position, end)
+            for score, text in self.fill_top(child, position, child_end):
+                best[text] = score
+            position = child_end
+        top = heapq.nlargest(self.limit, ((score, text) for text, score in best.items()),
+                             key=lambda entry: entry[0])
+        self.top_cache[prefix] = top
+        return top
+
+    def complete(self, prefix, limit=None):
+        prefix = prefix.lower()
+        top = self.top_cache.get(prefix)
+        if top is None:
+            start = bisect.bisect_left(self.keys, (prefix,))
+            end = bisect.bisect_left(self.keys, (prefix + '\U0010ffff',), start)
+            top = self.fill_top(prefix, start, end)
+        return [text for _, text in top[:limit or self.limit]]
+
+class FrecencyScorer:
+    # Visit weights by age in days, in the style of Firefox places frecency
+    AGE_BUCKETS = ((4, 100), (14, 70), (31, 50), (90, 30))
+    OLD_VISIT_WEIGHT = 10
+    VISIT_TYPE_BONUS = {'typed': 2.0, 'link': 1.0}
+    SAMPLE_SIZE = 10
+
+    def __init__(self):
+        self.samples = {}
+        self.visit_counts = Counter()
+        self.scores = {}
+        # A score only changes when one of its sampled visits crosses an age bucket
+        # boundary, so each URL is scheduled for that moment instead of rescanning
+        # the whole history on every decay pass
+        self.next_change = {}
+        self.schedule = []
+
+    def __len__(self):
+        return len(self.scores)
+
+    def add_visit(self, url, timestamp, visit_type='link'):
+        samples = self.samples.get(url)
+        if samples is None:
+            samples = self.samples[url] = deque(maxlen=self.SAMPLE_SIZE)
+        samples.append((timestamp, visit_type))
+        self.visit_counts[url] += 1
+
+    def record_visit(self, url, timestamp, visit_type='link', now=None):
+        self.add_visit(url, timestamp, visit_type)
+        return self.rescore(url, now or time.time())
+
+    def rescore_all(self, now=None):
+        now = now or time.time()
+        self.schedule = []
+        self.next_change = {}
+        for url in self.samples:
+            self.rescore(url, now)
+
+    def rescore(self, url, now):
+        points = 0.0
+        next_change = None
+        samples = self.samples[url]
+        for timestamp, visit_type in samples:
+            age_days = (now - timestamp) / 86400
+            weight = self.OLD_VISIT_WEIGHT
+            for max_age, bucket_weight in self.AGE_BUCKETS:
+                if age_days < max_age:
+                    weight = bucket_weight
+                    change = timestamp + max_age * 86400
+                    if next_change is None or change < next_change:
+                        next_change = change
+                    break
+            points += weight * self.VISIT_TYPE_BONUS.get(visit_type, 1.0)
+        score = math.ceil(self.visit_counts[url] * points / len(samples))
+        self.scores[url] = score
+
+        if next_change is None:
+            self.next_change.pop(url, None)
+        elif self.next_change.get(url) != next_change:
+            self.next_change[url] = next_change
+            heapq.heappush(self.schedule, (next_change, url))
+        return score
+
+    def decay(self, now=None):
+        now = now or time.time()
+        changed = {}
+        while self.schedule and self.schedule[0][0] <= now:
+            due, url = heapq.heappop(self.schedule)
+            # Entries superseded by a later visit are left in the heap and skipped here
+            if self.next_change.get(url) != due:
+                continue
+            del self.next_change[url]
+            old_score = self.scores[url]
+            score = self.rescore(url, now)
+            if score != old_score:
+                changed[url] = score
+        return changed
+
+    def top(self, limit):
+        return heapq.nlargest(limit, self.scores.items(), key=lambda entry: entry[1])
+
+SearchEngine = namedtuple('SearchEngine', ['name', 'keyword', 'hosts', 'path', 'query_param', 'search_url'])
+SiteRule = namedtuple('SiteRule', ['kind', 'hosts', 'path', 'template'])
+
+SEARCH_ENGINES = [
+    SearchEngine('Google', 'g', ('google.com',), '/search', 'q', 'https://www.google.com/search?q={query}'),
+    SearchEngine('Bing', 'b', ('bing.com',), '/search', 'q', 'https://www.bing.com/search?q={query}'),
+    SearchEngine('DuckDuckGo', 'd', ('duckduckgo.com',), '/', 'q', 'https://duckduckgo.com/?q={query}'),
+    SearchEngine('Yahoo', 'y', ('search.yahoo.com',), '/search', 'p', 'https://search.yahoo.com/search?p={query}'),
+    SearchEngine('YouTube', 'yt', ('youtube.com',), '/results', 'search_query',
+                 'https://www.youtube.com/results?search_query={query}'),
+    SearchEngine('Wikipedia', 'w', ('wikipedia.org',), '/w/index.php', 'search',
+                 'https://en.wikipedia.org/w/index.php?search={query}'),
+]
+DEFAULT_SEARCH_ENGINE = 'g'
+SEARCH_KEYWORD_PREFIX = '@'  # "@w python"; bare keywords would catch queries like "y combinator"
+
+SITE_RULES = [
+    SiteRule('video', ('youtube.com',), '/watch', "Watched: {title}"),
+]
+
+class UrlClassifier:
+    def __init__(self, engines=SEARCH_ENGINES, site_rules=SITE_RULES, default_engine=DEFAULT_SEARCH_ENGINE):
+        # host -> [(path prefix, engine or rule)], so classifying a URL is a dict lookup
+        # per host label instead of a substring scan over every known site
+        self.hosts = defaultdict(list)
+        self.keywords = {}
+        self.default_engine = default_engine
+        for engine in engines:
+            self.register_engine(engine)
+        for rule in site_rules:
+            self.register_site(rule)
+
+    def register_engine(self, engine):
+        self.keywords[engine.keyword] = engine
+        for host in engine.hosts:
+            self.hosts[host].append((engine.path, engine))
+
+    def register_site(self, rule):
+        for host in rule.hosts:
+            self.hosts[host].append((rule.path, rule))
+
+    def rules_for(self, host):
+        labels = host.split('.')
+        for start in range(len(labels) - 1):
+            rules = self.hosts.get('.'.join(labels[start:]))
+            if rules:
+                return rules
+        return ()
+
+    def classify(self, url, title):
+        parts = urllib.parse.urlsplit(url)
+        for path, rule in self.rules_for((parts.hostname or '').lower()):
+            if path != '/' and not parts.path.startswith(path):
+                continue
+            if isinstance(rule, SearchEngine):
+                query = urllib.parse.parse_qs(parts.query).get(rule.query_param, [''])[0]
+                if not query and path == '/':
+                    continue
+                return 'search', f"Searched for: {query}" if query else f"{rule.name} Search"
+            return rule.kind, rule.template.format(title=title, url=url)
+
+        if not title or title == url:
+            domain = re.sub(r'^www\.', '', parts.netloc)
+            return 'page', f"Visited {domain}"
+        return 'page', title
+
+    def search_url(self, query, keyword=None):
+        engine = self.keywords.get(keyword or self.default_engine) or self.keywords[self.default_engine]
+        return engine.search_url.format(query=urllib.parse.quote_plus(query))
+
+    def keyword_search(self, text):
+        # "@w python" searches Wikipedia when "w" is a registered keyword
+        keyword, _, query = text.partition(' ')
+        if not keyword.startswith(SEARCH_KEYWORD_PREFIX):
+            return None
+        keyword = keyword[len(SEARCH_KEYWORD_PREFIX):]
+        if keyword in self.keywords and query.strip():
+            return self.search_url(query.strip(), keyword)
+        return None
+
+HISTORY_PARTITION_DIR = 'history'
+HISTORY_URLS_FILE = 'browser_history_urls.json'
+HISTORY_MAX_AGE_DAYS = 365
+HISTORY_MAX_VISITS = 200000
+HISTORY_SUMMARIZE_AFTER_DAYS = 90
+VISIT_DEDUP_SECONDS = 300
+
+class InternTable:
+    def __init__(self, values=()):
+        self.values = []
+        self.ids = {}
+        for value in values:
+            self.intern(value)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def intern(self, value):
+        index = self.ids.get(value)
+        if index is None:
+            index = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return index
+
+    def find(self, value):
+        return self.ids.get(value)
+
+class HistoryUrlTable:
+    def __init__(self, classifier):
+        self.classifier = classifier
+        # One slot per URL ever seen; parallel arrays instead of a dict per URL
+        self.urls = InternTable()
+        self.hosts = InternTable()
+        self.titles = InternTable()
+        self.host_ids = array('I')
+        self.title_ids = array('I')
+        self.visit_counts = array('I')
+        self.last_visits = array('d')
+        # (kind, display) per URL id, classified on first use and dropped when the title changes
+        self.classified = {}
+        self.live = 0
+        self.version = 0
+
+    def __len__(self):
+        return self.live
+
+    def __contains__(self, url):
+        url_id = self.urls.find(url)
+        return url_id is not None and self.visit_counts[url_id] > 0
+
+    def find(self, url):
+        return self.urls.find(url)
+
+    def add(self, url, title, timestamp, count=1):
+        url_id = self.urls.find(url)
+        if url_id is None:
+            url_id = self.urls.intern(url)
+            host = url.partition('://')[2].partition('/')[0]
+            self.host_ids.append(self.hosts.intern(host))
+            self.title_ids.append(self.titles.intern(title or url))
+            self.visit_counts.append(count)
+            self.last_visits.append(timestamp)
+            self.live += 1 if count else 0
+            self.version += 1
+            return url_id
+        if title:
+            self.set_title(url_id, title)
+        if count and not self.visit_counts[url_id]:
+            self.live += 1
+            self.version += 1
+        self.visit_counts[url_id] += count
+        if timestamp > self.last_visits[url_id]:
+            self.last_visits[url_id] = timestamp
+        return url_id
+
+    def add_many(self, urls, titles, last_visits, counts):
+        # add() for a whole partition at load time, with the lookups bound once
+        ids = self.urls.ids
+        values = self.urls.values
+        intern_host = self.hosts.intern
+        intern_title = self.titles.intern
+        url_ids = []
+        for url, timestamp, count in zip(urls, last_visits, counts):
+            url_id = ids.get(url)
+            if url_id is None:
+                url_id = ids[url] = len(values)
+                values.append(url)
+                self.host_ids.append(intern_host(url.partition('://')[2].partition('/')[0]))
+                self.title_ids.append(intern_title(titles.get(url) or url))
+                self.visit_counts.append(0)
+                self.last_visits.append(timestamp)
+            if count and not self.visit_counts[url_id]:
+                self.live += 1
+            self.visit_counts[url_id] += count
+            if timestamp > self.last_visits[url_id]:
+                self.last_visits[url_id] = timestamp
+            url_ids.append(url_id)
+        self.version += 1
+        return url_ids
+
+    def remove(self, url_id, count):
+        remaining = max(0, self.visit_counts[url_id] - count)
+        if self.visit_counts[url_id] and not remaining:
+            self.live -= 1
+            self.version += 1
+        self.visit_counts[url_id] = remaining
+
+    def title(self, url_id):
+        return self.titles[self.title_ids[url_id]]
+
+    def set_title(self, url_id, title):
+        title_id = self.titles.intern(title)
+        if self.title_ids[url_id] != title_id:
+            self.title_ids[url_id] = title_id
+            self.classified.pop(url_id, None)
+            self.version += 1
+
+    def classify(self, url_id):
+        result = self.classified.get(url_id)
+        if result is None:
+            result = self.classified[url_id] = self.classifier.classify(self.urls[url_id], self.title(url_id))
+        return result
+
+    def items(self):
+        for url_id, url in enumerate(self.urls.values):
+            if self.visit_counts[url_id]:
+                yield url, self.title(url_id)
+
+    def matching(self, text):
+        title_ids = {title_id for title_id, title in enumerate(self.titles.values) if text in title.lower()}
+        return {url_id for url_id, url in enumerate(self.urls.values)
+                if self.visit_counts[url_id] and (self.title_ids[url_id] in title_ids or text in url.lower())}
+
+class VisitColumns:
+    def __init__(self):
+        self.url_ids = array('I')
+        self.timestamps = array('d')
+        self.type_ids = array('B')
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def append(self, url_id, timestamp, type_id):
+        self.url_ids.append(url_id)
+        self.timestamps.append(timestamp)
+        self.type_ids.append(type_id)
+
+class HistoryRow:
+    # A visit read straight from the columns; fields are resolved when accessed,
+    # and item['url'] style access keeps it interchangeable with the SQLite dicts
+    def __init__(self, table, url_id, time, visit_type):
+        self.table = table
+        self.url_id = url_id
+        self.time = time
+        self.type = visit_type
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    @property
+    def url(self):
+        return self.table.urls[self.url_id]
+
+    @property
+    def title(self):
+        return self.table.title(self.url_id)
+
+    @property
+    def timestamp(self):
+        return datetime.fromtimestamp(self.time).isoformat()
+
+    @property
+    def kind(self):
+        return self.table.classify(self.url_id)[0]
+
+    @property
+    def display(self):
+        return self.table.classify(self.url_id)[1]
+
+class HistoryManager:
+    def __init__(self, persistence=None, journal_file='browser_history.jsonl', compact_threshold=256 * 1024,
+                 partition_dir=HISTORY_PARTITION_DIR, urls_file=HISTORY_URLS_FILE, max_age_days=HISTORY_MAX_AGE_DAYS,
+                 max_visits=HISTORY_MAX_VISITS, summarize_after_days=HISTORY_SUMMARIZE_AFTER_DAYS,
+                 classifier=None, build_index=True):
+        self.classifier = classifier or UrlClassifier()
+        # Unique URLs with their title and visit count; the visits themselves live in
+        # monthly partitions of array columns so whole months can be summarized or
+        # dropped at once
+        self.url_table = HistoryUrlTable(self.classifier)
+        self.visit_types = InternTable(('link', 'typed'))
+        self.partitions = {}
+        self.search_cache = None
+        self.dirty_partitions = set()
+        self.visit_total = 0
+        self.last_visit = None
+        self.legacy_history = False
+        self.persistence = persistence or PersistenceService()
+        # Visits are appended to the journal one line at a time and folded into the
+        # partitions once the journal grows past compact_threshold bytes
+        self.journal_file = journal_file
+        self.compact_threshold = compact_threshold
+        self.journal_size = 0
+        self.sequence = 0
+        self.partition_dir = partition_dir
+        # URL titles live in their own file, rewritten only when the set of URLs or a
+        # title changed since the last write
+        self.urls_file = urls_file
+        self.saved_urls_version = None
+        self.max_age_days = max_age_days
+        self.max_visits = max_visits
+        self.summarize_after_days = summarize_after_days
+        self.frecency = FrecencyScorer()
+        self.suggestion_index = SuggestionIndex()
+        self.load_from_file()
+        self.apply_retention()
+        if self.legacy_history or self.dirty_partitions or self.saved_urls_version is None:
+            self.save_to_file()
+        # The window builds the index after its first paint; until then completions are empty
+        if build_index:
+            self.build_suggestion_index()
+
+    def add_item(self, url, title, visit_type='link'):
+        if not title:
+            title = url
+        timestamp = time.time()
+        if self.is_duplicate_visit(url, timestamp):
+            # Redirect hops and reloads report the URL that was just recorded
+            self.last_visit = (url, timestamp)
+            self.set_title(url, title)
+            return False
+        self.last_visit = (url, timestamp)
+        item = {
+            'url': url,
+            'title': title,
+            'timestamp': datetime.fromtimestamp(timestamp).isoformat(),
+            'type': visit_type
+        }
+        self.add_visit(url, title, timestamp, visit_type)
+        self.update_suggestions(url, self.frecency.record_visit(url, timestamp, visit_type))
+        self.sequence += 1
+        self.append_to_journal(self.sequence, item)
+        return True
+
+    def is_duplicate_visit(self, url, timestamp):
+        return (self.last_visit is not None and self.last_visit[0] == url
+                and timestamp - self.last_visit[1] < VISIT_DEDUP_SECONDS)
+
+    @staticmethod
+    def partition_key(timestamp):
+        return datetime.fromtimestamp(timestamp).strftime('%Y-%m')
+
+    @staticmethod
+    def partition_end(key):
+        year, month = map(int, key.split('-'))
+        if month == 12:
+            year, month = year + 1, 1
+        else:
+            month += 1
+        return datetime(year, month, 1).timestamp()
+
+    def partition_path(self, key):
+        return os.path.join(self.partition_dir, key + '.json')
+
+    def add_visit(self, url, title, timestamp, visit_type):
+        key = self.partition_key(timestamp)
+        partition = self.partitions.get(key)
+        if partition is None:
+            partition = self.partitions[key] = {'seq': 0, 'visits': VisitColumns(), 'summary': None}
+        url_id = self.url_table.add(url, title, timestamp)
+        partition['visits'].append(url_id, timestamp, self.visit_types.intern(visit_type))
+        self.dirty_partitions.add(key)
+        self.visit_total += 1
+
+    def set_title(self, url, title):
+        url_id = self.url_table.find(url)
+        if url_id is not None:
+            self.url_table.set_title(url_id, title)
+
+    def apply_retention(self, now=None):
+        # Oldest months first; stops at the first month that is still kept in full,
+        # so a pass usually looks at one partition
+        now = now or time.time()
+        current = self.partition_key(now)
+        for key in sorted(self.partitions):
+            if key >= current:
+                break
+            age_days = (now - self.partition_end(key)) / 86400
+            partition = self.partitions[key]
+            if self.max_age_days is not None and age_days > self.max_age_days:
+                self.drop_partition(key)
+            elif not partition['visits']:
+                continue
+            elif ((self.summarize_after_days is not None and age_days > self.summarize_after_days)
+                  or (self.max_visits is not None and self.visit_total > self.max_visits)):
+                self.summarize_partition(key)
+            else:
+                break
+
+    def drop_partition(self, key):
+        partition = self.partitions.pop(key)
+        self.dirty_partitions.add(key)
+        visits = partition['visits']
+        for url_id, count in Counter(visits.url_ids).items():
+            self.url_table.remove(url_id, count)
+        self.visit_total -= len(visits)
+        for url, (count, timestamp, visit_type) in (partition['summary'] or {}).items():
+            url_id = self.url_table.find(url)
+            if url_id is not None:
+                self.url_table.remove(url_id, count)
+
+    def summarize_partition(self, key):
+        partition = self.partitions[key]
+        visits = partition['visits']
+        summary = dict(partition['summary'] or {})
+        for url_id, timestamp, type_id in zip(visits.url_ids, visits.timestamps, visits.type_ids):
+            url = self.url_table.urls[url_id]
+            count = summary[url][0] if url in summary else 0
+            summary[url] = [count + 1, timestamp, self.visit_types[type_id]]
+        self.visit_total -= len(visits)
+        self.partitions[key] = {'seq': partition['seq'], 'visits': VisitColumns(), 'summary': summary}
+        self.dirty_partitions.add(key)
+
+    def build_suggestion_index(self):
+        self.frecency = FrecencyScorer()
+        urls = self.url_table.urls
+        for key in sorted(self.partitions):
+            partition = self.partitions[key]
+            # A summarized month keeps one sample visit per URL plus its visit count
+            for url, (count, timestamp, visit_type) in (partition['summary'] or {}).items():
+                self.frecency.add_visit(url, timestamp, visit_type)
+                self.frecency.visit_counts[url] += count - 1
+            visits = partition['visits']
+            for url_id, timestamp, type_id in zip(visits.url_ids, visits.timestamps, visits.type_ids):
+                self.frecency.add_visit(urls[url_id], timestamp, self.visit_types[type_id])
+        self.frecency.rescore_all()
+        self.suggestion_index.build(self.frecency.scores)
+
+    def update_suggestions(self, url, score):
+        self.suggestion_index.set_score(url, score)
+
+    def decay_frecency(self):
+        changed = self.frecency.decay()
+        for url, score in changed.items():
+            self.suggestion_index.set_score(url, score)
+        return len(changed)
+
+    def get_frecency(self, url):
+        return self.frecency.scores.get(url, 0)
+
+    def top_sites(self, limit=8):
+        # Best-ranked URL per host, hosts ordered by their best frecency
+        sites = {}
+        for url, score in self.frecency.top(limit * 10):
+            host = re.sub(r'^www\.', '', urllib.parse.urlparse(url).netloc)
+            if host not in sites:
+                sites[host] = (url, score)
+        return list(sites.values())[:limit]
+
+    def iter_visits(self, offset=0, url_ids=None):
+        # Newest month first, each walked backwards; without a filter whole months
+        # are skipped by length, so a deep page doesn't touch the visits before it
+        for key in sorted(self.partitions, reverse=True):
+            visits = self.partitions[key]['visits']
+            if url_ids is None and offset >= len(visits):
+                offset -= len(visits)
+                continue
+            for index in range(len(visits) - 1, -1, -1):
+                url_id = visits.url_ids[index]
+                if url_ids is not None and url_id not in url_ids:
+                    continue
+                if offset:
+                    offset -= 1
+                    continue
+                yield HistoryRow(self.url_table, url_id, visits.timestamps[index],
+                                 self.visit_types[visits.type_ids[index]])
+
+    def get_items(self, limit=None, offset=0):
+        return list(itertools.islice(self.iter_visits(offset), limit))
+
+    def get_items_by_day(self, limit=None):
+        days = []
+        for item in self.get_items(limit):
+            day = item['timestamp'][:10]
+            if not days or days[-1][0] != day:
+                days.append((day, []))
+            days[-1][1].append(item)
+        return days
+
+    def search(self, text, limit=None, offset=0):
+        text = text.lower()
+        # Paging through one query reuses the matching URL ids until history changes
+        key = (text, self.url_table.version)
+        if self.search_cache is None or self.search_cache[0] != key:
+            self.search_cache = (key, self.url_table.matching(text))
+        return list(itertools.islice(self.iter_visits(offset, self.search_cache[1]), limit))
+
+    def get_display_text(self, url, title):
+        url_id = self.url_table.find(url)
+        if url_id is not None and self.url_table.title(url_id) == title:
+            return self.url_table.classify(url_id)[1]
+        return self.classifier.classify(url, title)[1]
+
+    def append_to_journal(self, sequence, item):
+        line = json.dumps({'seq': sequence, **item}) + '\n'
+        self.persistence.append(self.journal_file, line)
+        self.journal_size += len(line)
+        if self.journal_size >= self.compact_threshold:
+            self.save_to_file()
+
+    def snapshot_data(self):
+        snapshot = {
+            'history_seq': self.sequence
+        }
+        if self.legacy_history:
+            snapshot['history'] = None
+        if self.persistence.get('history_urls') is not None:
+            # Titles used to be kept in browser_data.json itself
+            snapshot['history_urls'] = None
+        if self.persistence.get('frequency') is not None:
+            # Word counts from before frecency ranking; nothing reads them any more
+            snapshot['frequency'] = None
+        return snapshot
+
+    def partition_data(self, partition):
+        # On disk each month lists its URLs once and refers to them by position
+        visits = partition['visits']
+        local_ids = {}
+        url_index = [local_ids.setdefault(url_id, len(local_ids)) for url_id in visits.url_ids]
+        return {
+            'seq': partition['seq'],
+            'urls': [self.url_table.urls[url_id] for url_id in local_ids],
+            'url_index': url_index,
+            'timestamps': visits.timestamps.tolist(),
+            'type_names': list(self.visit_types.values),
+            'type_ids': visits.type_ids.tolist(),
+            'summary': partition['summary']
+        }
+
+    def save_to_file(self):
+        self.apply_retention()
+        # Partitions go to the worker ahead of the snapshot; each records the journal
+        # sequence it includes so a crash between the two writes can't replay twice
+        for key in self.dirty_partitions:
+            partition = self.partitions.get(key)
+            if partition is None:
+                self.persistence.write_json(self.partition_path(key), None)
+            else:
+                partition['seq'] = self.sequence
+                self.persistence.write_json(self.partition_path(key), self.partition_data(partition))
+        self.dirty_partitions.clear()
+        if self.saved_urls_version != self.url_table.version:
+            self.persistence.write_json(self.urls_file, dict(self.url_table.items()))
+            self.saved_urls_version = self.url_table.version
+        # The worker writes the snapshot after any journal lines queued before it,
+        # then drops the lines the snapshot already covers
+        snapshot = self.snapshot_data()
+        self.legacy_history = False
+        self.persistence.update(snapshot, lambda: self.trim_journal(snapshot['history_seq']))
+        self.journal_size = 0
+
+    def trim_journal(self, sequence):
+        try:
+            with open(self.journal_file, 'r') as file:
+                lines = [line for line in file if self.journal_sequence(line) > sequence]
+        except FileNotFoundError:
+            return
+        if lines:
+            PersistenceService.write_atomic(self.journal_file, ''.join(lines))
+        else:
+            os.remove(self.journal_file)
+
+    @staticmethod
+    def journal_sequence(line):
+        try:
+            return json.loads(line).get('seq', 0)
+        except ValueError:
+            return 0
+
+    def load_partitions(self, titles):
+        try:
+            names = sorted(os.listdir(self.partition_dir))
+        except FileNotFoundError:
+            return
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.partition_dir, name), 'r') as file:
+                    data = json.load(file)
+            except (OSError, ValueError) as e:
+                print(f"Error loading history partition {name}: {e}")
+                continue
+            if 'url_index' not in data:
+                # Partitions written as [url, timestamp, type] rows
+                rows = data.get('visits', [])
+                data['urls'] = list(dict.fromkeys(row[0] for row in rows))
+                positions = {url: index for index, url in enumerate(data['urls'])}
+                data['url_index'] = [positions[row[0]] for row in rows]
+                data['timestamps'] = [row[1] for row in rows]
+                data['type_names'] = list(dict.fromkeys(row[2] for row in rows))
+                type_positions = {name: index for index, name in enumerate(data['type_names'])}
+                data['type_ids'] = [type_positions[row[2]] for row in rows]
+            self.partitions[name[:-5]] = {
+                'seq': data.get('seq', 0),
+                'visits': self.load_visits(data, titles),
+                'summary': data.get('summary')
+            }
+            for url, (count, timestamp, visit_type) in (data.get('summary') or {}).items():
+                self.url_table.add(url, titles.get(url), timestamp, count)
+
+    def load_visits(self, data, titles):
+        url_index = data['url_index']
+        timestamps = data['timestamps']
+        # Visits are in time order, so the last one seen for a URL is its latest
+        last_visit = dict(zip(url_index, timestamps))
+        counts = Counter(url_index)
+        indexes = range(len(data['urls']))
+        url_ids = self.url_table.add_many(data['urls'], titles, [last_visit.get(index, 0.0) for index in indexes],
+                                          [counts[index] for index in indexes])
+        type_ids = [self.visit_types.intern(name) for name in data['type_names']]
+        visits = VisitColumns()
+        visits.url_ids = array('I', [url_ids[index] for index in url_index])
+        visits.timestamps = array('d', timestamps)
+        visits.type_ids = array('B', [type_ids[index] for index in data['type_ids']])
+        self.visit_total += len(visits)
+        return visits
+
+    def migrate_legacy_history(self, items):
+        # browser_data.json used to hold every visit in one 'history' list
+        duplicates = 0
+        for item in sorted(items, key=lambda item: item['timestamp']):
+            timestamp = datetime.fromisoformat(item['timestamp']).timestamp()
+            if self.is_duplicate_visit(item['url'], timestamp):
+                duplicates += 1
+            else:
+                self.add_visit(item['url'], item['title'], timestamp, item.get('type', 'link'))
+            self.last_visit = (item['url'], timestamp)
+        self.last_visit = None
+        self.legacy_history = True
+        print(f"Migrated {len(items) - duplicates} history visits into {self.partition_dir}/ "
+              f"({duplicates} duplicates dropped)")
+
+    def load_from_file(self):
+        snapshot_sequence = self.persistence.get('history_seq', 0)
+        self.sequence = snapshot_sequence
+        try:
+            with open(self.urls_file, 'r') as file:
+                titles = json.load(file)
+        except FileNotFoundError:
+            titles = None
+        except ValueError as e:
+            print(f"Error loading {self.urls_file}: {e}")
+            titles = None
+        self.load_partitions(titles if titles is not None else self.persistence.get('history_urls', {}))
+        if titles is not None:
+            self.saved_urls_version = self.url_table.version
+        legacy_items = self.persistence.get('history')
+        if legacy_items:
+            self.migrate_legacy_history(legacy_items)
+
+        # Replay visits that were journaled after the snapshot was taken
+        try:
+            with open(self.journal_file, 'r') as file:
+                for line in file:
+                    self.journal_size += len(line)
+                    try:
+                        item = json.loads(line)
+                    except ValueError:
+                        # A crash mid-append can leave a torn last line
+                        continue
+                    sequence = item.pop('seq', 0)
+                    if sequence <= snapshot_sequence:
+                        continue
+                    self.sequence = max(self.sequence, sequence)
+                    timestamp = datetime.fromisoformat(item['timestamp']).timestamp()
+                    partition = self.partitions.get(self.partition_key(timestamp))
+                    if partition is not None and sequence <= partition['seq']:
+                        self.set_title(item['url'], item['title'])
+                        continue
+                    self.add_visit(item['url'], item['title'], timestamp, item.get('type', 'link'))
+        except FileNotFoundError:
+            pass
+
+HISTORY_BACKEND = 'json'  # or 'sqlite'
+
+class SQLiteHistoryManager(HistoryManager):
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS urls (
+        id INTEGER PRIMARY KEY,
+        url TEXT NOT NULL UNIQUE,
+        host TEXT NOT NULL,
+        title TEXT NOT NULL,
+        visit_count INTEGER NOT NULL DEFAULT 0,
+        last_visit REAL NOT NULL,
+        kind TEXT,
+        display TEXT
+    );
+    CREATE TABLE IF NOT EXISTS visits (
+        id INTEGER PRIMARY KEY,
+        url_id INTEGER NOT NULL REFERENCES urls(id) ON DELETE CASCADE,
+        title TEXT NOT NULL,
+        timestamp REAL NOT NULL,
+        visit_type TEXT NOT NULL DEFAULT 'link'
+    );
+    DROP TABLE IF EXISTS word_frequency;
+    CREATE INDEX IF NOT EXISTS visits_timestamp ON visits(timestamp);
+    CREATE INDEX IF NOT EXISTS visits_url_id ON visits(url_id);
+    CREATE INDEX IF NOT EXISTS urls_host ON urls(host);
+    """
+
+    FTS_SCHEMA = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS urls_fts USING fts5(title, url, content='urls', content_rowid='id');
+    CREATE TRIGGER IF NOT EXISTS urls_fts_insert AFTER INSERT ON urls BEGIN
+        INSERT INTO urls_fts(rowid, title, url) VALUES (new.id, new.title, new.url);
+    END;
+    CREATE TRIGGER IF NOT EXISTS urls_fts_delete AFTER DELETE ON urls BEGIN
+        INSERT INTO urls_fts(urls_fts, rowid, title, url) VALUES ('delete', old.id, old.title, old.url);
+    END;
+    CREATE TRIGGER IF NOT EXISTS urls_fts_update AFTER UPDATE OF title, url ON urls BEGIN
+        INSERT INTO urls_fts(urls_fts, rowid, title, url) VALUES ('delete', old.id, old.title, old.url);
+        INSERT INTO urls_fts(rowid, title, url) VALUES (new.id, new.title, new.url);
+    END;
+    """
+
+    RETENTION_BATCH = 5000
+
+    def __init__(self, persistence=None, database_file='browser_history.db', build_index=True):
+        self.database_file = database_file
+        self.connection = sqlite3.connect(database_file)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self.connection.executescript(self.SCHEMA)
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(visits)")]
+        if 'visit_type' not in columns:
+            self.connection.execute("ALTER TABLE visits ADD COLUMN visit_type TEXT NOT NULL DEFAULT 'link'")
+        url_columns = [row[1] for row in self.connection.execute("PRAGMA table_info(urls)")]
+        for column in ('kind', 'display'):
+            if column not in url_columns:
+                self.connection.execute(f"ALTER TABLE urls ADD COLUMN {column} TEXT")
+        try:
+            self.connection.executescript(self.FTS_SCHEMA)
+            self.has_fts = True
+        except sqlite3.OperationalError:
+            # SQLite builds without FTS5 fall back to LIKE queries in search()
+            self.has_fts = False
+        super().__init__(persistence, build_index=build_index)
+
+    def add_item(self, url, title, visit_type='link'):
+        timestamp = time.time()
+        if self.is_duplicate_visit(url, timestamp):
+            self.last_visit = (url, timestamp)
+            kind, display = self.classifier.classify(url, title or url)
+            with self.connection:
+                self.connection.execute("UPDATE urls SET title = ?, kind = ?, display = ? WHERE url = ?",
+                                        (title or url, kind, display, url))
+            return False
+        self.last_visit = (url, timestamp)
+        with self.connection:
+            self.insert_visit(url, title or url, timestamp, visit_type)
+        self.update_suggestions(url, self.frecency.record_visit(url, timestamp, visit_type))
+        return True
+
+    def insert_visit(self, url, title, timestamp, visit_type='link'):
+        host = re.sub(r'^www\.', '', urllib.parse.urlparse(url).netloc.lower())
+        kind, display = self.classifier.classify(url, title)
+        self.connection.execute("""
+            INSERT INTO urls (url, host, title, visit_count, last_visit, kind, display) VALUES (?, ?, ?, 1, ?, ?, ?)
+            ON CONFLICT(url) DO UPDATE SET title = excluded.title, visit_count = visit_count + 1,
+                last_visit = MAX(last_visit, excluded.last_visit), kind = excluded.kind, display = excluded.display
+        """, (url, host, title, timestamp, kind, display))
+        url_id = self.connection.execute("SELECT id FROM urls WHERE url = ?", (url,)).fetchone()[0]
+        self.connection.execute("INSERT INTO visits (url_id, title, timestamp, visit_type) VALUES (?, ?, ?, ?)",
+                                (url_id, title, timestamp, visit_type))
+
+    def build_suggestion_index(self):
+        self.frecency = FrecencyScorer()
+        rows = self.connection.execute("""
+            SELECT urls.url, visits.timestamp, visits.visit_type FROM visits
+            JOIN urls ON urls.id = visits.url_id
+            ORDER BY visits.timestamp
+        """)
+        for url, timestamp, visit_type in rows:
+            self.frecency.add_visit(url, timestamp, visit_type)
+        # urls keeps the full count even after retention removed the old visit rows
+        for url, visit_count, last_visit in self.connection.execute("SELECT url, visit_count, last_visit FROM urls"):
+            if url not in self.frecency.samples:
+                self.frecency.add_visit(url, last_visit)
+            self.frecency.visit_counts[url] = visit_count
+        self.frecency.rescore_all()
+        self.suggestion_index.build(self.frecency.scores)
+
+    def row_to_item(self, row):
+        kind, display = row[3], row[4]
+        if display is None:
+            # Rows written before classification was stored
+            kind, display = self.classifier.classify(row[0], row[1])
+        return {
+            'url': row[0],
+            'title': row[1],
+            'timestamp': datetime.fromtimestamp(row[2]).isoformat(),
+            'kind': kind,
+            'display': display
+        }
+
+    def get_items(self, limit=None, offset=0):
+        rows = self.connection.execute("""
+            SELECT urls.url, visits.title, visits.timestamp, urls.kind, urls.display FROM visits
+            JOIN urls ON urls.id = visits.url_id
+            ORDER BY visits.timestamp DESC LIMIT ? OFFSET ?
+        """, (-1 if limit is None else limit, offset))
+        return [self.row_to_item(row) for row in rows]
+
+    def get_items_by_day(self, limit=None):
+        days = []
+        rows = self.connection.execute("""
+            SELECT urls.url, visits.title, visits.timestamp, urls.kind, urls.display,
+                   date(visits.timestamp, 'unixepoch', 'localtime') AS day FROM visits
+            JOIN urls ON urls.id = visits.url_id
+            ORDER BY visits.timestamp DESC LIMIT ?
+        """, (-1 if limit is None else limit,))
+        for row in rows:
+            if not days or days[-1][0] != row[5]:
+                days.append((row[5], []))
+            days[-1][1].append(self.row_to_item(row))
+        return days
+
+    def get_items_for_host(self, host, limit=None):
+        rows = self.connection.execute("""
+            SELECT urls.url, visits.title, visits.timestamp, urls.kind, urls.display FROM urls
+            JOIN visits ON visits.url_id = urls.id
+            WHERE urls.host = ?
+            ORDER BY visits.timestamp DESC LIMIT ?
+        """, (re.sub(r'^www\.', '', host.lower()), -1 if limit is None else limit))
+        return [self.row_to_item(row) for row in rows]
+
+    def search(self, text, limit=None, offset=0):
+        terms = re.findall(r'\w+', text)
+        if not terms:
+            return []
+        if self.has_fts:
+            query = ' '.join('"' + term + '"*' for term in terms)
+            rows = self.connection.execute("""
+                SELECT urls.url, urls.title, urls.last_visit, urls.kind, urls.display FROM urls_fts
+                JOIN urls ON urls.id = urls_fts.rowid
+                WHERE urls_fts MATCH ?
+                ORDER BY urls.last_visit DESC LIMIT ? OFFSET ?
+            """, (query, -1 if limit is None else limit, offset))
+        else:
+            pattern = '%' + text.replace('%', '').replace('_', '') + '%'
+            rows = self.connection.execute("""
+                SELECT url, title, last_visit, kind, display FROM urls
+                WHERE url LIKE ? OR title LIKE ?
+                ORDER BY last_visit DESC LIMIT ? OFFSET ?
+            """, (pattern, pattern, -1 if limit is None else limit, offset))
+        return [self.row_to_item(row) for row in rows]
+
+    def apply_retention(self, now=None):
+        # Old visit rows are deleted in batches; the urls row keeps the aggregate
+        # visit_count and last_visit, which is this backend's summarized form
+        now = now or time.time()
+        with self.connection:
+            if self.summarize_after_days is not None:
+                self.connection.execute("""
+                    DELETE FROM visits WHERE id IN (
+                        SELECT id FROM visits WHERE timestamp < ? ORDER BY timestamp LIMIT ?)
+                """, (now - self.summarize_after_days * 86400, self.RETENTION_BATCH))
+            if self.max_visits is not None:
+                excess = self.connection.execute("SELECT COUNT(*) FROM visits").fetchone()[0] - self.max_visits
+                if excess > 0:
+                    self.connection.execute("""
+                        DELETE FROM visits WHERE id IN (SELECT id FROM visits ORDER BY timestamp LIMIT ?)
+                    """, (min(excess, self.RETENTION_BATCH),))
+            if self.max_age_days is not None:
+                self.connection.execute("DELETE FROM urls WHERE last_visit < ?",
+                                        (now - self.max_age_days * 86400,))
+
+    def save_to_file(self):
+        self.apply_retention()
+        self.connection.commit()
+
+    def load_from_file(self):
+        # user_version 1 records that the JSON history was imported; retention can
+        # empty visits later, so that is no sign the import is still to do. Databases
+        # filled before the flag existed are recognised by their urls rows
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] < 1:
+            if self.connection.execute("SELECT 1 FROM urls LIMIT 1").fetchone() is None:
+                self.import_json_history()
+            self.connection.execute("PRAGMA user_version = 1")
+            self.connection.commit()
+
+    def import_json_history(self):
+        # Reuse the JSON loader so journaled visits newer than the snapshot come along
+        HistoryManager.load_from_file(self)
+        items = HistoryManager.get_items(self)
+        summaries = [(url, self.url_table.title(self.url_table.find(url)), count, timestamp)
+                     for partition in self.partitions.values()
+                     for url, (count, timestamp, visit_type) in (partition['summary'] or {}).items()]
+        self.url_table = HistoryUrlTable(self.classifier)
+        self.partitions, self.visit_total = {}, 0
+        self.dirty_partitions.clear()
+        self.legacy_history = False
+        if not items and not summaries:
+            return
+        with self.connection:
+            for item in items:
+                timestamp = datetime.fromisoformat(item['timestamp']).timestamp()
+                self.insert_visit(item['url'], item['title'] or item['url'], timestamp, item.get('type', 'link'))
+            # Summarized months only carry per-URL totals, which map onto the urls table
+            for url, title, count, timestamp in summaries:
+                host = re.sub(r'^www\.', '', urllib.parse.urlparse(url).netloc.lower())
+                self.connection.execute("""
+                    INSERT INTO urls (url, host, title, visit_count, last_visit, kind, display)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(url) DO UPDATE SET visit_count = visit_count + excluded.visit_count,
+                        last_visit = MAX(last_visit, excluded.last_visit)
+                """, (url, host, title, count, timestamp, *self.classifier.classify(url, title)))
+        print(f"Imported {len(items)} history items and {len(summaries)} summarized URLs into {self.database_file}")
+
+# Colours for the whole UI; the stylesheet and the palette are both derived from these
+THEME = {
+    'window': '#1a1a1a',
+    'surface': '#2b2b2b',
+    'surface_hover': '#333',
+    'item_hover': '#444',
+    'border': '#222',
+    'text': '#fff',
+    'text_muted': '#bbb',
+    'accent': '#0066cc',
+    'link': '#4285f4',
+    'history_header': '#aaa',
+    'history_link': '#4a9eff',
+}
+
+# With palette backgrounds the sheet drops its catch-all QWidget rule, so plain
+# widgets are painted from the palette instead of being styled one by one
+THEME_PALETTE_BACKGROUNDS = False
+
+def build_stylesheet(theme, palette_backgrounds=False):
+    # Widgets that need their own look carry an object name (navBar, urlBar, navButton,
+    # newTabButton, historyList) instead of a stylesheet of their own
+    base = "" if palette_backgrounds else """
+    QMainWindow, QWidget {{
+        background: {window};
+        color: {text};
+    }}"""
+    return (base + """
+    QTabWidget::pane {{
+        border: none;
+        background: {window};
+        margin-top: -1px;
+    }}
+    QTabWidget {{
+        padding-top: 0px;
+        background: {window};
+    }}
+    QTabBar {{
+        background: {window};
+    }}
+    QTabBar::tab {{
+        background: rgba(255, 255, 255, 0.05);
+        color: {text_muted};
+        padding: 8px 12px;
+        margin: 4px 1px 0px 1px;
+        border-radius: 8px 8px 0 0;
+        min-width: 50px;
+        max-width: 150px;
+    }}
+    QTabBar::tab:selected {{
+        background: rgba(255, 255, 255, 0.1);
+        color: {text};
+        font-weight: bold;
+    }}
+    QTabBar::tab:hover:!selected {{
+        background: rgba(255, 255, 255, 0.07);
+        color: {text};
+    }}
+    QTabBar::close-button {{
+        image: none;
+        subcontrol-position: right;
+        subcontrol-origin: padding;
+        margin-right: 4px;
+    }}
+    QPushButton {{
+        background-color: transparent;
+        color: {text};
+        padding: 4px 12px;
+        border-radius: 6px;
+    }}
+    QPushButton:hover {{
+        background-color: rgba(255, 255, 255, 0.1);
+    }}
+    QPushButton:pressed {{
+        background-color: rgba(255, 255, 255, 0.05);
+    }}
+    QPushButton:disabled {{
+        color: rgba(255, 255, 255, 0.3);
+    }}
+    QWidget#navBar {{
+        background: {window};
+        border-bottom: 1px solid rgba(255, 255, 255, 0.1);
+        border-radius: 12px;
+    }}
+    QPushButton#navButton {{
+        padding: 0;
+        border-radius: 16px;
+        margin: 8px 4px;
+        min-width: 32px;
+        max-width: 32px;
+        min-height: 32px;
+        max-height: 32px;
+        font-size: 14px;
+        font-weight: 400;
+    }}
+    QPushButton#newTabButton {{
+        padding: 5px;
+        border-radius: 15px;
+        margin: 0px 8px 0px 2px;
+        min-width: 30px;
+        max-width: 30px;
+        min-height: 28px;
+        max-height: 28px;
+        font-size: 18px;
+        font-weight: 400;
+    }}
+    QLineEdit {{
+        background-color: {surface};
+        color: {text};
+        padding: 4px 10px;
+        border-radius: 6px;
+        border: 1px solid {border};
+        margin: 4px;
+        font-size: 13px;
+        selection-background-color: {accent};
+    }}
+    QLineEdit:focus {{
+        border: 1px solid {accent};
+        background-color: {surface_hover};
+    }}
+    QLineEdit:hover {{
+        background-color: {surface_hover};
+    }}
+    QListView#historyList {{
+        background-color: {surface};
+        border: none;
+        font-size: 13px;
+    }}
+    QListView#historyList::item {{
+        padding: 8px 12px;
+        border-radius: 4px;
+    }}
+    QListView#historyList::item:hover {{
+        background-color: {item_hover};
+    }}
+    QListView#historyList::item:selected {{
+        background-color: {surface_hover};
+    }}
+    """).format(**theme)
+
+def build_palette(theme):
+    palette = QPalette()
+    window = QColor(theme['window'])
+    raised = window.lighter(135)
+    for role, color in (
+            (QPalette.ColorRole.Window, window),
+            (QPalette.ColorRole.WindowText, QColor(theme['text'])),
+            (QPalette.ColorRole.Base, window),
+            (QPalette.ColorRole.AlternateBase, raised),
+            (QPalette.ColorRole.ToolTipBase, QColor(theme['text'])),
+            (QPalette.ColorRole.ToolTipText, QColor(theme['text'])),
+            (QPalette.ColorRole.Text, QColor(theme['text'])),
+            (QPalette.ColorRole.PlaceholderText, QColor(255, 255, 255, 128)),
+            (QPalette.ColorRole.Button, raised),
+            (QPalette.ColorRole.ButtonText, QColor(theme['text'])),
+            (QPalette.ColorRole.Link, QColor(theme['link'])),
+            (QPalette.ColorRole.Highlight, QColor(theme['link'])),
+            (QPalette.ColorRole.HighlightedText, QColor(theme['text']))):
+        palette.setColor(role, color)
+    return palette
+
+@functools.lru_cache(maxsize=None)
+def get_styles():
+    # Parsed by Qt once, on the main window; every tab shares it
+    return build_stylesheet(THEME, THEME_PALETTE_BACKGROUNDS)
+
+FILTER_LIST_DIR = 'filter_lists'
+
+DEFAULT_TRACKER_LIST = [
+    "google-analytics.com", "analytics.google.com", "googletagmanager.com",
+    "doubleclick.net", "googleadservices.com", "googlesyndication.com",
+    "facebook.com", "facebook.net", "fbcdn.net", "fbevents.com", "omtrdc.net",
+    "demdex.net", "twitter.com", "twimg.com", "t.co", "linkedin.com",
+    "licdn.com", "snap.licdn.com", "clarity.ms", "hotjar.com", "hotjar.io",
+    "mixpanel.com", "segment.com", "segment.io", "crazyegg.com", "hubspot.com",
+    "hs-analytics.net", "hs-scripts.com", "newrelic.com", "pinterest.com",
+    "pinimg.com", "yandex.ru", "mc.yandex.ru", "bat.bing.com", "scorecardresearch.com",
+    "quantserve.com", "chartbeat.com", "chartbeat.net", "outbrain.com", "taboola.com",
+    "addthis.com", "addthisedge.com", "disqus.com", "disquscdn.com", "optimizely.com",
+    "criteo.com", "criteo.net", "appnexus.com", "adnxs.com", "bluekai.com",
+    "sharethis.com", "matomo.cloud", "matomo.org", "amplitude.com", "api.amplitude.com",
+    "cdn.amplitude.com", "analytics.tiktok.com", "analytics-sg.tiktok.com",
+    "business-api.tiktok.com", "ads-api.tiktok.com", "pixel.facebook.com",
+    "an.facebook.com", "pixel-a.basis.net", "pixel-sync.sitescout.com",
+    "pixel.tapad.com", "pixel.advertising.com", "pixel.mathtag.com", "id5-sync.com",
+    "match.adsrvr.org", "secure.adnxs.com", "pixel.rubiconproject.com",
+    "analytics.yahoo.com", "sp.analytics.yahoo.com", "udc.yahoo.com",
+    "log.outbrain.com", "amplify.outbrain.com", "widgets.outbrain.com",
+    "snowplow.io", "collector.snowplow.io", "plausible.io", "collector.plausible.io",
+    "analytics.heap.io", "tracking.monsido.com", "cdn.mouseflow.com", "tools.mouseflow.com",
+    "stats.wp.com", "pixel.wp.com", "s.pinimg.com", "trk.pinterest.com",
+    "analytics.pinterest.com", "log.pinterest.com", "adservice.google.com",
+    "adservice.google.com.au", "googlesurvey.com", "moatads.com", "tapad.com",
+    "everesttech.net", "quantcast.com", "adsrvr.org", "advertising.com",
+    "adobedtm.com", "adform.net", "openx.net", "adroll.com",
+    "exelator.com", "zqtk.net", "revcontent.com", "3lift.com", "bidswitch.net",
+    "adnuntius.com", "adscale.de", "mediamath.com", "admedo.com", "connexity.net",
+    "smartadserver.com", "spotxchange.com", "rubiconproject.com", "gumgum.com",
+    "yieldlab.net", "pubmatic.com", "simpli.fi", "adacado.com", "bidgear.com",
+    "bidr.trellian.com", "rtbhouse.com", "triplelift.com", "loopme.com",
+    "casalemedia.com", "eyeota.net", "adsymptotic.com", "adtech.de", "trustx.org",
+    "deepintent.com", "beeswax.com", "stackadapt.com", "districtm.io",
+    "adlightning.com", "brightmountainmedia.com", "yieldmo.com", "media.net",
+    "connatix.com", "teads.tv", "revtrax.com", "revx.io",
+    "neustar.biz", "dstillery.com", "intent.com", "fifty.io", "adloox.com",
+    "onead.io", "liftoff.io", "zedo.com", "exponential.com", "parsely.com",
+    "ezoic.com", "permutive.com", "zeotap.com"
+]
+
+class HostMatcher:
+    def __init__(self, hosts=()):
+        self.hosts = set()
+        for host in hosts:
+            self.add(host)
+
+    def __len__(self):
+        return len(self.hosts)
+
+    def add(self, host):
+        host = host.strip().lower().strip('.')
+        if host:
+            self.hosts.add(host)
+
+    def matches(self, host):
+        # Walk the label suffixes (a.b.example.com -> b.example.com -> example.com -> com)
+        # so the cost depends on the host's depth, not on the size of the list
+        host = host.lower().rstrip('.')
+        while host:
+            if host in self.hosts:
+                return True
+            dot = host.find('.')
+            if dot < 0:
+                break
+            host = host[dot + 1:]
+        return False
+
+HOSTS_FILE_ADDRESSES = {'0.0.0.0', '127.0.0.1', '::', '::1'}
+
+def parse_host_entry(line):
+    # Accepts hosts-file lines ("0.0.0.0 ads.example.com"), bare domains and "||domain^"
+    line = line.split('#', 1)[0].strip()
+    if not line or line.startswith('!'):
+        return None
+    parts = line.split()
+    if len(parts) == 2 and parts[0] in HOSTS_FILE_ADDRESSES:
+        line = parts[1]
+    elif len(parts) != 1:
+        return None
+    if line.startswith('||') and line.endswith('^'):
+        line = line[2:-1]
+    line = line.lower().strip('.')
+    if line in ('localhost', 'localhost.localdomain', 'broadcasthost', '0.0.0.0'):
+        return None
+    return line if re.fullmatch(r'[a-z0-9_-]+(\.[a-z0-9_-]+)+', line) else None
+
+def host_hash(host):
+    return int.from_bytes(hashlib.blake2b(host.encode(), digest_size=8).digest(), 'little')
+
+class BinaryHostList:
+    # File layout: 8-byte magic, uint32 version, uint32 reserved, uint64 count,
+    # uint64 filter_count, then `count` and `filter_count` sorted little-endian
+    # uint64 host hashes. The first set blocks every request to the host like a
+    # hosts file; the second holds "||host^" entries, which leave documents alone
+    MAGIC = b'STRATBL\0'
+    VERSION = 2
+    HEADER = struct.Struct('<8sIIQQ')
+    V1_HEADER = struct.Struct('<8sIIQ')
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise ValueError(f"{path} is empty")
+        magic, version, _, count = self.V1_HEADER.unpack_from(self.map, 0)
+        if magic != self.MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a compiled blocklist")
+        if version == 1:
+            # Compiled before "||host^" entries were kept apart; everything blocks documents too
+            offset, filter_count = self.V1_HEADER.size, 0
+        elif version == self.VERSION:
+            offset, filter_count = self.HEADER.size, self.HEADER.unpack_from(self.map, 0)[4]
+        else:
+            self.close()
+            raise ValueError(f"{path} has unsupported blocklist version {version}")
+        if len(self.map) < offset + (count + filter_count) * 8:
+            self.close()
+            raise ValueError(f"{path} is truncated")
+        self.hashes = self.read_hashes(offset, count)
+        self.filter_hashes = self.read_hashes(offset + count * 8, filter_count)
+
+    def read_hashes(self, offset, count):
+        if sys.byteorder == 'little':
+            # Zero-copy view over the mapping, so bisect runs against the page cache
+            return memoryview(self.map)[offset:offset + count * 8].cast('Q')
+        hashes = array('Q', self.map[offset:offset + count * 8])
+        hashes.byteswap()
+        return hashes
+
+    def __len__(self):
+        return len(self.hashes) + len(self.filter_hashes)
+
+    @staticmethod
+    def contains(hashes, host):
+        value = host_hash(host)
+        index = bisect.bisect_left(hashes, value)
+        return index < len(hashes) and hashes[index] == value
+
+    def find(self, hashes, host):
+        if not len(hashes):
+            return False
+        host = host.lower().rstrip('.')
+        while host:
+            if self.contains(hashes, host):
+                return True
+            dot = host.find('.')
+            if dot < 0:
+                break
+            host = host[dot + 1:]
+        return False
+
+    def matches(self, host):
+        return self.find(self.hashes, host)
+
+    def matches_filter(self, host):
+        return self.find(self.filter_hashes, host)
+
+    def close(self):
+        for hashes in (getattr(self, 'hashes', None), getattr(self, 'filter_hashes', None)):
+            if isinstance(hashes, memoryview):
+                hashes.release()
+        self.map.close()
+        self.file.close()
+
+    @classmethod
+    def compile(cls, input_paths, output_path):
+        hashes = set()
+        filter_hashes = set()
+        for path in input_paths:
+            with open(path, 'r', encoding='utf-8', errors='ignore') as file:
+                for line in file:
+                    host = parse_host_entry(line)
+                    if host:
+                        # Same meaning as in a text list: "||host^" leaves documents alone
+                        (filter_hashes if line.lstrip().startswith('||') else hashes).add(host_hash(host))
+        filter_hashes -= hashes
+        with open(output_path + '.tmp', 'wb') as file:
+            file.write(cls.HEADER.pack(cls.MAGIC, cls.VERSION, 0, len(hashes), len(filter_hashes)))
+            for values in (hashes, filter_hashes):
+                values = array('Q', sorted(values))
+                if sys.byteorder != 'little':
+                    values.byteswap()
+                values.tofile(file)
+        os.replace(output_path + '.tmp', output_path)
+        return len(hashes) + len(filter_hashes)
+
+FILTER_RESOURCE_TYPES = {
+    QWebEngineUrlRequestInfo.ResourceType.ResourceTypeMainFrame: 'document',
+    QWebEngineUrlRequestInfo.ResourceType.ResourceTypeSubFrame: 'subdocument',
+    QWebEngineUrlRequestInfo.ResourceType.ResourceTypeStylesheet: 'stylesheet',
+    QWebEngineUrlRequestInfo.ResourceType.ResourceTypeScript: 'script',
+    QWebEngineUrlRequestInfo.ResourceType.ResourceTypeImage: 'image',
+    QWebEngineUrlRequestInfo.ResourceType.ResourceTypeFontResource: 'font',
+    QWebEngineUrlRequestInfo.ResourceType.ResourceTypeObject: 'object',
+    QWebEngineUrlRequestInfo.ResourceType.ResourceTypeMedia: 'media',
+    QWebEngineUrlRequestInfo.ResourceType.ResourceTypeWorker: 'script',
+    QWebEngineUrlRequestInfo.ResourceType.ResourceTypeSharedWorker: 'script',
+    QWebEngineUrlRequestInfo.ResourceType.ResourceTypeServiceWorker: 'script',
+    QWebEngineUrlRequestInfo.ResourceType.ResourceTypeFavicon: 'image',
+    QWebEngineUrlRequestInfo.ResourceType.ResourceTypeXhr: 'xmlhttprequest',
+    QWebEngineUrlRequestInfo.ResourceType.ResourceTypePing: 'ping',
+    QWebEngineUrlRequestInfo.ResourceType.ResourceTypePluginResource: 'object',
+}
+
+FILTER_TYPE_OPTIONS = {
+    'script', 'image', 'stylesheet', 'object', 'xmlhttprequest', 'subdocument',
+    'ping', 'websocket', 'font', 'media', 'other', 'document',
+}
+
+FILTER_OPTION_ALIASES = {
+    'xhr': 'xmlhttprequest', 'css': 'stylesheet', 'frame': 'subdocument',
+    '3p': 'third-party', '1p': '~third-party', 'first-party': '~third-party',
+}
+
+# Options that only make sense for cosmetic filtering, popups or response rewriting;
+# the request interceptor can't honour them, so rules using them are skipped
+FILTER_IGNORED_OPTIONS = {'popup', 'elemhide', 'generichide', 'genericblock', 'csp', 'redirect', 'rewrite'}
+
+# Tokens shared by most URLs make poor index keys
+COMMON_FILTER_TOKENS = {'http', 'https', 'www', 'com', 'net', 'org', 'js', 'html', 'php', 'cdn'}
+
+SECOND_LEVEL_LABELS = {'co', 'com', 'net', 'org', 'gov', 'edu', 'ac'}
+
+def registrable_domain(host):
+    labels = host.lower().rstrip('.').split('.')
+    if len(labels) > 2 and len(labels[-1]) == 2 and labels[-2] in SECOND_LEVEL_LABELS:
+        return '.'.join(labels[-3:])
+    return '.'.join(labels[-2:])
+
+HostVerdict = namedtuple('HostVerdict', ['blocks_all', 'blocks_subresources', 'third_party', 'document_allowed'])
+
+class FilterRule:
+    def __init__(self, text, regex, types, third_party, include_domains, exclude_domains):
+        self.text = text
+        self.regex = regex
+        self.types = types
+        self.third_party = third_party
+        self.include_domains = include_domains
+        self.exclude_domains = exclude_domains
+
+    def matches(self, url, first_party_host, resource_type, third_party):
+        if resource_type not in self.types:
+            return False
+        if self.third_party is not None and self.third_party != third_party:
+            return False
+        if self.include_domains is not None and not self.include_domains.matches(first_party_host):
+            return False
+        if self.exclude_domains is not None and self.exclude_domains.matches(first_party_host):
+            return False
+        return self.regex.search(url) is not None
+
+class FilterIndex:
+    def __init__(self):
+        self.buckets = defaultdict(list)
+        self.untokenized = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, rule, tokens):
+        self.count += 1
+        if not tokens:
+            self.untokenized.append(rule)
+            return
+        # Prefer the token with the fewest rules already filed under it
+        token = min(tokens, key=lambda t: (t in COMMON_FILTER_TOKENS, len(self.buckets.get(t, ())), -len(t)))
+        self.buckets[token].append(rule)
+
+    def find(self, url, url_tokens, first_party_host, resource_type, third_party):
+        for token in url_tokens:
+            for rule in self.buckets.get(token, ()):
+                if rule.matches(url, first_party_host, resource_type, third_party):
+                    return rule
+        for rule in self.untokenized:
+            if rule.matches(url, first_party_host, resource_type, third_party):
+                return rule
+        return None
+
+class FilterEngine:
+    def __init__(self):
+        # Plain host entries block every request to the host, including top-level navigations
+        self.blocked_hosts = HostMatcher()
+        # Bare "||host^" filters follow Adblock Plus semantics and leave documents alone
+        self.filter_hosts = HostMatcher()
+        # Compiled, memory-mapped host lists hold both kinds, kept apart so an entry
+        # blocks the same requests whether its list was compiled or not
+        self.host_lists = []
+        self.block_rules = FilterIndex()
+        self.exception_rules = FilterIndex()
+        self.has_document_exceptions = False
+
+    def __len__(self):
+        return (len(self.blocked_hosts) + len(self.filter_hosts) + sum(len(hosts) for hosts in self.host_lists)
+                + len(self.block_rules) + len(self.exception_rules))
+
+    def add_hosts(self, hosts):
+        for host in hosts:
+            self.blocked_hosts.add(host)
+
+    def load_file(self, path):
+        count = 0
+        try:
+            with open(path, 'r', encoding='utf-8', errors='ignore') as file:
+                for line in file:
+                    if self.add_filter(line):
+                        count += 1
+        except OSError as e:
+            print(f"Error loading filter list {path}: {e}")
+        return count
+
+    def load_directory(self, path):
+        count = 0
+        try:
+            names = sorted(os.listdir(path))
+        except FileNotFoundError:
+            return 0
+        for name in names:
+            if name.endswith('.txt'):
+                count += self.load_file(os.path.join(path, name))
+            elif name.endswith('.bin'):
+                count += self.load_host_list(os.path.join(path, name))
+        return count
+
+    def load_host_list(self, path):
+        try:
+            host_list = BinaryHostList(path)
+        except (OSError, ValueError) as e:
+            print(f"Error loading compiled blocklist {path}: {e}")
+            return 0
+        self.host_lists.append(host_list)
+        return len(host_list)
+
+    def add_filter(self, line):
+        line = line.strip()
+        if not line or line.startswith('!') or line.startswith('['):
+            return False
+        # Element hiding rules are handled by the page, not the request interceptor
+        if '##' in line or '#@#' in line or '#?#' in line or '#$#' in line:
+            return False
+        if line.split(None, 1)[0] in HOSTS_FILE_ADDRESSES:
+            host = parse_host_entry(line)
+            if host:
+                self.blocked_hosts.add(host)
+            return host is not None
+
+        exception = line.startswith('@@')
+        if exception:
+            line = line[2:]
+
+        pattern, options = line, ''
+        if '$' in line and not (line.startswith('/') and line.endswith('/')):
+            pattern, options = line.rsplit('$', 1)
+
+        types = None
+        excluded_types = set()
+        third_party = None
+        include_domains = exclude_domains = None
+        match_case = False
+        for option in filter(None, options.lower().split(',')):
+            option = FILTER_OPTION_ALIASES.get(option, option)
+            negated = option.startswith('~')
+            name = option.lstrip('~')
+            name = FILTER_OPTION_ALIASES.get(name, name)
+            if name in FILTER_TYPE_OPTIONS:
+                if negated:
+                    excluded_types.add(name)
+                else:
+                    types = (types or set()) | {name}
+            elif name in ('third-party', '~third-party'):
+                third_party = not negated if name == 'third-party' else negated
+            elif name.startswith('domain='):
+                for domain in name[len('domain='):].split('|'):
+                    if domain.startswith('~'):
+                        exclude_domains = exclude_domains or HostMatcher()
+                        exclude_domains.add(domain[1:])
+                    else:
+                        include_domains = include_domains or HostMatcher()
+                        include_domains.add(domain)
+            elif name == 'match-case':
+                match_case = True
+            elif name == 'important':
+                continue
+            elif name.partition('=')[0] in FILTER_IGNORED_OPTIONS:
+                return False
+            else:
+                # Unknown or unsupported option: skipping the rule is safer than widening it
+                return False
+
+        if types is None:
+            types = FILTER_TYPE_OPTIONS - {'document'}
+        types = frozenset(types - excluded_types)
+        if not types:
+            return False
+
+        if (not exception and types == FILTER_TYPE_OPTIONS - {'document'} and third_party is None
+                and include_domains is None and exclude_domains is None):
+            host = self.host_only_pattern(pattern)
+            if host:
+                self.filter_hosts.add(host)
+                return True
+
+        try:
+            regex = re.compile(self.pattern_to_regex(pattern), 0 if match_case else re.IGNORECASE)
+        except re.error:
+            return False
+
+        rule = FilterRule(line, regex, types, third_party, include_domains, exclude_domains)
+        if exception:
+            self.exception_rules.add(rule, self.pattern_tokens(pattern))
+            if 'document' in types:
+                self.has_document_exceptions = True
+        else:
+            self.block_rules.add(rule, self.pattern_tokens(pattern))
+        return True
+
+    @staticmethod
+    def host_only_pattern(pattern):
+        match = re.fullmatch(r'\|\|([a-z0-9.-]+)\^?', pattern, re.IGNORECASE)
+        return match.group(1) if match else None
+
+    @staticmethod
+    def pattern_to_regex(pattern):
+        if len(pattern) > 1 and pattern.startswith('/') and pattern.endswith('/'):
+            return pattern[1:-1]
+
+        regex = ''
+        if pattern.startswith('||'):
+            regex = r'^[a-z][a-z0-9.+-]*:/+(?:[^/?#]*\.)?'
+            pattern = pattern[2:]
+        elif pattern.startswith('|'):
+            regex = '^'
+            pattern = pattern[1:]
+
+        suffix = ''
+        if pattern.endswith('|'):
+            suffix = '$'
+            pattern = pattern[:-1]
+
+        for char in pattern:
+            if char == '*':
+                regex += '.*'
+            elif char == '^':
+                regex += r'(?:[^\w.%-]|$)'
+            else:
+                regex += re.escape(char)
+        return regex + suffix
+
+    @staticmethod
+    def pattern_tokens(pattern):
+        if len(pattern) > 1 and pattern.startswith('/') and pattern.endswith('/'):
+            return []
+
+        start_anchored = pattern.startswith('|')
+        end_anchored = pattern.endswith('|')
+        body = pattern.lstrip('|').rstrip('|').lower()
+
+        # A token can only be used as an index key if it cannot be part of a longer
+        # token in the URL, i.e. it is not next to a wildcard or an unanchored edge
+        tokens = []
+        for match in re.finditer(r'[a-z0-9]{2,}', body):
+            start, end = match.span()
+            if start == 0 and not start_anchored:
+                continue
+            if start > 0 and body[start - 1] == '*':
+                continue
+            if end == len(body) and not end_anchored:
+                continue
+            if end < len(body) and body[end] == '*':
+                continue
+            tokens.append(match.group())
+        return tokens
+
+    def host_verdict(self, host, first_party_host):
+        blocks_all = self.blocked_hosts.matches(host) or any(hosts.matches(host) for hosts in self.host_lists)
+        blocks_subresources = (blocks_all or self.filter_hosts.matches(host)
+                               or any(hosts.matches_filter(host) for hosts in self.host_lists))
+        third_party = bool(first_party_host) and registrable_domain(host) != registrable_domain(first_party_host)
+        document_allowed = False
+        if self.has_document_exceptions and first_party_host:
+            # "@@||site^$document" allowlists everything loaded by that site
+            document_url = f"https://{first_party_host}/"
+            document_tokens = set(re.findall(r'[a-z0-9]{2,}', document_url))
+            document_allowed = self.exception_rules.find(
+                document_url, document_tokens, first_party_host, 'document', False) is not None
+        return HostVerdict(blocks_all, blocks_subresources, third_party, document_allowed)
+
+    def should_block(self, url, host, first_party_host, resource_type, verdict=None):
+        if verdict is None:
+            verdict = self.host_verdict(host, first_party_host)
+        blocked = verdict.blocks_all or (resource_type != 'document' and verdict.blocks_subresources)
+
+        url_tokens = None
+        if not blocked and len(self.block_rules):
+            url_tokens = set(re.findall(r'[a-z0-9]{2,}', url.lower()))
+            blocked = self.block_rules.find(
+                url, url_tokens, first_party_host, resource_type, verdict.third_party) is not None
+        if not blocked:
+            return False
+
+        if verdict.document_allowed:
+            return False
+        if not len(self.exception_rules):
+            return True
+        if url_tokens is None:
+            url_tokens = set(re.findall(r'[a-z0-9]{2,}', url.lower()))
+        return self.exception_rules.find(
+            url, url_tokens, first_party_host, resource_type, verdict.third_party) is None
+
+class DecisionCache:
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+class InterceptorStats:
+    # Upper bounds in microseconds; the last bucket counts everything slower
+    LATENCY_BUCKETS_US = (10, 25, 50, 100, 250, 1000, 5000)
+
+    def __init__(self, max_sites=256):
+        # Only the interceptor thread writes these, so the UI can read them without locking
+        self.max_sites = max_sites
+        self.requests = 0
+        self.blocked = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.latency_histogram = [0] * (len(self.LATENCY_BUCKETS_US) + 1)
+        self.sites = {}
+
+    def record(self, first_party_host, blocked, elapsed_ns):
+        self.requests += 1
+        self.total_ns += elapsed_ns
+        if elapsed_ns > self.max_ns:
+            self.max_ns = elapsed_ns
+        self.latency_histogram[bisect.bisect_left(self.LATENCY_BUCKETS_US, elapsed_ns / 1000)] += 1
+
+        # Re-inserted on every request, so the dict stays in least recently seen order
+        # and the site evicted at the cap is the one not visited for longest
+        counts = self.sites.pop(first_party_host, None)
+        if counts is None:
+            counts = [0, 0]
+            if len(self.sites) >= self.max_sites:
+                del self.sites[next(iter(self.sites))]
+        self.sites[first_party_host] = counts
+        if blocked:
+            self.blocked += 1
+            counts[0] += 1
+        else:
+            counts[1] += 1
+
+    def snapshot(self):
+        sites = dict(self.sites)
+        requests = self.requests
+        return {
+            'requests': requests,
+            'blocked': self.blocked,
+            'mean_us': self.total_ns / requests / 1000 if requests else 0.0,
+            'max_us': self.max_ns / 1000,
+            'latency_histogram': list(zip(self.LATENCY_BUCKETS_US + (None,), self.latency_histogram)),
+            'sites': {site: {'blocked': counts[0], 'allowed': counts[1]} for site, counts in sites.items()},
         }
-        
-        # Connect signals
-        download.downloadProgress.connect(lambda received, total, d=download: 
-            self.update_progress(d, received, total))
-        download.finished.connect(lambda d=download: self.download_finished(d))
-        download.stateChanged.connect(lambda state, d=download: 
-            self.update_status(d, state))
-
-    def update_progress(self, download, received, total):
-        if download in self.downloads:
-            row = self.downloads[download]['row']
-            progress = self.downloads[download]['progress']
-            
-            # Update progress bar
-            progress.setMaximum(total)
-            progress.setValue(received)
-            
-            # Update size
-            size = self.format_size(total)
-            self.table.item(row, 1).setText(size)
-
-    def download_finished(self, download):
-        if download in self.downloads:
-            row = self.downloads[download]['row']
-            self.table.item(row, 3).setText("Completed")
-
-    def update_status(self, download, state):
-        if download in self.downloads:
-            row = self.downloads[download]['row']
-            status_map = {
-                0: "Starting",
-                1: "Downloading",
-                2: "Completed",
-                3: "Failed",
-                4: "Cancelled"
-            }
-            self.table.item(row, 3).setText(status_map.get(state, "Unknown"))
 
-    def clear_completed(self):
-        for row in range(self.table.rowCount() - 1, -1, -1):
-            if self.table.item(row, 3).text() == "Completed":
-                self.table.removeRow(row)
+class TrackerBlocker(QWebEngineUrlRequestInterceptor):
+    def __init__(self, tracker_list, filter_list_dir=None, cache_size=4096):
+        super().__init__()
+        self.tracker_list = list(dict.fromkeys(tracker_list))
+        self.engine = FilterEngine()
+        self.engine.add_hosts(self.tracker_list)
+        if filter_list_dir:
+            count = self.engine.load_directory(filter_list_dir)
+            print(f"Loaded {count} filter rules from {filter_list_dir}")
+        self.cache = DecisionCache(cache_size)
+        self.stats = InterceptorStats()
 
-    @staticmethod
-    def format_size(size):
-        for unit in ['B', 'KB', 'MB', 'GB']:
-            if size < 1024:
-                return f"{size:.1f} {unit}"
-            size /= 1024
-        return f"{size:.1f} TB"
-    
-class HistoryManager:
-    def __init__(self):
-        self.history_items = []
-        self.frequency_dict = defaultdict(int)
-        self.load_from_file()
+    def interceptRequest(self, info):
+        start = time.perf_counter_ns()
+        url = info.requestUrl()
+        host = url.host()
+        first_party_host = info.firstPartyUrl().host()
+        if url.scheme() in ('ws', 'wss'):
+            resource_type = 'websocket'
+        else:
+            resource_type = FILTER_RESOURCE_TYPES.get(info.resourceType(), 'other')
 
-    def add_item(self, url, title):
-        if not title:
-            title = url
-        self.history_items.append({
-            'url': url,
-            'title': title,
-            'timestamp': datetime.now().isoformat()
-        })
-        self.update_frequency(url)
-        self.update_frequency(title)
-        self.save_to_file()
+        key = (host, first_party_host)
+        verdict = self.cache.get(key)
+        if verdict is None:
+            verdict = self.engine.host_verdict(host, first_party_host)
+            self.cache.put(key, verdict)
+
+        blocked = self.engine.should_block(url.toString(), host, first_party_host, resource_type, verdict)
+        if blocked:
+            info.block(True)
+        self.stats.record(first_party_host, blocked, time.perf_counter_ns() - start)
 
-    def update_frequency(self, text):
-        words = re.findall(r'\b\w+\b', text)
-        for word in words:
-            self.frequency_dict[word.lower()] += 1
+PAGE_CACHE_BYTES = 64 * 1048576
+PAGE_CACHE_TTL = 3600
 
-    def get_items(self):
-        return sorted(self.history_items, key=lambda x: x['timestamp'], reverse=True)
+class PageCache:
+    def __init__(self, max_bytes=PAGE_CACHE_BYTES, ttl=PAGE_CACHE_TTL, level=6):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.level = level
+        # url -> content digest, kept in least recently used order
+        self.entries = OrderedDict()
+        # url -> stored_at in the order entries were written, so expiry only looks at the front
+        self.expiry = OrderedDict()
+        # digest -> [compressed html, number of urls sharing it]
+        self.blobs = {}
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
 
-    def get_display_text(self, url, title):
-        if "google.com/search" in url:
-            query = urllib.parse.parse_qs(urllib.parse.urlparse(url).query).get('q', [''])[0]
-            return f"Searched for: {query}" if query else "Google Search"
+    def __len__(self):
+        return len(self.entries)
 
-        if any(engine in url for engine in ["bing.com/search", "yahoo.com/search", "duckduckgo.com"]):
-            query = urllib.parse.parse_qs(urllib.parse.urlparse(url).query).get('q', [''])[0]
-            return f"Searched for: {query}" if query else "Web Search"
+    def __contains__(self, url):
+        return url in self.entries
 
-        if "youtube.com/watch" in url:
-            return f"Watched: {title}"
+    def put(self, url, html):
+        data = html.encode('utf-8')
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        self.discard(url)
+        blob = self.blobs.get(digest)
+        if blob is None:
+            compressed = zlib.compress(data, self.level)
+            if len(compressed) > self.max_bytes:
+                return
+            blob = self.blobs[digest] = [compressed, 0]
+            self.resident_bytes += len(compressed)
+        blob[1] += 1
+        now = time.monotonic()
+        self.entries[url] = digest
+        self.expiry[url] = now
+        self.expire(now)
+        while self.resident_bytes > self.max_bytes:
+            self.discard(next(iter(self.entries)))
 
-        if title == url:
-            domain = urllib.parse.urlparse(url).netloc
-            domain = re.sub(r'^www\.', '', domain)
-            return f"Visited {domain}"
+    def get(self, url):
+        self.expire(time.monotonic())
+        digest = self.entries.get(url)
+        if digest is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(url)
+        return zlib.decompress(self.blobs[digest][0]).decode('utf-8')
 
-        return title
+    def discard(self, url):
+        digest = self.entries.pop(url, None)
+        if digest is None:
+            return
+        del self.expiry[url]
+        blob = self.blobs[digest]
+        blob[1] -= 1
+        if blob[1] == 0:
+            del self.blobs[digest]
+            self.resident_bytes -= len(blob[0])
 
-    def save_to_file(self):
-        with open('browser_data.json', 'w') as file:
-            json.dump({'history': self.history_items, 'frequency': self.frequency_dict}, file)
+    def expire(self, now):
+        while self.expiry:
+            url, stored_at = next(iter(self.expiry.items()))
+            if now - stored_at < self.ttl:
+                break
+            self.discard(url)
 
-    def load_from_file(self):
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'blobs': len(self.blobs),
+            'resident_bytes': self.resident_bytes,
+            'hit_rate': self.hit_rate(),
+        }
+
+OFFLINE_STORE_DIR = 'page_store'
+OFFLINE_STORE_BYTES = 256 * 1048576
+OFFLINE_SCHEME = b'stratus-cache'
+
+def offline_url(url):
+    return f"{OFFLINE_SCHEME.decode()}:{urllib.parse.quote(url, safe='')}"
+
+class OfflineStore:
+    def __init__(self, directory=OFFLINE_STORE_DIR, max_bytes=OFFLINE_STORE_BYTES):
+        self.directory = directory
+        self.index_file = os.path.join(directory, 'index.json')
+        self.max_bytes = max_bytes
+        # url -> {'digest', 'title', 'size', 'stored', 'accessed'}; page bodies live in
+        # content-addressed files so identical snapshots share one object
+        self.index = self.load_index()
+        self.refs = Counter(entry['digest'] for entry in self.index.values())
+        self.sizes = {entry['digest']: entry['size'] for entry in self.index.values()}
+        self.total_bytes = sum(self.sizes.values())
+        self.lock = threading.Lock()
+        self.pending = OrderedDict()
+        self.condition = threading.Condition()
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, name='offline-store', daemon=True)
+        self.thread.start()
+
+    def load_index(self):
         try:
-            with open('browser_data.json', 'r') as file:
-                data = json.load(file)
-                self.history_items = data.get('history', [])
-                self.frequency_dict = defaultdict(int, data.get('frequency', {}))
+            with open(self.index_file, 'r') as file:
+                return json.load(file)
         except FileNotFoundError:
-            pass
+            return {}
+        except ValueError as e:
+            print(f"Error loading {self.index_file}: {e}")
+            return {}
 
-def get_styles():
-    return """
-    QMainWindow, QWidget {
-        background: #1a1a1a;
-        color: #fff;
-    }
-    QTabWidget::pane {
-        border: none;
-        background: #1a1a1a;
-        margin-top: -1px;
-    }
-    QTabWidget {
-        padding-top: 0px;
-        background: #1a1a1a;
-    }
-    QTabBar::tab {
-        background: rgba(255, 255, 255, 0.05);
-        color: #bbb;
-        padding: 8px 12px;
-        margin: 2px 1px 0px 1px;
-        border-radius: 4px 4px 0 0;
-        min-width: 50px;
-        max-width: 150px;
-    }
-    QTabBar::tab:selected {
-        background: rgba(255, 255, 255, 0.1);
-        color: #fff;
-        font-weight: bold;
-    }
-    QTabBar::tab:hover:!selected {
-        background: rgba(255, 255, 255, 0.07);
-        color: #ddd;
-    }
-    QPushButton {
-        background-color: transparent;
-        color: #fff;
-        padding: 0;
-        border-radius: 16px;
-        margin: 8px 4px;
-        min-width: 32px;
-        max-width: 32px;
-        min-height: 32px;
-        max-height: 32px;
-        font-size: 14px;
-        font-weight: 400;
-        line-height: 32px;
-    }
-    QPushButton:hover {
-        background-color: rgba(255, 255, 255, 0.1);
-    }
-    QPushButton:pressed {
-        background-color: rgba(255, 255, 255, 0.05);
-    }
-    QPushButton:disabled {
-        color: rgba(255, 255, 255, 0.3);
-    }
-    QLineEdit {
-        background-color: #2b2b2b;
-        color: #fff;
-        padding: 4px 10px;
-        border-radius: 6px;
-        border: 1px solid #222;
-        margin: 4px;
-        font-size: 13px;
-        selection-background-color: #0066cc;
-    }
-    QLineEdit:focus {
-        border: 1px solid #0066cc;
-        background-color: #333;
-    }
-    QLineEdit:hover {
-        background-color: #333;
-    }
-    """
+    def object_path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
 
-class TrackerBlocker(QWebEngineUrlRequestInterceptor):
-    def __init__(self, tracker_list):
-        super().__init__()
-        self.tracker_list = tracker_list
+    def __contains__(self, url):
+        with self.lock:
+            return url in self.index
 
-    def interceptRequest(self, info):
-        url = info.requestUrl().toString()
-        if any(tracker in url for tracker in self.tracker_list):
-            info.block(True)
+    def put(self, url, html, title=''):
+        with self.condition:
+            self.pending[url] = (html, title)
+            self.pending.move_to_end(url)
+            self.condition.notify()
+
+    def read(self, url):
+        with self.lock:
+            entry = self.index.get(url)
+            if entry is None:
+                return None
+            entry['accessed'] = time.time()
+            path = self.object_path(entry['digest'])
+        try:
+            with open(path, 'rb') as file:
+                return file.read()
+        except OSError as e:
+            print(f"Error reading offline copy of {url}: {e}")
+            return None
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopping:
+                    self.condition.wait()
+                if self.stopping and not self.pending:
+                    return
+                pending, self.pending = self.pending, OrderedDict()
+            try:
+                self.write_snapshots(pending)
+            except OSError as e:
+                print(f"Error saving offline pages: {e}")
+
+    def write_snapshots(self, pending):
+        for url, (page, title) in pending.items():
+            data = page.encode('utf-8')
+            digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+            path = self.object_path(digest)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path + '.tmp', 'wb') as file:
+                    file.write(data)
+                os.replace(path + '.tmp', path)
+            now = time.time()
+            with self.lock:
+                self.remove_entry(url)
+                self.index[url] = {'digest': digest, 'title': title, 'size': len(data),
+                                   'stored': now, 'accessed': now}
+                self.refs[digest] += 1
+                if digest not in self.sizes:
+                    self.sizes[digest] = len(data)
+                    self.total_bytes += len(data)
+        self.evict()
+        with self.lock:
+            index_text = json.dumps(self.index)
+        PersistenceService.write_atomic(self.index_file, index_text)
+
+    def remove_entry(self, url):
+        entry = self.index.pop(url, None)
+        if entry is None:
+            return None
+        digest = entry['digest']
+        self.refs[digest] -= 1
+        if self.refs[digest] > 0:
+            return None
+        del self.refs[digest]
+        self.total_bytes -= self.sizes.pop(digest, 0)
+        return digest
+
+    def evict(self):
+        with self.lock:
+            if self.total_bytes <= self.max_bytes:
+                return
+            orphans = []
+            for url in sorted(self.index, key=lambda url: self.index[url]['accessed']):
+                if self.total_bytes <= self.max_bytes:
+                    break
+                digest = self.remove_entry(url)
+                if digest is not None:
+                    orphans.append(digest)
+        for digest in orphans:
+            try:
+                os.remove(self.object_path(digest))
+            except OSError:
+                pass
+
+    def close(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        self.thread.join()
+
+def register_offline_scheme():
+    # Custom schemes have to be registered before the QApplication is created
+    scheme = QWebEngineUrlScheme(OFFLINE_SCHEME)
+    scheme.setSyntax(QWebEngineUrlScheme.Syntax.Path)
+    # Local, so web pages can't embed cached copies to learn what the user has visited
+    scheme.setFlags(QWebEngineUrlScheme.Flag.SecureScheme | QWebEngineUrlScheme.Flag.LocalScheme)
+    QWebEngineUrlScheme.registerScheme(scheme)
+
+def with_base_href(data, url):
+    # The copy is served from stratus-cache:, so relative links need the page's own URL
+    if re.search(rb'<base\b', data, re.IGNORECASE):
+        return data
+    tag = f'<base href="{html.escape(url)}">'.encode('utf-8')
+    head = re.search(rb'<head\b[^>]*>', data, re.IGNORECASE)
+    if head is None:
+        return tag + data
+    return data[:head.end()] + tag + data[head.end():]
+
+class OfflineSchemeHandler(QWebEngineUrlSchemeHandler):
+    def __init__(self, store, cache, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.cache = cache
+
+    def requestStarted(self, job):
+        if job.initiator().isValid():
+            # Only the browser itself opens cached copies; requests from page content are refused
+            job.fail(QWebEngineUrlRequestJob.Error.RequestDenied)
+            return
+        prefix = OFFLINE_SCHEME.decode() + ':'
+        url = urllib.parse.unquote(job.requestUrl().toString()[len(prefix):])
+        # Pages from this session are still in the memory cache; older ones come from disk
+        page = self.cache.get(url)
+        data = page.encode('utf-8') if page is not None else self.store.read(url)
+        if data is None:
+            job.fail(QWebEngineUrlRequestJob.Error.UrlNotFound)
+            return
+        buffer = QBuffer(job)
+        buffer.setData(QByteArray(with_base_href(data, url)))
+        job.reply(b'text/html', buffer)
+
+LAZY_TAB_RESTORE = True
+
+def icon_to_base64(icon):
+    if icon.isNull():
+        return None
+    buffer = QBuffer()
+    buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+    icon.pixmap(16, 16).save(buffer, "PNG")
+    return base64.b64encode(bytes(buffer.data())).decode('ascii')
+
+def icon_from_base64(data):
+    pixmap = QPixmap()
+    if not data or not pixmap.loadFromData(base64.b64decode(data)):
+        return None
+    return QIcon(pixmap)
 
 class CustomTabWidget(QTabWidget):
     def __init__(self):
         super().__init__()
 
-from PyQt6.QtCore import QStringListModel
 from PyQt6.QtWidgets import QCompleter
 
+class SuggestionModel(QAbstractListModel):
+    def __init__(self, suggestion_index, parent=None):
+        super().__init__(parent)
+        self.suggestion_index = suggestion_index
+        self.suggestions = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.suggestions)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if index.isValid() and role in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.EditRole):
+            return self.suggestions[index.row()]
+        return None
+
+    def set_prefix(self, prefix):
+        # Only the handful of rows the popup shows are ever materialized
+        self.beginResetModel()
+        self.suggestions = self.suggestion_index.complete(prefix) if prefix.strip() else []
+        self.endResetModel()
+
+NAVIGATION_SETTLE_MS = 500  # quiet time after the last URL/title change before a visit is recorded
+NAVIGATION_MAX_DELAY_MS = 5000
+
+NavigationVisit = namedtuple('NavigationVisit', ['url', 'title', 'visit_type', 'same_document'])
+
+class NavigationPipeline:
+    # Turns a tab's urlChanged/titleChanged/load signals into one visit per navigation:
+    # redirects resolve to the URL the load finishes on, pushState bursts on single-page
+    # apps collapse into their last URL, in-page anchors are not visits, and the visit
+    # is only committed once the page has been quiet long enough to have its own title
+    def __init__(self, commit, settle_ms=NAVIGATION_SETTLE_MS, max_delay_ms=NAVIGATION_MAX_DELAY_MS):
+        self.commit = commit
+        self.settle_ms = settle_ms
+        self.max_delay = max_delay_ms / 1000
+        self.browser = None
+        self.visit_type = 'link'
+        self.loading = False
+        self.pending_url = None
+        self.pending_since = None
+        self.same_document = False
+        self.committed_url = None
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.flush)
+
+    def attach(self, browser):
+        self.browser = browser
+        browser.urlChanged.connect(self.url_changed)
+        browser.titleChanged.connect(self.title_changed)
+        browser.loadStarted.connect(self.load_started)
+        browser.loadFinished.connect(self.load_finished)
+
+    def url_changed(self, url):
+        if not url.isValid() or url.scheme() in ('data', OFFLINE_SCHEME.decode()):
+            return
+        if not self.loading:
+            if (self.committed_url is not None and self.pending_url is None
+                    and url.adjusted(QUrl.UrlFormattingOption.RemoveFragment)
+                    == self.committed_url.adjusted(QUrl.UrlFormattingOption.RemoveFragment)):
+                return
+            self.same_document = True
+        if self.pending_url is None:
+            self.pending_since = time.monotonic()
+        self.pending_url = url
+        if not self.loading:
+            self.schedule()
+
+    def title_changed(self, title):
+        if self.pending_url is not None and not self.loading:
+            self.schedule()
+
+    def load_started(self):
+        self.loading = True
+        self.same_document = False
+        self.timer.stop()
+
+    def load_finished(self, success):
+        self.loading = False
+        if not success:
+            self.pending_url = None
+            self.timer.stop()
+        elif self.pending_url is not None:
+            self.schedule()
+
+    def schedule(self):
+        remaining = self.max_delay - (time.monotonic() - self.pending_since)
+        if remaining <= 0:
+            self.flush()
+        else:
+            self.timer.start(int(min(self.settle_ms, remaining * 1000)))
+
+    def flush(self):
+        self.timer.stop()
+        if self.pending_url is None or self.loading:
+            return
+        url, self.pending_url = self.pending_url, None
+        self.committed_url = url
+        visit = NavigationVisit(url.toString(), self.browser.title(), self.visit_type, self.same_document)
+        self.visit_type = 'link'
+        self.same_document = False
+        self.commit(visit)
+
 class BrowserTab(QWidget):
-    def __init__(self, history_manager, cache, browser_window, parent=None):
+    def __init__(self, history_manager, cache, browser_window, url=None, lazy=False, parent=None):
         super().__init__(parent)
         self.history_manager = history_manager
         self.cache = cache
         self.browser_window = browser_window
+        self.navigation = NavigationPipeline(self.commit_visit)
         self.layout = QVBoxLayout(self)
         self.layout.setSpacing(0)
         self.layout.setContentsMargins(0, 0, 0, 0)
 
-        self.browser = QWebEngineView()
-        self.browser.setUrl(QUrl("https://www.google.com"))
+        # Restored background tabs keep only their URL until they are first shown
+        self.browser = None
+        self.restore_url = url
 
         nav_container = QWidget()
+        nav_container.setObjectName("navBar")
         nav_container.setFixedHeight(48)
-        nav_container.setStyleSheet("""
-            QWidget {
-                background: #1a1a1a;
-                border-bottom: 1px solid rgba(255, 255, 255, 0.1);
-                border-radius: 12px;
-            }
-        """)
 
         self.url_bar = QLineEdit()
+        self.url_bar.setObjectName("urlBar")
         self.url_bar.setPlaceholderText("Search or enter address")
-        self.url_bar.setStyleSheet("""
-            QLineEdit {
-                background-color: #2b2b2b;
-                color: #fff;
-                padding: 4px 10px;
-                border-radius: 6px;
-                border: 1px solid #222;
-                margin: 4px;
-                font-size: 13px;
-                selection-background-color: #0066cc;
-            }
-            QLineEdit:focus {
-                border: 1px solid #0066cc;
-                background-color: #333;
-            }
-            QLineEdit:hover {
-                background-color: #333;
-            }
-            QLineEdit::placeholder {
-                color: rgba(255, 255, 255, 0.5);
-            }
-        """)
         self.url_bar.returnPressed.connect(self.load_url)
 
-        self.completer = QCompleter(self)
-        self.completer.setModel(QStringListModel())
-        self.url_bar.setCompleter(self.completer)
-
-        self.update_completer_model()
-
-        button_style = """
-            QPushButton {
-                background-color: transparent;
-                color: #fff;
-                padding: 0;
-                border-radius: 16px;
-                margin: 8px 4px;
-                min-width: 32px;
-                max-width: 32px;
-                min-height: 32px;
-                max-height: 32px;
-                font-size: 14px;
-                font-weight: 400;
-                line-height: 32px;
-            }
-            QPushButton:hover {
-                background-color: rgba(255, 255, 255, 0.1);
-            }
-            QPushButton:pressed {
-                background-color: rgba(255, 255, 255, 0.05);
-            }
-            QPushButton:disabled {
-                color: rgba(255, 255, 255, 0.3);
-            }
-        """
+        # The completer and its model are shared by every tab; QLineEdit re-targets
+        # the completer to whichever URL bar has focus
+        self.url_bar.textEdited.connect(self.browser_window.completer_model.set_prefix)
+        self.url_bar.setCompleter(self.browser_window.completer)
 
+        # Styled by object name from the window's stylesheet (see build_stylesheet)
         self.back_button = QPushButton("←")
-        self.back_button.setStyleSheet(button_style)
-        self.back_button.clicked.connect(self.browser.back)
+        self.back_button.setObjectName("navButton")
 
         self.forward_button = QPushButton("→")
-        self.forward_button.setStyleSheet(button_style)
-        self.forward_button.clicked.connect(self.browser.forward)
+        self.forward_button.setObjectName("navButton")
 
         self.reload_button = QPushButton("⟳")
-        self.reload_button.setStyleSheet(button_style)
-        self.reload_button.clicked.connect(self.browser.reload)
+        self.reload_button.setObjectName("navButton")
 
         self.new_tab_button = QPushButton("+")
-        self.new_tab_button.setStyleSheet("""
-            QPushButton {
-                background-color: transparent;
-                color: #fff;
-                padding: 5px;
-                border-radius: 15px;
-                margin: 0px 8px 0px 2px;
-                min-width: 30px;
-                max-width: 30px;
-                min-height: 28px;
-                max-height: 28px;
-                font-size: 18px;
-                font-weight: 400;
-                line-height: 1;
-            }
-            QPushButton:hover {
-                background-color: rgba(255, 255, 255, 0.1);
-            }
-            QPushButton:pressed {
-                background-color: rgba(255, 255, 255, 0.05);
-            }
-        """)
+        self.new_tab_button.setObjectName("newTabButton")
 
         self.new_tab_button.clicked.connect(self.browser_window.add_new_tab)
 
@@ -402,57 +3546,36 @@ class BrowserTab(QWidget):
         nav_layout.addWidget(self.new_tab_button)
 
         self.layout.addWidget(nav_container)
+
+        if lazy:
+            self.url_bar.setText(url or "")
+        else:
+            self.create_browser()
+
+    def create_browser(self):
+        self.browser = QWebEngineView()
+        self.browser.setUrl(QUrl(self.restore_url or "https://www.google.com"))
         self.layout.addWidget(self.browser)
 
+        self.back_button.clicked.connect(self.browser.back)
+        self.forward_button.clicked.connect(self.browser.forward)
+        self.reload_button.clicked.connect(self.browser.reload)
+
         self.browser.urlChanged.connect(self.update_url)
-        self.browser.urlChanged.connect(self.record_history)
+        self.navigation.attach(self.browser)
         self.browser.loadStarted.connect(lambda: self.reload_button.setText("✕"))
         self.browser.loadFinished.connect(lambda: self.reload_button.setText("⟳"))
         self.browser.loadFinished.connect(self.handle_load_finished)
         self.browser.loadFinished.connect(self.update_navigation_state)
         self.browser.iconChanged.connect(self.update_tab_icon)
+        self.browser.titleChanged.connect(lambda title: self.browser_window.update_tab_title(self, title))
 
         self.setup_shortcuts()
-        
-        # Add this line to setup the download handler
-        self.setup_download_handler()
-
-    def setup_download_handler(self):
-        self.browser.page().profile().downloadRequested.connect(self.handle_download)
-
-    def handle_download(self, download):
-        # Get default download path or ask user
-        default_path = QDir.homePath() + "/Downloads/" + download.suggestedFileName()
-        path, _ = QFileDialog.getSaveFileName(
-            self, "Save File", default_path, "All Files (*.*)"
-        )
-        
-        if path:
-            download.setPath(path)
-            download.accept()
-            
-            # Show download manager tab if not already visible
-            download_manager = None
-            for i in range(self.browser_window.tabs.count()):
-                if isinstance(self.browser_window.tabs.widget(i), DownloadManager):
-                    download_manager = self.browser_window.tabs.widget(i)
-                    self.browser_window.tabs.setCurrentIndex(i)
-                    break
-            
-            if not download_manager:
-                download_manager = DownloadManager()
-                index = self.browser_window.tabs.addTab(download_manager, "Downloads")
-                self.browser_window.tabs.setCurrentIndex(index)
-            
-            download_manager.start_download(download)
-
-    def update_completer_model(self):
-        # Populate the completer model with suggestions
-        suggestions = [item['url'] for item in self.history_manager.get_items()]
-        suggestions.extend(self.history_manager.frequency_dict.keys())
-        suggestions = sorted(suggestions, key=lambda x: self.history_manager.frequency_dict.get(x.lower(), 0), reverse=True)
-        model = QStringListModel(suggestions)
-        self.completer.setModel(model)
+
+    def current_url(self):
+        if self.browser is None:
+            return self.restore_url or ""
+        return self.browser.url().toString()
 
     def setup_shortcuts(self):
         reload_shortcut = QShortcut(QKeySequence("F5"), self)
@@ -467,14 +3590,18 @@ class BrowserTab(QWidget):
         self.forward_button.setEnabled(self.browser.history().canGoForward())
 
     def load_url(self):
+        self.navigation.visit_type = 'typed'
         url = self.url_bar.text().strip()
+        classifier = self.history_manager.classifier
+        keyword_url = classifier.keyword_search(url)
         if re.match(r"^(http://|https://|www\.)", url):
             self.browser.setUrl(QUrl(url))
+        elif keyword_url:
+            self.browser.setUrl(QUrl(keyword_url))
         elif re.match(r"\w+\.\w+", url):
             self.browser.setUrl(QUrl(f"https://{url}"))
         else:
-            search_url = f"https://www.google.com/search?q={url.replace(' ', '+')}"
-            self.browser.setUrl(QUrl(search_url))
+            self.browser.setUrl(QUrl(classifier.search_url(url)))
 
     def update_url(self, url):
         if url.toString() == "https://www.google.com/":
@@ -482,17 +3609,29 @@ class BrowserTab(QWidget):
         else:
             self.url_bar.setText(url.toString())
 
-    def record_history(self, url):
-        if url.isValid() and not url.toString().startswith("data:"):
-            self.history_manager.add_item(url.toString(), self.browser.title())
-            self.cache_page(url.toString())
-            self.update_completer_model()
+    def commit_visit(self, visit):
+        # The one place a finished navigation reaches history, suggestions and the page caches
+        self.history_manager.add_item(visit.url, visit.title, visit.visit_type)
+        # pushState and similar in-page changes keep the document the last snapshot came from
+        if not visit.same_document:
+            self.cache_page(visit)
 
-    def cache_page(self, url):
-        self.browser.page().toHtml(lambda html: self.cache.update({url: (html, datetime.now().isoformat())}))
+    def cache_page(self, visit):
+        if QUrl(visit.url).scheme() not in ('http', 'https'):
+            return
+        def store(html):
+            self.cache.put(visit.url, html)
+            self.browser_window.offline_store.put(visit.url, html, visit.title)
+        self.browser.page().toHtml(store)
 
     def handle_load_finished(self, success):
+        self.browser_window.startup_trace.load_finished()
         if not success:
+            url = self.browser.url().toString()
+            if url in self.cache or url in self.browser_window.offline_store:
+                # Show the last copy of the page rather than an error
+                self.browser.setUrl(QUrl(offline_url(url)))
+                return
             self.browser.setHtml("<h1 style='text-align: center; font-weight: bold;'>Failed to load page... I am sorry.</h1>")
 
     def update_tab_icon(self, icon):
@@ -500,6 +3639,98 @@ class BrowserTab(QWidget):
         if index >= 0:
             self.browser_window.tabs.setTabIcon(index, icon)
 
+HISTORY_PAGE_SIZE = 100
+
+class HistoryListModel(QAbstractListModel):
+    HeaderRole = Qt.ItemDataRole.UserRole + 1
+
+    def __init__(self, history_manager, page_size=HISTORY_PAGE_SIZE, parent=None):
+        super().__init__(parent)
+        self.history_manager = history_manager
+        self.page_size = page_size
+        self.filter_text = ""
+        self.reset_rows()
+
+    def reset_rows(self):
+        # Rows are ('header', day) or ('item', url, text, kind); only fetched pages are materialized
+        self.rows = []
+        self.offset = 0
+        self.exhausted = False
+        self.last_day = None
+        self.last_header = None
+
+    def set_filter(self, text):
+        self.beginResetModel()
+        self.filter_text = text.strip()
+        self.reset_rows()
+        self.endResetModel()
+        self.fetchMore(QModelIndex())
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and not self.exhausted
+
+    def fetchMore(self, parent):
+        if parent.isValid() or self.exhausted:
+            return
+        if self.filter_text:
+            items = self.history_manager.search(self.filter_text, self.page_size, self.offset)
+        else:
+            items = self.history_manager.get_items(self.page_size, self.offset)
+        self.offset += len(items)
+        self.exhausted = len(items) < self.page_size
+        rows = []
+        for item in items:
+            day = item['timestamp'][:10]
+            if day != self.last_day:
+                self.last_day = day
+                header = HistoryTab.get_day_header(datetime.fromisoformat(day))
+                if header != self.last_header:
+                    self.last_header = header
+                    rows.append(('header', header))
+            rows.append(('item', item['url'], item['display'], item['kind']))
+        if rows:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+            self.rows.extend(rows)
+            self.endInsertRows()
+
+    def url_at(self, index):
+        row = self.rows[index.row()]
+        return row[1] if row[0] == 'item' else None
+
+    def flags(self, index):
+        if index.isValid() and self.rows[index.row()][0] == 'header':
+            return Qt.ItemFlag.ItemIsEnabled
+        return super().flags(index)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self.rows[index.row()]
+        if role == self.HeaderRole:
+            return row[0] == 'header'
+        if row[0] == 'header':
+            if role == Qt.ItemDataRole.DisplayRole:
+                return row[1]
+            if role == Qt.ItemDataRole.FontRole:
+                font = QFont()
+                font.setBold(True)
+                font.setPointSizeF(font.pointSizeF() * 1.2)
+                return font
+            if role == Qt.ItemDataRole.ForegroundRole:
+                return QColor(THEME['history_header'])
+            return None
+        if role == Qt.ItemDataRole.DisplayRole:
+            icon = "🔍" if row[3] == 'search' else "🌐"
+            return f"{icon}  {row[2]}"
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return row[1]
+        if role == Qt.ItemDataRole.ForegroundRole:
+            return QColor(THEME['history_link'])
+        return None
+
 class HistoryTab(QWidget):
     def __init__(self, browser_window, history_manager, cache, parent=None):
         super().__init__(parent)
@@ -507,13 +3738,33 @@ class HistoryTab(QWidget):
         self.history_manager = history_manager
         self.cache = cache
         self.layout = QVBoxLayout(self)
+        self.layout.setContentsMargins(20, 12, 20, 0)
 
-        self.browser = QWebEngineView()
-        self.layout.addWidget(self.browser)
+        self.search_bar = QLineEdit()
+        self.search_bar.setPlaceholderText("Search history")
+        self.layout.addWidget(self.search_bar)
+
+        self.model = HistoryListModel(history_manager, parent=self)
+        self.list_view = QListView()
+        self.list_view.setModel(self.model)
+        self.list_view.setUniformItemSizes(True)
+        self.list_view.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
+        self.list_view.setObjectName("historyList")
+        self.list_view.activated.connect(self.open_item)
+        self.list_view.customContextMenuRequested.connect(self.show_context_menu)
+        self.layout.addWidget(self.list_view)
+
+        # Filtering runs in HistoryManager; wait for a pause in typing before querying
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(150)
+        self.search_timer.timeout.connect(lambda: self.model.set_filter(self.search_bar.text()))
+        self.search_bar.textChanged.connect(self.search_timer.start)
 
         self.display_history()
 
-    def get_day_header(self, date):
+    @staticmethod
+    def get_day_header(date):
         today = datetime.now().date()
         diff = (today - date.date()).days
 
@@ -529,150 +3780,203 @@ class HistoryTab(QWidget):
             return date.strftime('%B %Y')
 
     def display_history(self):
-        history_html = """
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <style>
-                body {
-                    font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, "Helvetica Neue", Arial, sans-serif;
-                    background-color: #2b2b2b;
-                    color: #ffffff;
-                    margin: 0;
-                    padding: 20px;
-                }
-                h1, h2 {
-                    color: #ffffff;
-                }
-                h1 {
-                    border-bottom: 1px solid #444;
-                    padding-bottom: 10px;
-                }
-                h2 {
-                    font-size: 1.2em;
-                    margin-top: 20px;
-                    color: #aaa;
-                    padding-bottom: 5px;
-                    border-bottom: 1px solid #444;
-                }
-                .history-item {
-                    padding: 12px;
-                    margin: 5px 0;
-                    border-radius: 4px;
-                    background-color: #333;
-                    transition: background-color 0.2s;
-                    display: flex;
-                    align-items: center;
-                }
-                .history-item:hover {
-                    background-color: #444;
-                }
-                .history-item a {
-                    color: #4a9eff;
-                    text-decoration: none;
-                    flex-grow: 1;
-                }
-                .history-item a:hover {
-                    text-decoration: underline;
-                }
-                .history-item .icon {
-                    margin-right: 12px;
-                    color: #888;
-                    font-size: 1.1em;
-                }
-                .search-query {
-                    color: #4a9eff;
-                }
-            </style>
-        </head>
-        <body>
-            <h1>Browsing History</h1>
-        """
-
-        current_day = None
-        for item in self.history_manager.get_items():
-            day = self.get_day_header(datetime.fromisoformat(item['timestamp']))
-
-            if day != current_day:
-                if current_day is not None:
-                    history_html += "</div>"
-                current_day = day
-                history_html += f"<h2>{day}</h2><div class='day-group'>"
-
-            display_text = self.history_manager.get_display_text(item['url'], item['title'])
-            icon = "🔍" if "Searched for:" in display_text else "🌐"
-
-            history_html += f"""
-            <div class="history-item">
-                <span class="icon">{icon}</span>
-                <a href="{item['url']}">{display_text}</a>
-            </div>
-            """
-
-        if current_day is not None:
-            history_html += "</div>"
-
-        history_html += """
-        </body>
-        </html>
-        """
-
-        self.browser.setHtml(history_html)
+        self.model.set_filter(self.search_bar.text())
+
+    def open_item(self, index):
+        url = self.model.url_at(index)
+        if url:
+            self.browser_window.add_new_tab(url)
+
+    def show_context_menu(self, position):
+        index = self.list_view.indexAt(position)
+        url = self.model.url_at(index) if index.isValid() else None
+        if not url:
+            return
+        menu = QMenu(self)
+        menu.addAction("Open in New Tab", lambda: self.browser_window.add_new_tab(url))
+        if url in self.cache or url in self.browser_window.offline_store:
+            menu.addAction("Open Cached Copy", lambda: self.browser_window.add_new_tab(offline_url(url)))
+        menu.exec(self.list_view.viewport().mapToGlobal(position))
 
 class CloseButtonTabBar(QTabBar):
     def __init__(self):
         super().__init__()
-        self.setStyleSheet("""
-            QTabBar {
-                background: #1a1a1a;
-            }
-            QTabBar::tab {
-                background: rgba(255, 255, 255, 0.05);
-                color: #bbb;
-                padding: 8px 12px;
-                margin: 4px 1px 0px 1px;
-                border-radius: 8px 8px 0 0;
-                min-width: 50px;
-                max-width: 150px;
-            }
-            QTabBar::tab:selected {
-                background: rgba(255, 255, 255, 0.1);
-                color: #fff;
-                font-weight: bold;
-            }
-            QTabBar::tab:hover:!selected {
-                background: rgba(255, 255, 255, 0.07);
-                color: #fff;
-            }
-            QTabBar::close-button {
-                image: none;
-                subcontrol-position: right;
-                subcontrol-origin: padding;
-                margin-right: 4px;
-            }
-            QTabBar::close-button::after {
-                content: "✕";
-                color: rgba(255, 255, 255, 0.5);
-                font-size: 16px;
-                font-weight: 400;
-                background: transparent;
-                border-radius: 10px;
-                padding: 2px 6px;
-            }
-            QTabBar::close-button:hover::after {
-                color: white;
-                background: rgba(255, 255, 255, 0.1);
-            }
-        """)
         self.setElideMode(Qt.TextElideMode.ElideRight)
 
+TAB_FREEZE_AFTER = 300  # seconds in the background before a tab is frozen
+TAB_DISCARD_AFTER = 1800
+TAB_MEMORY_BUDGET_MB = 1536
+TAB_LIFECYCLE_INTERVAL = 30
+
+LIFECYCLE_ORDER = [QWebEnginePage.LifecycleState.Active, QWebEnginePage.LifecycleState.Frozen,
+                   QWebEnginePage.LifecycleState.Discarded]
+
+def process_rss(pid):
+    try:
+        with open(f"/proc/{pid}/statm") as file:
+            return int(file.read().split()[1]) * mmap.PAGESIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+class TabLifecycleManager:
+    def __init__(self, tabs, memory_budget=TAB_MEMORY_BUDGET_MB * 1048576,
+                 freeze_after=TAB_FREEZE_AFTER, discard_after=TAB_DISCARD_AFTER):
+        self.tabs = tabs
+        self.memory_budget = memory_budget
+        self.freeze_after = freeze_after
+        self.discard_after = discard_after
+        self.last_active = {}
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.enforce)
+        self.timer.start(TAB_LIFECYCLE_INTERVAL * 1000)
+
+    def activate(self, tab):
+        self.last_active[tab] = time.monotonic()
+        if tab.browser is None:
+            return
+        page = tab.browser.page()
+        # Discarded pages reload themselves when set back to Active
+        if page.lifecycleState() != QWebEnginePage.LifecycleState.Active:
+            page.setLifecycleState(QWebEnginePage.LifecycleState.Active)
+
+    def forget(self, tab):
+        self.last_active.pop(tab, None)
+
+    def browser_tabs(self):
+        for index in range(self.tabs.count()):
+            tab = self.tabs.widget(index)
+            if isinstance(tab, BrowserTab) and tab.browser is not None:
+                yield tab
+
+    def background_tabs(self, now):
+        current = self.tabs.currentWidget()
+        tabs = [tab for tab in self.browser_tabs() if tab is not current]
+        for tab in tabs:
+            self.last_active.setdefault(tab, now)
+        return sorted(tabs, key=self.last_active.get)
+
+    def move_to(self, tab, state):
+        page = tab.browser.page()
+        # Never go further than Chromium allows, e.g. for pages playing audio
+        if LIFECYCLE_ORDER.index(page.recommendedState()) < LIFECYCLE_ORDER.index(state):
+            return False
+        if LIFECYCLE_ORDER.index(page.lifecycleState()) >= LIFECYCLE_ORDER.index(state):
+            return False
+        page.setLifecycleState(state)
+        return True
+
+    def memory_usage(self):
+        processes = defaultdict(list)
+        for tab in self.browser_tabs():
+            pid = tab.browser.page().renderProcessPid()
+            if pid > 0:
+                processes[pid].append(tab)
+        total = process_rss(os.getpid())
+        if total is None:
+            return None, {}
+        shares = {}
+        for pid, tabs in processes.items():
+            rss = process_rss(pid) or 0
+            total += rss
+            for tab in tabs:
+                shares[tab] = rss // len(tabs)
+        return total, shares
+
+    def enforce(self):
+        now = time.monotonic()
+        candidates = self.background_tabs(now)
+        for tab in candidates:
+            idle = now - self.last_active[tab]
+            if idle >= self.discard_after:
+                self.move_to(tab, QWebEnginePage.LifecycleState.Discarded)
+            elif idle >= self.freeze_after:
+                self.move_to(tab, QWebEnginePage.LifecycleState.Frozen)
+
+        total, shares = self.memory_usage()
+        if total is None:
+            return
+        for tab in candidates:
+            if total <= self.memory_budget:
+                break
+            if self.move_to(tab, QWebEnginePage.LifecycleState.Discarded):
+                total -= shares.get(tab, 0)
+                print(f"Discarded background tab {tab.current_url()} to stay under the memory budget")
+
+STARTUP_TRACE_FLAG = '--startup-trace'
+DEFERRED_STARTUP = True  # run non-critical startup work after the window's first paint
+
+class StartupTrace(QObject):
+    # Wall-clock phases from interpreter start to the first painted window and the
+    # first finished page load, printed once both are in when --startup-trace is given
+    def __init__(self, enabled=False, start=STARTUP_CLOCK):
+        super().__init__()
+        self.enabled = enabled
+        self.start = start
+        self.last = start
+        self.phases = []
+        self.after_paint = None
+        self.painted = False
+        self.loaded = False
+        self.reported = False
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last, now - self.start))
+        self.last = now
+
+    def elapsed(self, phase):
+        for name, duration, total in self.phases:
+            if name == phase:
+                return total
+        return None
+
+    def watch_paint(self, widget, after_paint):
+        self.after_paint = after_paint
+        widget.installEventFilter(self)
+
+    def eventFilter(self, watched, event):
+        if event.type() == QEvent.Type.Paint and not self.painted:
+            self.painted = True
+            watched.removeEventFilter(self)
+            self.mark('first paint')
+            if self.after_paint is not None:
+                # Queued so the paint itself completes before the deferred work starts
+                QTimer.singleShot(0, self.after_paint)
+        return False
+
+    def load_finished(self):
+        if not self.loaded:
+            self.loaded = True
+            self.mark('first loadFinished')
+            self.report()
+
+    def report(self):
+        if not self.enabled or self.reported:
+            return
+        self.reported = True
+        print(f"{'startup phase':<22} {'ms':>8} {'since start':>12}")
+        for phase, duration, total in self.phases:
+            print(f"{phase:<22} {duration * 1000:>8.1f} {total * 1000:>12.1f}")
+
 class StratusBrowser(QMainWindow):
-    def __init__(self):
+    def __init__(self, startup_trace=None):
         super().__init__()
+        self.startup_trace = startup_trace or StartupTrace()
+        # Tabs stay unloaded until the deferred start activates the current one
+        self.started = not DEFERRED_STARTUP
         self.setWindowTitle("Stratus Browser")
         self.setGeometry(100, 100, 1200, 800)
-        self.history_manager = HistoryManager()
-        self.cache = {}
+        self.persistence = PersistenceService()
+        if HISTORY_BACKEND == 'sqlite':
+            self.history_manager = SQLiteHistoryManager(self.persistence, build_index=False)
+        else:
+            self.history_manager = HistoryManager(self.persistence, build_index=False)
+        self.startup_trace.mark('history load')
+        self.completer_model = SuggestionModel(self.history_manager.suggestion_index, self)
+        self.completer = QCompleter(self.completer_model, self)
+        self.completer.setCompletionMode(QCompleter.CompletionMode.UnfilteredPopupCompletion)
+        self.cache = PageCache()
+        self.offline_store = OfflineStore()
 
         self.setStyleSheet(get_styles())
 
@@ -687,64 +3991,65 @@ class StratusBrowser(QMainWindow):
         self.tabs.tabCloseRequested.connect(self.close_tab)
         self.tabs.setDocumentMode(True)
         self.tabs.setMovable(True)
+        self.tab_lifecycle = TabLifecycleManager(self.tabs)
+        self.tabs.currentChanged.connect(self.tab_changed)
 
         main_layout.addWidget(self.tabs)
         self.setCentralWidget(main_container)
 
+        # The blocker goes in before any tab can start a request
+        self.tracker_list = DEFAULT_TRACKER_LIST
+
+        profile = QWebEngineProfile.defaultProfile()
+        self.tracker_blocker = TrackerBlocker(self.tracker_list, FILTER_LIST_DIR)
+        QWebEngineProfile.defaultProfile().setUrlRequestInterceptor(self.tracker_blocker)
+
+        self.offline_handler = OfflineSchemeHandler(self.offline_store, self.cache, self)
+        profile.installUrlSchemeHandler(OFFLINE_SCHEME, self.offline_handler)
+        self.startup_trace.mark('tracker blocker')
+
         self.load_tabs_from_file()
         if self.tabs.count() == 0:
-            self.add_new_tab()
+            self.add_new_tab(background=not self.started)
+        self.startup_trace.mark('tab restore')
 
         self.setup_shortcuts()
 
-        self.tracker_list = [
-    "google-analytics.com", "analytics.google.com", "googletagmanager.com",
-    "doubleclick.net", "googleadservices.com", "googlesyndication.com",
-    "facebook.com", "facebook.net", "fbcdn.net", "fbevents.com", "omtrdc.net",
-    "demdex.net", "twitter.com", "twimg.com", "t.co", "linkedin.com",
-    "licdn.com", "snap.licdn.com", "clarity.ms", "hotjar.com", "hotjar.io",
-    "mixpanel.com", "segment.com", "segment.io", "crazyegg.com", "hubspot.com",
-    "hs-analytics.net", "hs-scripts.com", "newrelic.com", "pinterest.com",
-    "pinimg.com", "yandex.ru", "mc.yandex.ru", "bat.bing.com", "scorecardresearch.com",
-    "quantserve.com", "chartbeat.com", "chartbeat.net", "outbrain.com", "taboola.com",
-    "addthis.com", "addthisedge.com", "disqus.com", "disquscdn.com", "optimizely.com",
-    "criteo.com", "criteo.net", "appnexus.com", "adnxs.com", "bluekai.com",
-    "sharethis.com", "matomo.cloud", "matomo.org", "amplitude.com", "api.amplitude.com",
-    "cdn.amplitude.com", "analytics.tiktok.com", "analytics-sg.tiktok.com",
-    "business-api.tiktok.com", "ads-api.tiktok.com", "pixel.facebook.com",
-    "an.facebook.com", "pixel-a.basis.net", "pixel-sync.sitescout.com",
-    "pixel.tapad.com", "pixel.advertising.com", "pixel.mathtag.com", "id5-sync.com",
-    "match.adsrvr.org", "secure.adnxs.com", "pixel.rubiconproject.com",
-    "analytics.yahoo.com", "sp.analytics.yahoo.com", "udc.yahoo.com",
-    "log.outbrain.com", "amplify.outbrain.com", "widgets.outbrain.com",
-    "snowplow.io", "collector.snowplow.io", "plausible.io", "collector.plausible.io",
-    "analytics.heap.io", "tracking.monsido.com", "cdn.mouseflow.com", "tools.mouseflow.com",
-    "stats.wp.com", "pixel.wp.com", "s.pinimg.com", "trk.pinterest.com",
-    "analytics.pinterest.com", "log.pinterest.com", "adservice.google.com",
-    "adservice.google.com.au", "googlesurvey.com", "moatads.com", "tapad.com",
-    "everesttech.net", "quantcast.com", "adsrvr.org", "advertising.com",
-    "adobedtm.com", "demdex.net", "adform.net", "openx.net", "adroll.com",
-    "exelator.com", "zqtk.net", "revcontent.com", "3lift.com", "bidswitch.net",
-    "adnuntius.com", "adscale.de", "mediamath.com", "admedo.com", "connexity.net",
-    "smartadserver.com", "spotxchange.com", "rubiconproject.com", "gumgum.com",
-    "yieldlab.net", "pubmatic.com", "simpli.fi", "adacado.com", "bidgear.com",
-    "bidr.trellian.com", "rtbhouse.com", "triplelift.com", "loopme.com",
-    "casalemedia.com", "eyeota.net", "adsymptotic.com", "adtech.de", "trustx.org",
-    "deepintent.com", "beeswax.com", "stackadapt.com", "districtm.io",
-    "adlightning.com", "brightmountainmedia.com", "yieldmo.com", "media.net",
-    "gumgum.com", "connatix.com", "teads.tv", "revtrax.com", "revx.io",
-    "neustar.biz", "dstillery.com", "intent.com", "fifty.io", "adloox.com",
-    "onead.io", "liftoff.io", "zedo.com", "exponential.com", "parsely.com",
-    "quantcast.com", "ezoic.com", "permutive.com", "zeotap.com"
-        ] 
+        self.downloads_tab = None
+        self.download_service = None
 
-        profile = QWebEngineProfile.defaultProfile()
-        interceptor = TrackerBlocker(self.tracker_list)
-        QWebEngineProfile.defaultProfile().setUrlRequestInterceptor(interceptor)
+        self.frecency_decay_timer = QTimer()
+        self.frecency_decay_timer.timeout.connect(self.history_manager.decay_frecency)
+        self.frecency_decay_timer.start(3600000)  # 1 hour
+
+        self.deferred_startup = deque([
+            ('activate tab', self.activate_current_tab),
+            ('download service', self.start_download_service),
+            ('history index', self.history_manager.build_suggestion_index),
+        ])
+        if DEFERRED_STARTUP:
+            self.startup_trace.watch_paint(self, self.run_deferred_startup)
+        else:
+            while self.deferred_startup:
+                self.run_deferred_startup()
+            self.startup_trace.watch_paint(self, None)
+        self.startup_trace.mark('window setup')
 
-        self.cache_cleanup_timer = QTimer()
-        self.cache_cleanup_timer.timeout.connect(self.cleanup_cache)
-        self.cache_cleanup_timer.start(3600000)  # 1 hour
+    def run_deferred_startup(self):
+        # One step per event loop pass, so input and paints get in between
+        phase, step = self.deferred_startup.popleft()
+        step()
+        self.startup_trace.mark(phase)
+        if self.deferred_startup and DEFERRED_STARTUP:
+            QTimer.singleShot(0, self.run_deferred_startup)
+
+    def activate_current_tab(self):
+        self.started = True
+        if self.tabs.count():
+            self.tab_changed(self.tabs.currentIndex())
+
+    def start_download_service(self):
+        self.download_service = DownloadService(QWebEngineProfile.defaultProfile(), self.persistence, self)
 
     def setup_shortcuts(self):
         new_tab_shortcut = QShortcut(QKeySequence("Ctrl+T"), self)
@@ -788,6 +4093,12 @@ class StratusBrowser(QMainWindow):
         index = self.tabs.addTab(history_tab, "History")
         self.tabs.setCurrentIndex(index)
 
+    def show_downloads(self):
+        if self.downloads_tab is None:
+            self.downloads_tab = DownloadManager(self.download_service)
+            self.tabs.addTab(self.downloads_tab, "Downloads")
+        self.tabs.setCurrentWidget(self.downloads_tab)
+
     def next_tab(self):
         current = self.tabs.currentIndex()
         if current < self.tabs.count() - 1:
@@ -807,101 +4118,131 @@ class StratusBrowser(QMainWindow):
         if isinstance(current_tab, BrowserTab):
             current_tab.browser.reload()
 
-    def add_new_tab(self, url=None):
-        new_tab = BrowserTab(self.history_manager, self.cache, self)
-        if url:
-            new_tab.browser.setUrl(QUrl(url))
-        index = self.tabs.addTab(new_tab, "New Tab")
-        self.tabs.setCurrentIndex(index)
-        new_tab.browser.titleChanged.connect(lambda title, tab=new_tab: self.update_tab_title(tab, title))
+    def add_new_tab(self, url=None, title=None, icon=None, background=False):
+        new_tab = BrowserTab(self.history_manager, self.cache, self, url or None, lazy=background)
+        index = self.tabs.addTab(new_tab, title or "New Tab")
+        if icon is not None:
+            self.tabs.setTabIcon(index, icon)
+        if not background:
+            self.tabs.setCurrentIndex(index)
+        return new_tab
 
     def close_tab(self, index):
         if self.tabs.count() > 1:
+            tab = self.tabs.widget(index)
+            if isinstance(tab, BrowserTab):
+                tab.navigation.flush()
+            if tab is self.downloads_tab:
+                self.downloads_tab = None
             self.tabs.removeTab(index)
+            self.tab_lifecycle.forget(tab)
+            # removeTab only reparents the widget; deleting it releases the renderer
+            tab.deleteLater()
 
     def update_tab_title(self, tab, title):
         index = self.tabs.indexOf(tab)
         if index >= 0:
             self.tabs.setTabText(index, title[:20] + "..." if len(title) > 20 else title)
 
-    def cleanup_cache(self):
-        current_time = datetime.now()
-        keys_to_remove = []
-
-        for key, (timestamp, _) in self.cache.items():
-            try:
-                if isinstance(timestamp, str):
-                    timestamp = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S.%f')
-                elif not isinstance(timestamp, datetime):
-                    continue
-
-                if current_time - timestamp > timedelta(hours=1):
-                    keys_to_remove.append(key)
-            except ValueError:
-                continue
-
-        for key in keys_to_remove:
-            del self.cache[key]
-
     def load_tab_content(self, index):
         tab = self.tabs.widget(index)
-        if isinstance(tab, BrowserTab) and not tab.browser.url().isValid():
+        if not isinstance(tab, BrowserTab):
+            return
+        if tab.browser is None:
+            tab.create_browser()
+        elif not tab.browser.url().isValid():
             tab.browser.setUrl(QUrl("https://www.google.com"))
 
     def tab_changed(self, index):
+        if not self.started:
+            return
         self.load_tab_content(index)
+        tab = self.tabs.widget(index)
+        if isinstance(tab, BrowserTab):
+            self.tab_lifecycle.activate(tab)
 
     def closeEvent(self, event):
+        stats = self.tracker_blocker.stats.snapshot()
+        print(f"Tracker blocker: blocked {stats['blocked']} of {stats['requests']} requests, "
+              f"mean {stats['mean_us']:.1f}us, max {stats['max_us']:.1f}us, "
+              f"decision cache hit rate {self.tracker_blocker.cache.hit_rate():.0%}")
+        top = sorted(stats['sites'].items(), key=lambda item: item[1]['blocked'], reverse=True)[:5]
+        if top and top[0][1]['blocked']:
+            print("Most blocked on: " + ", ".join(f"{site or '(none)'} {counts['blocked']}"
+                                                  for site, counts in top if counts['blocked']))
+        cache_stats = self.cache.stats()
+        print(f"Page cache: {cache_stats['entries']} pages in {cache_stats['blobs']} blobs, "
+              f"{cache_stats['resident_bytes'] / 1048576:.1f} MB resident, hit rate {cache_stats['hit_rate']:.0%}")
         print("Saving tabs to file...")
         self.save_tabs_to_file()
+        for tab in self.tab_lifecycle.browser_tabs():
+            tab.navigation.flush()
         self.history_manager.save_to_file()
+        if self.download_service is not None:
+            self.download_service.close()
+        self.persistence.close()
+        self.offline_store.close()
         event.accept()
 
     def save_tabs_to_file(self):
         tabs_data = []
+        current_tab = 0
         for index in range(self.tabs.count()):
             tab = self.tabs.widget(index)
             if isinstance(tab, BrowserTab):
+                if index == self.tabs.currentIndex():
+                    current_tab = len(tabs_data)
                 tabs_data.append({
-                    'url': tab.browser.url().toString(),
-                    'title': self.tabs.tabText(index)
+                    'url': tab.current_url(),
+                    'title': self.tabs.tabText(index),
+                    'icon': icon_to_base64(self.tabs.tabIcon(index))
                 })
-        with open('browser_data.json', 'w') as file:
-            json.dump({'tabs': tabs_data, 'history': self.history_manager.history_items, 'frequency': self.history_manager.frequency_dict}, file)
-        print(f"Tabs data saved: {tabs_data}")
+        self.persistence.update({'tabs': tabs_data, 'current_tab': current_tab})
+        print(f"Saved {len(tabs_data)} tabs")
 
     def load_tabs_from_file(self):
-        try:
-            with open('browser_data.json', 'r') as file:
-                data = json.load(file)
-                print(f"Loading tabs from file: {data.get('tabs', [])}")
-                for tab_data in data.get('tabs', []):
-                    self.add_new_tab(tab_data['url'])
-        except FileNotFoundError:
+        tabs_data = self.persistence.get('tabs')
+        if tabs_data is None:
             print("No saved tabs found.")
+            return
+        print(f"Loading {len(tabs_data)} tabs from file")
+        # Only the active tab gets a web view now; the rest are created when first selected
+        self.tabs.blockSignals(True)
+        try:
+            for tab_data in tabs_data:
+                self.add_new_tab(tab_data['url'], tab_data.get('title'), icon_from_base64(tab_data.get('icon')),
+                                 background=LAZY_TAB_RESTORE)
+            current_tab = self.persistence.get('current_tab', 0)
+            if 0 <= current_tab < self.tabs.count():
+                self.tabs.setCurrentIndex(current_tab)
         except Exception as e:
             print(f"Error loading tabs: {e}")
+        finally:
+            self.tabs.blockSignals(False)
+        if self.tabs.count():
+            self.tab_changed(self.tabs.currentIndex())
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--compile-blocklist":
+        if len(sys.argv) < 4:
+            print("Usage: main.py --compile-blocklist OUTPUT.bin LIST.txt [LIST.txt ...]")
+            sys.exit(1)
+        count = BinaryHostList.compile(sys.argv[3:], sys.argv[2])
+        print(f"Compiled {count} hosts into {sys.argv[2]}")
+        sys.exit(0)
+
+    startup_trace = StartupTrace(STARTUP_TRACE_FLAG in sys.argv)
+    startup_trace.mark('imports')
+    register_offline_scheme()
     app = QApplication(sys.argv)
 
-    dark_palette = QPalette()
-    dark_palette.setColor(QPalette.ColorRole.Window, QColor(26, 26, 26))
-    dark_palette.setColor(QPalette.ColorRole.WindowText, QColor(255, 255, 255))
-    dark_palette.setColor(QPalette.ColorRole.Base, QColor(26, 26, 26))
-    dark_palette.setColor(QPalette.ColorRole.AlternateBase, QColor(35, 35, 35))
-    dark_palette.setColor(QPalette.ColorRole.ToolTipBase, QColor(255, 255, 255))
-    dark_palette.setColor(QPalette.ColorRole.ToolTipText, QColor(255, 255, 255))
-    dark_palette.setColor(QPalette.ColorRole.Text, QColor(255, 255, 255))
-    dark_palette.setColor(QPalette.ColorRole.Button, QColor(35, 35, 35))
-    dark_palette.setColor(QPalette.ColorRole.ButtonText, QColor(255, 255, 255))
-    dark_palette.setColor(QPalette.ColorRole.Link, QColor(66, 133, 244))
-    dark_palette.setColor(QPalette.ColorRole.Highlight, QColor(66, 133, 244))
-    dark_palette.setColor(QPalette.ColorRole.HighlightedText, QColor(255, 255, 255))
-
-    app.setPalette(dark_palette)
-
-    window = StratusBrowser()
-    window.tabs.currentChanged.connect(window.tab_changed)
+    app.setPalette(build_palette(THEME))
+    startup_trace.mark('QApplication')
+
+    window = StratusBrowser(startup_trace)
     window.show()
-    sys.exit(app.exec())
\ No newline at end of file
+    startup_trace.mark('show')
+    status = app.exec()
+    # Pages that never finished loading still get their startup report
+    startup_trace.report()
+    sys.exit(status)
\ No newline at end of file